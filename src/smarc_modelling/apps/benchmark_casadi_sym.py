@@ -0,0 +1,147 @@
+#---------------------------------------------------------------------------------
+# INFO:
+# Benchmark of the MX and SX versions of the SAM_casadi export model. For both
+# it reports the time per evaluation of the dynamics and of their Jacobian
+# (what the IRK integrator of acados evaluates) in the CasADi virtual machine
+# and as generated C code compiled with -O3, the size and build time of the
+# generated code and the maximum deviation of SX from MX. The functions are mapped over all
+# states, so the Python call overhead is not part of the times.
+#
+# Usage: python benchmark_casadi_sym.py [--nmpc]
+# With --nmpc, the NMPC is also built with both models and the solver times of
+# tracking the dive of benchmark_nmpc.py are compared. This needs acados.
+#---------------------------------------------------------------------------------
+import sys
+import os
+# Add the src directory to the system path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+import subprocess
+import tempfile
+import time
+import numpy as np
+import casadi as ca
+from smarc_modelling.apps.benchmark_dynamics import random_states
+from smarc_modelling.vehicles.casadi_models import dynamics_function
+
+SYMBOLS = {"MX": ca.MX, "SX": ca.SX}
+
+
+def with_jacobian(x_dot, sym):
+    """
+    Function (x, u) -> (x_dot, d x_dot / d[x, u]) of the export model
+    """
+    x = sym.sym('x', x_dot.size1_in(0))
+    u = sym.sym('u', x_dot.size1_in(1))
+    f = x_dot(x, u)
+    return ca.Function('x_dot_jac', [x, u], [f, ca.jacobian(f, ca.vertcat(x, u))])
+
+
+def compile_function(fun, directory):
+    """
+    Generate C code for fun, compile it with -O3 and load it back as an external
+    function. Returns the function, the number of lines of the C code and the
+    build time in seconds.
+    """
+    start = time.perf_counter()
+    source = os.path.join(directory, fun.name() + ".c")
+    os.replace(fun.generate(fun.name() + ".c"), source)
+    library = os.path.join(directory, fun.name() + ".so")
+    subprocess.run(["gcc", "-O3", "-fPIC", "-shared", source, "-o", library], check=True)
+    build_time = time.perf_counter() - start
+    with open(source) as f:
+        lines = sum(1 for _ in f)
+
+    return ca.external(fun.name(), library), lines, build_time
+
+
+def time_per_call(fun, X, U, repeat=5):
+    """
+    Best-of-repeat time per evaluation in seconds, with fun mapped over all states
+    """
+    batch = fun.map(X.shape[0])
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        batch(X.T, U.T)
+        best = min(best, time.perf_counter() - start)
+
+    return best / X.shape[0]
+
+
+def run_benchmark(n=10000, dt=0.1):
+    """
+    Returns a dict sym -> {"<fun> <backend>": time per call in s, "lines" and
+    "build": lines of C code and build time in s of the Jacobian function,
+    "error": max. relative deviation from MX}
+    """
+    X, U = random_states(n)
+    X = X[:, :13]
+
+    results = {}
+    reference = None
+    with tempfile.TemporaryDirectory() as directory:
+        for name, sym in SYMBOLS.items():
+            x_dot = dynamics_function("SAM_casadi", export=True, sym=sym, dt=dt)
+            x_dot_jac = with_jacobian(x_dot, sym)
+
+            x_dot_c, _, _ = compile_function(x_dot, directory)
+            x_dot_jac_c, lines, build_time = compile_function(x_dot_jac, directory)
+
+            values = x_dot_c.map(n)(X.T, U.T).full()
+            if reference is None:
+                reference = values
+
+            results[name] = {
+                "x_dot vm": time_per_call(x_dot, X, U),
+                "x_dot c": time_per_call(x_dot_c, X, U),
+                "jacobian vm": time_per_call(x_dot_jac, X, U),
+                "jacobian c": time_per_call(x_dot_jac_c, X, U),
+                "lines": lines,
+                "build": build_time,
+                "error": np.max(np.abs(values - reference) / (1 + np.abs(reference))),
+            }
+
+    return results
+
+
+def run_nmpc_benchmark(Ts=0.1, N_horizon=16):
+    """
+    Solver times of tracking the dive with the NMPC built from either model.
+    Returns a dict sym -> TrackingLoop.timing()
+    """
+    # acados is only needed for this part
+    from smarc_modelling.apps.benchmark_nmpc import dive_trajectory
+    from smarc_modelling.control.control import NMPC
+    from smarc_modelling.control.tracking import TrackingLoop
+    from smarc_modelling.vehicles.SAM_casadi import SAM_casadi
+
+    trajectory = dive_trajectory(Ts)
+    results = {}
+    for name, sym in SYMBOLS.items():
+        ocp_solver, integrator = NMPC(SAM_casadi(dt=Ts), Ts, N_horizon, update_solver_settings=True, sym=sym).setup()
+        tracker = TrackingLoop(ocp_solver, integrator)
+        tracker.simulate(trajectory)
+        results[name] = tracker.timing()
+
+    return results
+
+
+def print_results(results):
+    columns = ["x_dot vm", "x_dot c", "jacobian vm", "jacobian c"]
+    print(f"{'sym':<5}" + "".join(f"{column + ' us':>16}" for column in columns) + f"{'C lines':>9}{'build s':>9}{'error':>11}")
+    for name, row in results.items():
+        print(f"{name:<5}" + "".join(f"{1e6 * row[column]:>16.2f}" for column in columns)
+              + f"{row['lines']:>9}{row['build']:>9.2f}{row['error']:>11.1e}")
+
+
+def print_nmpc_results(results):
+    print(f"{'sym':<5}{'solver ms: median':>19}{'p99':>9}{'max':>9}")
+    for name, stats in results.items():
+        print(f"{name:<5}{stats['solver']['median']:>19.3f}{stats['solver']['p99']:>9.3f}{stats['solver']['max']:>9.3f}")
+
+
+if __name__ == "__main__":
+    print_results(run_benchmark())
+    if "--nmpc" in sys.argv:
+        print_nmpc_results(run_nmpc_benchmark())
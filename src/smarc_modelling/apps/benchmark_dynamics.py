@@ -0,0 +1,135 @@
+#---------------------------------------------------------------------------------
+# INFO:
+# Benchmark of the different dynamics implementations. Evaluates the
+# reference SAM.dynamics, the vectorized SAM.dynamics_batch, the stateless
+# kernel in SAM_kernel and, if numba is installed, the compiled kernels for SAM
+# and BlueROV on the same random states. Checks that they agree with the
+# reference and reports the time per evaluation.
+#---------------------------------------------------------------------------------
+import sys
+import os
+# Add the src directory to the system path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+import time
+import numpy as np
+from smarc_modelling.lib.jit import jit_available
+from smarc_modelling.vehicles.SAM import SAM
+from smarc_modelling.vehicles.SAM_kernel import SAMKernel
+from smarc_modelling.vehicles.BlueROV import BlueROV
+
+
+def random_states(n, seed=0):
+    """
+    Draw n random states and control inputs within the actuator ranges.
+    """
+    rng = np.random.default_rng(seed)
+
+    X = np.zeros((n, 19))
+    X[:, 0:3] = rng.normal(size=(n, 3))
+    quat = rng.normal(size=(n, 4))
+    X[:, 3:7] = quat / np.linalg.norm(quat, axis=1, keepdims=True)
+    X[:, 7:13] = rng.normal(scale=[1, 0.2, 0.2, 0.5, 0.5, 0.5], size=(n, 6))
+    X[:, 13:15] = rng.uniform(0, 100, size=(n, 2))
+    X[:, 15:17] = rng.uniform(-0.12, 0.12, size=(n, 2))
+    X[:, 17:19] = rng.uniform(-1500, 1500, size=(n, 2))
+
+    U = np.zeros((n, 6))
+    U[:, 0:2] = rng.uniform(0, 100, size=(n, 2))
+    U[:, 2:4] = rng.uniform(-0.12, 0.12, size=(n, 2))
+    U[:, 4:6] = rng.uniform(-1500, 1500, size=(n, 2))
+
+    return X, U
+
+
+def time_per_call(fun, X, U, repeat=3):
+    """
+    Best-of-repeat time per state in seconds for fun(x, u) over all states.
+    """
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for i in range(X.shape[0]):
+            fun(X[i], U[i])
+        best = min(best, time.perf_counter() - start)
+
+    return best / X.shape[0]
+
+
+def max_rel_error(x_dot, x_dot_ref):
+    """
+    Max. deviation from the reference, relative to 1 + |reference|.
+    """
+    return np.max(np.abs(x_dot - x_dot_ref) / (1 + np.abs(x_dot_ref)))
+
+
+def run_benchmark(n=2000, dt=0.01):
+    """
+    Compare all dynamics implementations. Returns a dict with the time per
+    state evaluation (s) and the max. relative deviation from the reference.
+    """
+    X, U = random_states(n)
+
+    sam = SAM(dt)
+    kernel = SAMKernel(SAM(dt))
+
+    x_dot_ref = np.array([sam.dynamics(X[i], U[i]) for i in range(n)])
+
+    results = {}
+    results["reference"] = (time_per_call(sam.dynamics, X, U), 0.0)
+
+    x_dot = np.zeros(19)
+    x_dot_kernel = np.array([kernel.dynamics(X[i], U[i], out=x_dot).copy() for i in range(n)])
+    err = max_rel_error(x_dot_kernel, x_dot_ref)
+    results["kernel"] = (time_per_call(lambda x, u: kernel.dynamics(x, u, out=x_dot), X, U), err)
+
+    start = time.perf_counter()
+    x_dot_batch = sam.dynamics_batch(X, U)
+    t_batch = (time.perf_counter() - start) / n
+    results["batch"] = (t_batch, max_rel_error(x_dot_batch, x_dot_ref))
+
+    if jit_available():
+        kernel_jit = SAMKernel(SAM(dt), jit=True)
+        x_dot_jit = np.array([kernel_jit.dynamics(X[i], U[i], out=x_dot).copy() for i in range(n)])
+        err = max_rel_error(x_dot_jit, x_dot_ref)
+        results["kernel jit"] = (time_per_call(lambda x, u: kernel_jit.dynamics(x, u, out=x_dot), X, U), err)
+
+    return results
+
+
+def run_benchmark_bluerov(n=2000, dt=0.01):
+    """
+    Compare the reference BlueROV dynamics with the compiled kernel.
+    """
+    X, U = random_states(n)
+    X = X[:, 0:13]
+    U = np.random.default_rng(1).normal(scale=10, size=(n, 6))
+
+    brov = BlueROV(dt)
+    x_dot_ref = np.array([brov.dynamics(X[i], U[i]) for i in range(n)])
+
+    results = {}
+    results["reference"] = (time_per_call(brov.dynamics, X, U), 0.0)
+
+    if jit_available():
+        brov_jit = BlueROV(dt, use_jit=True)
+        x_dot_jit = np.array([brov_jit.dynamics(X[i], U[i]) for i in range(n)])
+        results["jit"] = (time_per_call(brov_jit.dynamics, X, U), max_rel_error(x_dot_jit, x_dot_ref))
+
+    return results
+
+
+def print_results(title, results):
+    t_ref = results["reference"][0]
+    print(title)
+    print(f"{'implementation':<16}{'us/eval':>10}{'speedup':>10}{'max rel err':>14}")
+    for name, (t, err) in results.items():
+        print(f"{name:<16}{t*1e6:>10.2f}{t_ref/t:>10.1f}{err:>14.2e}")
+
+
+if __name__ == "__main__":
+    if not jit_available():
+        print("numba is not installed, skipping the compiled kernels")
+
+    print_results("SAM", run_benchmark())
+    print_results("BlueROV", run_benchmark_bluerov())
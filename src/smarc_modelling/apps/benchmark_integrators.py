@@ -0,0 +1,79 @@
+#---------------------------------------------------------------------------------
+# INFO:
+# Accuracy vs. cost of the integration schemes in lib/integrators.py on SAM.
+# Simulates a turning maneuver with every scheme and step size / tolerance and
+# compares the trajectory against a tight-tolerance RK45 reference. Reports
+# the number of dynamics evaluations, the wall time and the errors.
+#---------------------------------------------------------------------------------
+import sys
+import os
+# Add the src directory to the system path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+import time
+import numpy as np
+from smarc_modelling.lib.jit import jit_available
+from smarc_modelling.lib.integrators import simulate
+from smarc_modelling.vehicles.SAM import SAM
+from smarc_modelling.vehicles.SAM_kernel import SAMKernel
+
+
+class CountedDynamics():
+    """
+    Wraps the dynamics and counts the evaluations
+    """
+    def __init__(self, fun):
+        self.fun = fun
+        self.n_eval = 0
+
+    def __call__(self, x, u):
+        self.n_eval += 1
+        return self.fun(x, u)
+
+
+def run_benchmark(t_end=10.0, dt_out=0.05):
+    """
+    Returns a list of (scheme, setting, n_eval, wall time (s), max position
+    error (m), max velocity error) on the output grid with spacing dt_out.
+    """
+    # Actuators start at the reference, so the actuator dynamics, which use
+    # the vehicle dt as time constant, stay at rest for all step sizes.
+    u = np.array([50, 50, np.deg2rad(5), -np.deg2rad(5), 1000, 1000])
+    x0 = np.zeros(19)
+    x0[3] = 1.0
+    x0[13:19] = u
+
+    kernel = SAMKernel(SAM(0.01), jit=jit_available())
+    n_out = int(round(t_end / dt_out)) + 1
+
+    X_ref = simulate(kernel.dynamics, x0, u, dt_out, n_out, method="rk45", rtol=1e-11, atol=1e-12)
+
+    settings = [("euler", dt) for dt in (0.001, 0.005, 0.01)] \
+             + [("rk4", dt) for dt in (0.01, 0.025, 0.05)] \
+             + [("rk45", tol) for tol in (1e-3, 1e-6, 1e-9)]
+
+    results = []
+    for method, setting in settings:
+        fun = CountedDynamics(kernel.dynamics)
+        start = time.perf_counter()
+        if method == "rk45":
+            X = simulate(fun, x0, u, dt_out, n_out, method=method, rtol=setting, atol=setting*1e-3)
+        else:
+            stride = int(round(dt_out / setting))
+            X = simulate(fun, x0, u, setting, (n_out - 1) * stride + 1, method=method)[::stride]
+        wall = time.perf_counter() - start
+
+        err_pos = np.max(np.linalg.norm(X[:, 0:3] - X_ref[:, 0:3], axis=1))
+        err_vel = np.max(np.abs(X[:, 7:13] - X_ref[:, 7:13]))
+        results.append((method, setting, fun.n_eval, wall, err_pos, err_vel))
+
+    return results
+
+
+if __name__ == "__main__":
+    if not jit_available():
+        print("numba is not installed, using the uncompiled SAM kernel")
+
+    print(f"{'scheme':<8}{'dt/tol':>10}{'n_eval':>10}{'wall [ms]':>12}{'pos err [m]':>14}{'vel err':>12}")
+    for method, setting, n_eval, wall, err_pos, err_vel in run_benchmark():
+        print(f"{method:<8}{setting:>10.3g}{n_eval:>10d}{wall*1e3:>12.1f}{err_pos:>14.2e}{err_vel:>12.2e}")
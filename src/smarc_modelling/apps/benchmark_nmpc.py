@@ -0,0 +1,103 @@
+#---------------------------------------------------------------------------------
+# INFO:
+# Benchmark of the NMPC tracking modes on the NMPC_sim scenarios: full SQP,
+# one real-time iteration per step (SQP_RTI) and SQP_RTI split into the
+# preparation and feedback phases. Reports the tracking RMSE and the input
+# latency, i.e. the time between the state estimate and the control output.
+# That is the whole step for SQP and SQP_RTI and only the feedback phase for
+# the split RTI.
+#
+# Usage: python benchmark_nmpc.py [trajectory.csv ...]
+# Without arguments, a dive with the numpy SAM model is used as reference.
+# The solvers are generated and built, this takes a while the first time.
+#---------------------------------------------------------------------------------
+import sys
+import os
+# Add the src directory to the system path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+import numpy as np
+from smarc_modelling.control.control import NMPC
+from smarc_modelling.control.tracking import TrackingLoop
+from smarc_modelling.lib.integrators import simulate
+from smarc_modelling.vehicles.SAM import SAM
+from smarc_modelling.vehicles.SAM_casadi import SAM_casadi
+
+# (name, nlp_solver_type, rti_phases)
+MODES = [
+    ("SQP", "SQP", False),
+    ("SQP_RTI", "SQP_RTI", False),
+    ("SQP_RTI split", "SQP_RTI", True),
+]
+
+
+def dive_trajectory(Ts=0.1, duration=10.0):
+    """
+    Reference trajectory sampled at Ts: SAM dives with some rudder and levels
+    out, simulated with the numpy model.
+    """
+    dt = 0.01
+    n_steps = int(round(duration / dt)) + 1
+    sam = SAM(dt)
+
+    x0 = np.zeros(19)
+    x0[3] = 1.0
+    x0[13] = 50
+    x0[14] = 50
+
+    u = np.zeros((n_steps-1, 6))
+    u[:, 0] = 50
+    u[:, 1] = 50
+    u[:, 2] = np.deg2rad(5)
+    u[:, 3] = -np.deg2rad(5)
+    u[:, 4] = 800
+    u[:, 5] = 800
+    u[n_steps//2:, 2] = 0
+
+    X = simulate(sam.dynamics, x0, u, dt, n_steps, update_dt=sam.update_dt)
+
+    return X[::int(round(Ts / dt))]
+
+
+def position_rmse(simX, trajectory):
+    return np.sqrt(np.mean(np.sum((simX[:-1, 0:3] - trajectory[:, 0:3])**2, axis=1)))
+
+
+def run_benchmark(trajectories, Ts=0.1, N_horizon=16):
+    """
+    Track all trajectories with every mode. Returns a dict mode -> (RMSEs,
+    input latencies in ms, timing() of the last trajectory).
+    """
+    results = {}
+    for name, nlp_solver_type, rti_phases in MODES:
+        nmpc = NMPC(SAM_casadi(dt=Ts), Ts, N_horizon, update_solver_settings=True,
+                    nlp_solver_type=nlp_solver_type)
+        ocp_solver, integrator = nmpc.setup()
+        tracker = TrackingLoop(ocp_solver, integrator, rti_phases=rti_phases)
+
+        rmse = []
+        latency = []
+        for trajectory in trajectories:
+            simX, simU, status = tracker.simulate(trajectory)
+            rmse.append(position_rmse(simX, trajectory))
+            latency += tracker.feedback_time if rti_phases else tracker.step_time
+
+        results[name] = (np.array(rmse), 1000 * np.array(latency), tracker.timing())
+
+    return results
+
+
+def print_results(results):
+    print(f"{'mode':<16}{'rmse (m)':>10}{'latency ms: median':>20}{'p99':>9}{'max':>9}")
+    for name, (rmse, latency, _) in results.items():
+        print(f"{name:<16}{np.mean(rmse):>10.4f}{np.median(latency):>20.3f}"
+              f"{np.percentile(latency, 99):>9.3f}{np.max(latency):>9.3f}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        trajectories = [np.loadtxt(path, delimiter=',', skiprows=1, ndmin=2) for path in sys.argv[1:]]
+    else:
+        trajectories = [dive_trajectory()]
+
+    print_results(run_benchmark(trajectories))
@@ -0,0 +1,51 @@
+#---------------------------------------------------------------------------------
+# INFO:
+# Precomputes the motion primitive library used by the A* planner, see
+# motion_planning/MotionPrimitives/PrimitiveLibrary.py. The library covers the
+# body states the search actually reaches: starting from SAM at rest, the
+# primitives of all the planner inputs are expanded for a few levels and the
+# grid cells of the reached nodes are simulated and saved to disk. Set
+# PRIMITIVE_LIBRARY in GlobalVariables.py to the output path to use it.
+#
+# Usage: python primitive_library.py [output path, default: primitive_library]
+#                                    [expanded levels, default: 1]
+# One level takes about 1 min and 700 MB, every further level about 3x more.
+#---------------------------------------------------------------------------------
+import sys
+import os
+# Add the src directory to the system path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+import time
+import numpy as np
+from smarc_modelling.motion_planning.MotionPrimitives.MotionPrimitives import SAM_PRIMITIVES, primitive_inputs
+from smarc_modelling.motion_planning.MotionPrimitives.PrimitiveLibrary import PrimitiveLibrary, grid_states, reached_states
+
+# Nodes of a level that are expanded further
+N_EXPANDED = 5
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else "primitive_library"
+    depth = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+
+    sim = SAM_PRIMITIVES()
+    inputs = primitive_inputs()
+    library = PrimitiveLibrary(sim, inputs)
+    rng = np.random.default_rng(0)
+
+    # Body states to precompute: the nodes of the first levels of a search from rest, where all the nodes of a level are
+    # precomputed and a random subset of them is expanded further
+    states = grid_states()
+    nodes = [states]
+    for level in range(depth):
+        states = reached_states(sim, states, inputs)
+        nodes.append(states)
+        states = states[rng.choice(len(states), min(N_EXPANDED, len(states)), replace=False)]
+
+    start = time.time()
+    library.build(np.concatenate(nodes))
+    print(f"Computed {len(library)} cells with {len(library.controls)} primitives each in {time.time() - start:.1f} s")
+
+    library.save(path)
+    print(f"Saved to {path}.npz and {path}.npy")
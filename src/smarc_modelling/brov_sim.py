@@ -4,6 +4,7 @@ from smarc_modelling.vehicles import *
 from smarc_modelling.lib import *
 from smarc_modelling.vehicles.BlueROV import BlueROV
 from smarc_modelling.vehicles.SAM import SAM
+from smarc_modelling.lib.integrators import rk4, simulate
 
 import matplotlib
 import matplotlib.pyplot as plt
@@ -45,16 +46,6 @@ class Sol():
         self.t = t
         self.y = data
 
-        
-def rk4(x, u, dt, fun):
-    k1 = fun(x, u)
-    k2 = fun(x+dt/2*k1, u)
-    k3 = fun(x+dt/2*k2, u)
-    k4 = fun(x+dt*k3, u)
-
-    x_t = x + dt/6 * (k1 + 2*k2 + 2*k3 + k4)
-
-    return x_t
 
 # FIXME: consider removing the dynamics wrapper and just call the dynamics straight away.
 def run_simulation(t_span, x0, dt, blueROV):
@@ -80,15 +71,12 @@ def run_simulation(t_span, x0, dt, blueROV):
     data[nx:,0] = u
 
     in_ENU = True
-    frame_message_printed = False
 
-    for i in range(n_sim-1):
-        if in_ENU is True:
-            if not frame_message_printed:
-                print("You provide x0 and u in ENU")
-                print("You get x and u in ENU")
-                frame_message_printed = True
+    if in_ENU is True:
+        print("You provide x0 and u in ENU")
+        print("You get x and u in ENU")
 
+        for i in range(n_sim-1):
             pos_ned, quat_ned= enu_to_ned(data[:3,i], data[3:7,i])
             u_NED = u_enu_to_ned(u)
 
@@ -100,13 +88,12 @@ def run_simulation(t_span, x0, dt, blueROV):
             data[3:7,i+1] = quat_enu
             data[7:nx,i+1] = x_new_NED[7:nx]
             data[nx:,i+1] = u
-        else:
-            if not frame_message_printed:
-                print("You provide x0 and u in NED (default)")
-                print("You get x and u in NED (default)")
-                frame_message_printed = True
-            data[:nx,i+1] = rk4(data[:nx,i], u, dt, blueROV.dynamics)
-            data[nx:,i+1] = u
+    else:
+        print("You provide x0 and u in NED (default)")
+        print("You get x and u in NED (default)")
+
+        data[:nx,:] = simulate(blueROV.dynamics, x0, u, dt, n_sim, method="rk4").T
+        data[nx:,:] = u[:, None]
     sol = Sol(t_eval,data)
     print(f" Simulation complete!")
 
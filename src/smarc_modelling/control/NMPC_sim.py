@@ -11,6 +11,7 @@ import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
 import numpy as np
 from smarc_modelling.control.control import *
+from smarc_modelling.control.tracking import TrackingLoop
 
 from smarc_modelling.vehicles import *
 from smarc_modelling.lib import plot
@@ -120,15 +121,11 @@ def main():
     # create ocp object to formulate the OCP
     Ts = 0.1           # Sampling time
     N_horizon = 16      # Prediction horizon
-    nmpc = NMPC_trajectory(sam, Ts, N_horizon, update_solver_settings=False)
-    nx = nmpc.nx        # State vector length + control vector
-    nu = nmpc.nu        # Control derivative vector length
-    nc = 1
-
+    nmpc = NMPC(sam, Ts, N_horizon, update_solver_settings=False)
 
     # Run the MPC setup
-    x0= np.zeros(19,)
-    ocp_solver, integrator = nmpc.setup(x0)
+    ocp_solver, integrator = nmpc.setup()
+    tracker = TrackingLoop(ocp_solver, integrator, budget=0.1)
 
     case = "medium"
     setting ="np28_"
@@ -137,82 +134,27 @@ def main():
         trajectory = read_csv_to_array(file_path)
         print(file_path)
 
-        trajectory = read_csv_to_array(file_path)
         # Declare duration of sim. and the x_axis in the plots
         Nsim = (trajectory.shape[0])            # The sim length should be equal to the number of waypoints
         x_axis = np.linspace(0, Ts*Nsim, Nsim)
 
-        simU = np.zeros((Nsim, nu))     # Matrix to store the optimal control derivative
-        simX = np.zeros((Nsim+1, nx))   # Matrix to store the simulated states
-
-        # Declare the initial state
-        x0 = trajectory[0] 
-        simX[0,:] = x0
-
-        # Augment the trajectory and control input reference 
-        Uref = np.zeros((trajectory.shape[0], nu))  # Derivative reference - set to 0 to penalize fast control changes
-        trajectory = np.concatenate((trajectory, Uref), axis=1) 
-
-
-
-        # Initialize the state and control vector as David does
-        for stage in range(N_horizon + 1):
-            ocp_solver.set(stage, "x", x0)
-        for stage in range(N_horizon):
-            ocp_solver.set(stage, "u", np.zeros(nu,))
-
-        # Array to store the time values
-        t = np.zeros((Nsim))
-
-        # closed loop - simulation
-        for i in range(Nsim):
-            # extract the sub-trajectory for the horizon
-            if i <= (Nsim - N_horizon):
-                ref = trajectory[i:i + N_horizon, :]
-            else:
-                ref = trajectory[i:, :]
-
-            # Update reference vector
-            # If the end of the trajectory has been reached, (ref.shape < N_horizon)
-            # set the following waypoints in the horizon to the last waypoint of the trajectory
-            for stage in range(N_horizon):
-                if ref.shape[0] < N_horizon and ref.shape[0] != 0:
-                    ocp_solver.set(stage, "p", ref[ref.shape[0]-1,:])
-                else:
-                    ocp_solver.set(stage, "p", ref[stage,:])
-
-            # Set the terminal state reference
-            ocp_solver.set(N_horizon, "yref", ref[-1,:nx])
-    
-            # Set current state
-            ocp_solver.set(0, "lbx", simX[i, :])
-            ocp_solver.set(0, "ubx", simX[i, :])
-
-            # solve ocp and get next control input
-            if i % nc == 0 and i < Nsim - (nc-1):
-                status = ocp_solver.solve()
-                #ocp_solver.print_statistics()
-                if status != 0:
-                    print(f" Note: acados_ocp_solver returned status: {status}")
-                    break
-
-                # simulate system
-                t[i] = ocp_solver.get_stats('time_tot')
-                for k in range(nc):
-                    simU[i+k, :] = ocp_solver.get(k, "u")
-            
+        # Measurement noise
+        std = 0.09
+        bias_set = str(int(std*1000))+"mm"
+        def noise(i):
             noise_vector = np.zeros(19)
-            std = 0.09
-            bias_set = str(int(std*1000))+"mm"
             #noise_vector[10:13] = np.random.normal(0, std, 3)
-            #print(f"noise_vector: {noise_vector}")
-            simX[i+1, :] = integrator.simulate(x=simX[i, :]+noise_vector, u=simU[i, :])
-        
+            return noise_vector
+
+        # closed loop - simulation, warm started with the shifted previous solution
+        # It stops at the first failed solve, as the loop before TrackingLoop did
+        simX, simU, status = tracker.simulate(trajectory, noise=noise, stop_on_failure=True)
+        Nsim = simU.shape[0]
+        trajectory = trajectory[:Nsim]
+        x_axis = x_axis[:Nsim]
 
         # evaluate timings
-        t *= 1000  # scale to milliseconds
-        #print(f'Computation time in ms:\n min: {np.min(t):.3f}\nmax: {np.max(t):.3f}\navg: {np.average(t):.3f}\nstdev: {np.std(t)}\nmedian: {np.median(t):.3f}')
-        print(f"median: {np.median(t):.3f}")
+        tracker.print_timing()
 
         # plot results
         # print(f"x_axis: {x_axis.shape}")
@@ -223,9 +165,10 @@ def main():
         # Extract the optimal control sequence
         #optimal_u = simX[:, 13:]
         #save_csv(simX,t, j, bias_set)
+        Uref = np.zeros((trajectory.shape[0], tracker.nu))
+        trajectory = np.concatenate((trajectory, Uref), axis=1)
         rmse(simX[:-1], trajectory)
         plot.plot_function(x_axis, trajectory, simX[:-1], simU)
-        #ocp_solver = None
 
 
 if __name__ == '__main__':
@@ -0,0 +1,200 @@
+# Batch evaluation of the acados NMPC on many reference trajectories
+#
+# The solver is generated and compiled once, then every worker process loads
+# its own instance of it and tracks its share of the trajectories:
+#
+#     results = run_batch(trajectories, weights=[{"Q": Q1, "R": R1}, {"Q": Q2, "R": R2}])
+#     print_summary(results)
+#
+# Every (trajectory, weight set) pair is one job. The weights are set at
+# runtime with cost_set, so tuning Q and R does not need a rebuild.
+import multiprocessing
+import time
+import numpy as np
+
+from smarc_modelling.control.control import NMPC
+from smarc_modelling.control.tracking import TrackingLoop
+from smarc_modelling.lib.integrators import simulate
+from smarc_modelling.vehicles.SAM import SAM
+from smarc_modelling.vehicles.SAM_casadi import SAM_casadi
+
+# Columns of the results
+RESULT_DTYPE = np.dtype([("trajectory", int), ("weights", int), ("rmse", float), ("rmse_xyz", float, (3,)),
+                         ("median_ms", float), ("p99_ms", float), ("max_ms", float), ("over_budget", int),
+                         ("failed", int), ("steps", int), ("wall_time", float)])
+
+
+def load_trajectories(paths):
+    '''
+    Reference trajectories from CSV files with a header line, one state per row
+    '''
+    return [np.loadtxt(path, delimiter=',', skiprows=1, ndmin=2) for path in paths]
+
+
+def primitive_trajectories(inputs, x0=None, Ts=0.1, duration=3.0):
+    '''
+    Reference trajectories from motion primitives: SAM starting in x0 with every
+    constant control input in inputs ((K, 6) array), simulated with the numpy
+    model in one batch and sampled at Ts.
+    '''
+    dt = 0.01
+    inputs = np.atleast_2d(np.asarray(inputs, dtype=float))
+    if x0 is None:
+        x0 = np.zeros(19)
+        x0[3] = 1.0
+        x0[13] = 50
+        x0[14] = 50
+
+    sam = SAM(dt)
+    n_steps = int(round(duration / dt)) + 1
+    X0 = np.tile(x0, (inputs.shape[0], 1))
+    X = simulate(sam.dynamics_batch, X0, inputs, dt, n_steps, update_dt=sam.update_dt, per_step=False)
+
+    return list(np.swapaxes(X[::int(round(Ts / dt))], 0, 1))
+
+
+def weight_matrices(weights, nx, nu):
+    '''
+    The path and terminal weight matrices W = diag(Q, R) and W_e = diag(Q) of a
+    weight set {"Q": (nx,), "R": (nu,)}, the cost structure of NMPC.setup()
+    '''
+    Q = np.asarray(weights["Q"], dtype=float).reshape(nx)
+    R = np.asarray(weights["R"], dtype=float).reshape(nu)
+    return np.diag(np.concatenate((Q, R))), np.diag(Q)
+
+#------------------------------------------------------------------------------
+# Workers. Each process loads its own solver instance once, in _init_worker.
+
+_worker = {}
+
+
+def _make_nmpc(config, build):
+    return NMPC(SAM_casadi(dt=config["Ts"]), config["Ts"], config["N_horizon"], update_solver_settings=build,
+                nlp_solver_type=config["nlp_solver_type"])
+
+
+def _init_worker(config):
+    ocp_solver, integrator = _make_nmpc(config, build=False).setup()
+    _worker["config"] = config
+    _worker["tracker"] = TrackingLoop(ocp_solver, integrator, budget=config["budget"],
+                                      rti_phases=config["rti_phases"])
+
+
+def _run_one(job):
+    config = _worker["config"]
+    tracker = _worker["tracker"]
+    solver = tracker.solver
+    i_trajectory, i_weights = job
+    start = time.perf_counter()
+
+    if config["weights"] is not None:
+        W, W_e = weight_matrices(config["weights"][i_weights], tracker.nx, tracker.nu)
+        for stage in range(tracker.N):
+            solver.cost_set(stage, "W", W)
+        solver.cost_set(tracker.N, "W", W_e)
+
+    trajectory = config["trajectories"][i_trajectory]
+    simX, simU, status = tracker.simulate(trajectory)
+
+    # Input latency: the feedback phase with the split RTI, otherwise the whole step
+    latency = 1000 * np.array(tracker.feedback_time if tracker.rti_phases else tracker.step_time)
+    error = simX[:-1, 0:3] - trajectory[:, 0:3]
+    stats = tracker.timing()
+
+    row = np.zeros(1, dtype=RESULT_DTYPE)[0]
+    row["trajectory"] = i_trajectory
+    row["weights"] = i_weights
+    row["rmse"] = np.sqrt(np.mean(np.sum(error**2, axis=1)))
+    row["rmse_xyz"] = np.sqrt(np.mean(error**2, axis=0))
+    row["median_ms"] = np.median(latency)
+    row["p99_ms"] = np.percentile(latency, 99)
+    row["max_ms"] = np.max(latency)
+    row["over_budget"] = stats["over_budget"]
+    row["failed"] = stats["failed"]
+    row["steps"] = stats["steps"]
+    row["wall_time"] = time.perf_counter() - start
+
+    return row
+
+#------------------------------------------------------------------------------
+
+def run_batch(trajectories, Ts=0.1, N_horizon=16, weights=None, nlp_solver_type='SQP_RTI', rti_phases=False,
+              budget=0.1, n_workers=None, build=True, verbose=True):
+    '''
+    Track every trajectory with every weight set in a process pool.
+
+    :param trajectories: list of (Nsim, nx) reference trajectories, see load_trajectories() and primitive_trajectories()
+    :param Ts, N_horizon, nlp_solver_type: NMPC settings
+    :param weights: optional list of weight sets {"Q": (nx,), "R": (nu,)}, see weight_matrices(). None uses the
+                    weights compiled into the solver.
+    :param rti_phases, budget: TrackingLoop settings
+    :param n_workers: number of processes, defaults to the number of CPUs
+    :param build: generate and build the solver once before starting the workers, otherwise the existing one is loaded
+    :return: structured array with one row per (trajectory, weight set), see RESULT_DTYPE
+    '''
+    if build:
+        _make_nmpc({"Ts": Ts, "N_horizon": N_horizon, "nlp_solver_type": nlp_solver_type}, build=True).setup()
+
+    config = {
+        "Ts": Ts,
+        "N_horizon": N_horizon,
+        "nlp_solver_type": nlp_solver_type,
+        "rti_phases": rti_phases,
+        "budget": budget,
+        "weights": weights,
+        "trajectories": [np.asarray(trajectory, dtype=float) for trajectory in trajectories],
+    }
+    n_weights = 1 if weights is None else len(weights)
+    jobs = [(i, j) for j in range(n_weights) for i in range(len(trajectories))]
+
+    results = np.zeros(len(jobs), dtype=RESULT_DTYPE)
+    start = time.perf_counter()
+    with multiprocessing.Pool(n_workers, initializer=_init_worker, initargs=(config,)) as pool:
+        for n_done, row in enumerate(pool.imap_unordered(_run_one, jobs), 1):
+            results[n_done - 1] = row
+            if verbose and (n_done % max(1, len(jobs) // 10) == 0 or n_done == len(jobs)):
+                print(f" {n_done}/{len(jobs)} runs, {time.perf_counter() - start:.1f} s")
+
+    return np.sort(results, order=["weights", "trajectory"])
+
+
+def summary(results):
+    '''
+    Aggregate the results per weight set: mean and max RMSE, median and worst latency, steps over budget and failures
+    '''
+    rows = []
+    for j in np.unique(results["weights"]):
+        r = results[results["weights"] == j]
+        rows.append({"weights": int(j), "runs": len(r), "rmse_mean": float(np.mean(r["rmse"])),
+                     "rmse_max": float(np.max(r["rmse"])), "median_ms": float(np.median(r["median_ms"])),
+                     "p99_ms": float(np.max(r["p99_ms"])), "max_ms": float(np.max(r["max_ms"])),
+                     "over_budget": int(np.sum(r["over_budget"])), "failed": int(np.sum(r["failed"]))})
+    return rows
+
+
+def print_summary(results):
+    print(f"{'weights':<9}{'runs':>6}{'rmse mean':>11}{'rmse max':>10}{'median ms':>11}{'p99 ms':>9}{'max ms':>9}"
+          f"{'over budget':>13}{'failed':>8}")
+    for row in summary(results):
+        print(f"{row['weights']:<9}{row['runs']:>6}{row['rmse_mean']:>11.4f}{row['rmse_max']:>10.4f}"
+              f"{row['median_ms']:>11.3f}{row['p99_ms']:>9.3f}{row['max_ms']:>9.3f}{row['over_budget']:>13}"
+              f"{row['failed']:>8}")
+
+
+if __name__ == '__main__':
+    import sys
+
+    if len(sys.argv) > 1:
+        trajectories = load_trajectories(sys.argv[1:])
+    else:
+        # Primitives with a few rudder, stern and rpm combinations
+        ds, dr, rpm = np.meshgrid(np.deg2rad([-5, 0, 5]), np.deg2rad([-5, 0, 5]), [400, 800])
+        inputs = np.zeros((ds.size, 6))
+        inputs[:, 0:2] = 50
+        inputs[:, 2] = ds.ravel()
+        inputs[:, 3] = dr.ravel()
+        inputs[:, 4] = rpm.ravel()
+        inputs[:, 5] = rpm.ravel()
+        trajectories = primitive_trajectories(inputs)
+
+    print_summary(run_batch(trajectories))
@@ -1,5 +1,6 @@
 # Script for the acados NMPC model
 from acados_template import AcadosOcp, AcadosOcpSolver, AcadosSimSolver, AcadosModel, AcadosSim
+from smarc_modelling.vehicles.casadi_models import vehicle_dynamics
 import numpy as np
 import casadi as ca
 import os
@@ -7,13 +8,17 @@ import os
 
 #The original NMPC class. Uses hard constraints.
 class NMPC:
-    def __init__(self, casadi_model, Ts, N_horizon, update_solver_settings):
+    def __init__(self, casadi_model, Ts, N_horizon, update_solver_settings, nlp_solver_type='SQP_RTI', sym=ca.MX):
         '''
         :param casadi_model: The casadi model to be used
         :param Ts: Sampling interval
         :param N_horizon: Control horizon
         :param update_solver_settings: If True, the solver will be updated with the new settings.
+        :param nlp_solver_type: 'SQP_RTI' for one real-time iteration per step, see TrackingLoop,
+                                or 'SQP' to iterate until convergence
+        :param sym: Symbol type of the exported model, ca.MX or ca.SX. SX gives faster generated code for SAM.
         '''
+        self.sym   = sym
         self.ocp   = AcadosOcp()
         self.model = self.export_dynamics_model(casadi_model)
         self.ocp.model = self.model
@@ -23,15 +28,17 @@ class NMPC:
         self.Tf    = Ts*N_horizon
         self.N_horizon = N_horizon
         self.update_solver = update_solver_settings
+        self.nlp_solver_type = nlp_solver_type
         
-    # Function to create a Acados model from the casadi model
+    # Function to create a Acados model from the casadi model. For SAM_casadi and SAM_LQR only the parameters of
+    # casadi_models.model_parameters() are taken from casadi_model, other changed attributes are not exported.
     def export_dynamics_model(self, casadi_model):
         # Create symbolic state and control variables
-        x_sym     = ca.MX.sym('x', 19,1)
-        u_ref_sym = ca.MX.sym('u_ref', 6,1)
+        x_sym     = self.sym.sym('x', 19,1)
+        u_ref_sym = self.sym.sym('u_ref', 6,1)
 
         # Create symbolic derivative
-        x_dot_sym = ca.MX.sym('x_dot', 19, 1)
+        x_dot_sym = self.sym.sym('x_dot', 19, 1)
         
         # Set up acados model
         model = AcadosModel()
@@ -41,7 +48,7 @@ class NMPC:
         model.u    = u_ref_sym
 
         # Declaration of explicit and implicit expressions
-        x_dot  = casadi_model.dynamics(export=True)    # extract casadi.MX function
+        x_dot  = vehicle_dynamics(casadi_model, export=True, sym=self.sym)    # casadi function, built once per parameter set
         f_expl = ca.vertcat(x_dot(x_sym[:13], x_sym[13:]), u_ref_sym)
         f_impl = x_dot_sym - f_expl
         model.f_expl_expr = f_expl
@@ -78,7 +85,7 @@ class NMPC:
         R = np.diag(R_diag)*1e-3
 
         # Stage costs
-        self.model.p = ca.MX.sym('ref_param', nx+nu,1)
+        self.model.p = self.sym.sym('ref_param', nx+nu,1)
         self.ocp.parameter_values = np.zeros((nx+nu,))
 
         self.ocp.cost.yref  = np.zeros((nx+nu,))        # Init ref point. The true references are declared in the controller for-loop
@@ -130,8 +137,11 @@ class NMPC:
         self.ocp.solver_options.integrator_type = 'IRK'
         self.ocp.solver_options.sim_method_newton_iter = 2 #3 default
 
-        self.ocp.solver_options.nlp_solver_type = 'SQP_RTI'
-        self.ocp.solver_options.nlp_solver_max_iter = 1 #80
+        self.ocp.solver_options.nlp_solver_type = self.nlp_solver_type
+        if self.nlp_solver_type == 'SQP_RTI':
+            self.ocp.solver_options.nlp_solver_max_iter = 1
+        else:
+            self.ocp.solver_options.nlp_solver_max_iter = 80
         self.ocp.solver_options.tol    = 1e-6       # NLP tolerance. 1e-6 is default for tolerances
         self.ocp.solver_options.qp_tol = 1e-6       # QP tolerance
 
@@ -140,8 +150,13 @@ class NMPC:
 
 
         # Define the folder path for the .json and c_generated code inside the home directory
+        # The solvers of the other NLP solver types and of the SX model are kept next to the RTI one
         home_dir = os.path.expanduser("~")
         save_dir = os.path.join(home_dir, "acados_generated_code")
+        if self.nlp_solver_type != 'SQP_RTI':
+            save_dir += '_' + self.nlp_solver_type.lower()
+        if self.sym is ca.SX:
+            save_dir += '_sx'
         self.ocp.code_export_directory = save_dir
 
         # Make sure the directory exists
@@ -159,7 +174,6 @@ class NMPC:
             acados_integrator = AcadosSimSolver(self.ocp, json_file = solver_json)
 
         return acados_ocp_solver, acados_integrator
-    
 
     def x_error(self, x, u, ref, terminal):
         """
@@ -0,0 +1,320 @@
+# Gain-scheduled LQR for SAM
+#
+# The LQR gains of the SAM_LQR model are computed offline on a grid of operating points and interpolated at runtime:
+#
+#     table = build_table()                               # parallel, cached on disk
+#     K = table.gain([surge, pitch, vbs, lcg])            # (6, 12), multilinear interpolation
+#     u = table.control(x, [surge, pitch, vbs, lcg])      # u_trim + u_ff - K (x - x_trim)
+#
+# The model is linearized with CasADi at every grid point: straight and level heading, surge speed and pitch as given,
+# VBS and LCG as given and the rpm trimmed to zero surge acceleration. The other accelerations, mostly the pitch
+# acceleration, are not zero there: the grid points are operating points rather than equilibria. Their accelerations
+# x_dot_trim are stored with the table, and the feedforward u_ff cancels them in the linearized model as far as the
+# input limits allow.
+import bisect
+import functools
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+import numpy as np
+import casadi as ca
+import scipy.linalg
+import scipy.optimize
+
+from smarc_modelling.vehicles.casadi_models import dynamics_function, function_key, make_vehicle, model_parameters
+
+# Default grid: surge speed (m/s), pitch (rad), VBS (%), LCG (%)
+AXES = (
+    np.linspace(0.2, 2.0, 10),
+    np.deg2rad(np.linspace(-40, 40, 9)),
+    np.linspace(0, 100, 5),
+    np.linspace(0, 100, 5),
+)
+
+# Default weights, states as [x, y, z, q1, q2, q3, u, v, w, p, q, r], inputs as [vbs, lcg, ds, dr, rpm1, rpm2]
+Q_DIAG = np.array([1, 1, 1, 10, 10, 10, 1, 1, 1, 1, 1, 1], dtype=float)
+R_DIAG = np.array([1e-4, 1e-4, 10, 10, 1e-6, 1e-6], dtype=float)
+
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "smarc_modelling", "lqr")
+
+RPM_MAX = 1525
+
+# Input limits for the feedforward, inputs as [vbs, lcg, ds, dr, rpm1, rpm2]
+U_MIN = np.array([0, 0, -np.deg2rad(7), -np.deg2rad(7), -RPM_MAX, -RPM_MAX], dtype=float)
+U_MAX = np.array([100, 100, np.deg2rad(7), np.deg2rad(7), RPM_MAX, RPM_MAX], dtype=float)
+
+
+def operating_point(surge, pitch, vbs, lcg, rpm=0.0):
+    '''
+    State (12,) and input (6,) of SAM_LQR at an operating point
+    '''
+    x = np.zeros(12)
+    x[4] = np.sin(pitch / 2)       # Vector part of the quaternion, q0 = cos(pitch/2)
+    x[6] = surge
+    u = np.array([vbs, lcg, 0.0, 0.0, rpm, rpm])
+    return x, u
+
+
+def linearization_function(**parameters):
+    '''
+    ca.Function (x, u) -> (x_dot, A, B) of the SAM_LQR export model with the given parameters, see
+    casadi_models.make_vehicle()
+    '''
+    x_dot = dynamics_function("SAM_LQR", export=True, sym=ca.SX, **parameters)
+    x = ca.SX.sym('x', 12)
+    u = ca.SX.sym('u', 6)
+    f = x_dot(x, u)
+    return ca.Function('sam_lqr_jacobians', [x, u], [f, ca.jacobian(f, x), ca.jacobian(f, u)])
+
+
+def trim_rpm(jacobians, surge, pitch, vbs, lcg):
+    '''
+    The rpm of both propellers with zero surge acceleration at the operating point, within +-RPM_MAX
+    '''
+    def surge_acceleration(rpm):
+        x, u = operating_point(surge, pitch, vbs, lcg, rpm)
+        return float(jacobians(x, u)[0][6])
+
+    low = surge_acceleration(-RPM_MAX)
+    high = surge_acceleration(RPM_MAX)
+    if np.sign(low) == np.sign(high):
+        return RPM_MAX if abs(high) < abs(low) else -RPM_MAX
+    return scipy.optimize.brentq(surge_acceleration, -RPM_MAX, RPM_MAX, xtol=1e-3)
+
+
+def feedforward(x_dot, B, u, R):
+    '''
+    Input change du within U_MIN - u and U_MAX - u that cancels the accelerations x_dot[6:] of the linearized model in
+    the least squares sense. R regularizes the inputs without effect, e.g. the rudder in straight flight.
+    '''
+    L = np.linalg.cholesky(R).T
+    A_ls = np.vstack((B[6:], 1e-3 * L))
+    b_ls = np.concatenate((-x_dot[6:], np.zeros(L.shape[0])))
+    return scipy.optimize.lsq_linear(A_ls, b_ls, bounds=(U_MIN - u, U_MAX - u)).x
+
+
+def lqr_gain(A, B, Q, R):
+    '''
+    Continuous-time LQR gain K = R^-1 B^T P, with P the solution of the algebraic Riccati equation
+    '''
+    P = scipy.linalg.solve_continuous_are(A, B, Q, R)
+    return np.linalg.solve(R, B.T @ P)
+
+#------------------------------------------------------------------------------
+# Workers. Each process builds the CasADi functions once, in _init_worker.
+
+_worker = {}
+
+
+def _init_worker(parameters, Q, R):
+    _worker["jacobians"] = linearization_function(**parameters)
+    _worker["Q"] = Q
+    _worker["R"] = R
+
+
+def _solve_point(point):
+    '''
+    Trim, linearize and solve the LQR at one grid point. The gain is NaN if the Riccati equation has no stabilizing
+    solution there.
+    '''
+    jacobians = _worker["jacobians"]
+    rpm = trim_rpm(jacobians, *point)
+    x, u = operating_point(*point, rpm)
+    x_dot, A, B = (m.full() for m in jacobians(x, u))
+    x_dot = x_dot.ravel()
+    u_ff = feedforward(x_dot, B, u, _worker["R"])
+
+    try:
+        K = lqr_gain(A, B, _worker["Q"], _worker["R"])
+    except (np.linalg.LinAlgError, ValueError):
+        K = np.full((6, 12), np.nan)
+
+    return K, x, u, x_dot, u_ff
+
+#------------------------------------------------------------------------------
+
+class LQRTable:
+    '''
+    LQR gains and trim points on a regular grid of operating points, with multilinear interpolation.
+
+    Grid points without a stabilizing solution (NaN gains) use the gain of the nearest valid grid point, in units of the
+    grid spacing. valid marks the points with their own gain.
+
+    :param axes: tuple of the increasing grid values of every axis, see AXES
+    :param K: (*grid, 6, 12) gains
+    :param x_trim: (*grid, 12) states and u_trim: (*grid, 6) inputs of the operating points
+    :param x_dot_trim: (*grid, 12) state derivatives at the operating points, zero if None
+    :param u_ff: (*grid, 6) feedforward inputs, see feedforward(), zero if None
+    '''
+    def __init__(self, axes, K, x_trim, u_trim, x_dot_trim=None, u_ff=None):
+        self.axes = tuple(np.asarray(axis, dtype=float) for axis in axes)
+        self.shape = tuple(axis.size for axis in self.axes)
+        self.K = np.asarray(K, dtype=float)
+        self.x_trim = np.asarray(x_trim, dtype=float)
+        self.u_trim = np.asarray(u_trim, dtype=float)
+        self.x_dot_trim = np.zeros_like(self.x_trim) if x_dot_trim is None else np.asarray(x_dot_trim, dtype=float)
+        self.u_ff = np.zeros_like(self.u_trim) if u_ff is None else np.asarray(u_ff, dtype=float)
+
+        self.valid = ~np.isnan(self.K).any(axis=(-2, -1))
+        if not self.valid.any():
+            raise ValueError("The LQR table has no grid point with a stabilizing solution.")
+        if not self.valid.all():
+            self.K = self.K.copy()
+            valid = np.argwhere(self.valid)
+            for idx in np.argwhere(~self.valid):
+                nearest = valid[np.argmin(np.sum((valid - idx)**2, axis=1))]
+                self.K[tuple(idx)] = self.K[tuple(nearest)]
+
+        # Flat views, and the offsets of the 2^d corners of a grid cell from its first corner for the interpolation.
+        # An axis with a single point has no upper corner.
+        n_points = int(np.prod(self.shape))
+        self._K = self.K.reshape(n_points, -1)
+        self._x_trim = self.x_trim.reshape(n_points, -1)
+        self._u_trim = (self.u_trim + self.u_ff).reshape(n_points, -1)
+        self._values = [axis.tolist() for axis in self.axes]
+        self._strides = [int(np.prod(self.shape[i+1:])) for i in range(len(self.shape))]
+        corners = np.array(np.meshgrid(*[[0, 1]] * len(self.axes), indexing='ij')).reshape(len(self.axes), -1).T
+        self._offsets = np.minimum(corners, np.array(self.shape) - 1) @ np.array(self._strides)
+
+    def _weights(self, point):
+        '''
+        Flat indices and weights of the grid points around point. Points outside the grid are clamped to it.
+        '''
+        # Plain Python on the scalars, the arrays are too small for numpy to pay off
+        first = 0
+        weights = [1.0]
+        for values, stride, value in zip(self._values, self._strides, map(float, point)):
+            n = len(values)
+            if n == 1:
+                weights = [w * s for w in weights for s in (1.0, 0.0)]
+                continue
+            j = min(max(bisect.bisect_left(values, value) - 1, 0), n - 2)
+            t = min(max((value - values[j]) / (values[j+1] - values[j]), 0.0), 1.0)
+            first += j * stride
+            weights = [w * s for w in weights for s in (1.0 - t, t)]
+
+        return first + self._offsets, np.array(weights)
+
+    def gain(self, point):
+        '''
+        Interpolated (6, 12) gain at point = [surge, pitch, vbs, lcg]
+        '''
+        flat, weights = self._weights(point)
+        return (weights @ self._K[flat]).reshape(self.K.shape[-2:])
+
+    def nearest_gain(self, point):
+        '''
+        Gain of the nearest grid point, without interpolation
+        '''
+        idx = tuple(int(np.argmin(np.abs(axis - value))) for axis, value in zip(self.axes, point))
+        return self.K[idx]
+
+    def trim(self, point):
+        '''
+        Interpolated operating point (x_trim, u_trim + u_ff)
+        '''
+        flat, weights = self._weights(point)
+        return weights @ self._x_trim[flat], weights @ self._u_trim[flat]
+
+    def control(self, x, point):
+        '''
+        LQR input u = u_trim + u_ff - K (x - x_trim) of the interpolated gain and operating point
+        '''
+        flat, weights = self._weights(point)
+        K = (weights @ self._K[flat]).reshape(self.K.shape[-2:])
+        return weights @ self._u_trim[flat] - K @ (x - weights @ self._x_trim[flat])
+
+    def save(self, path):
+        # The gains as built, with NaN where there is no stabilizing solution
+        K = np.where(self.valid[..., None, None], self.K, np.nan)
+        np.savez_compressed(path, K=K, x_trim=self.x_trim, u_trim=self.u_trim, x_dot_trim=self.x_dot_trim,
+                            u_ff=self.u_ff, **{f"axis_{i}": axis for i, axis in enumerate(self.axes)})
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            axes = [data[f"axis_{i}"] for i in range(sum(name.startswith("axis_") for name in data.files))]
+            return cls(axes, data["K"], data["x_trim"], data["u_trim"], data["x_dot_trim"], data["u_ff"])
+
+
+@functools.lru_cache(maxsize=None)
+def _source_hash():
+    with open(__file__, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def table_key(axes, Q, R, parameters):
+    '''
+    Hash of the grid, the weights, the model (its parameters and source, see casadi_models.function_key()) and of the
+    source of this module, which trims and solves the grid points
+    '''
+    content = json.dumps([function_key("SAM_LQR", True, ca.SX, **parameters), _source_hash(),
+                          [np.asarray(axis, dtype=float).tolist() for axis in axes],
+                          np.asarray(Q, dtype=float).tolist(), np.asarray(R, dtype=float).tolist()])
+    return hashlib.sha1(content.encode()).hexdigest()[0:16]
+
+
+def build_table(axes=AXES, Q=None, R=None, model=None, n_workers=None, cache_dir=None, verbose=True):
+    '''
+    LQR gains on the grid of operating points, computed in a process pool.
+
+    :param axes: grid values of surge speed (m/s), pitch (rad), VBS (%) and LCG (%)
+    :param Q, R: weight matrices, diag(Q_DIAG) and diag(R_DIAG) by default
+    :param model: SAM_LQR instance with the model parameters, the default model if None
+    :param n_workers: number of processes, defaults to the number of CPUs
+    :param cache_dir: the table is saved here and loaded again for the same grid, weights and model. CACHE_DIR by
+                      default, False to disable the cache.
+    :return: LQRTable
+    '''
+    Q = np.diag(Q_DIAG) if Q is None else np.asarray(Q, dtype=float)
+    R = np.diag(R_DIAG) if R is None else np.asarray(R, dtype=float)
+    parameters = model_parameters(model if model is not None else make_vehicle("SAM_LQR"))
+    if cache_dir is None:
+        cache_dir = CACHE_DIR
+
+    path = None
+    if cache_dir is not False:
+        path = os.path.join(cache_dir, f"lqr_table_{table_key(axes, Q, R, parameters)}.npz")
+        if os.path.isfile(path):
+            return LQRTable.load(path)
+
+    shape = tuple(len(axis) for axis in axes)
+    points = [tuple(float(axis[i]) for axis, i in zip(axes, idx)) for idx in np.ndindex(*shape)]
+
+    start = time.perf_counter()
+    with multiprocessing.Pool(n_workers, initializer=_init_worker, initargs=(parameters, Q, R)) as pool:
+        results = pool.map(_solve_point, points, chunksize=max(1, len(points) // (8 * (n_workers or os.cpu_count()))))
+
+    K = np.array([r[0] for r in results]).reshape(*shape, 6, 12)
+    x_trim = np.array([r[1] for r in results]).reshape(*shape, 12)
+    u_trim = np.array([r[2] for r in results]).reshape(*shape, 6)
+    x_dot_trim = np.array([r[3] for r in results]).reshape(*shape, 12)
+    u_ff = np.array([r[4] for r in results]).reshape(*shape, 6)
+    table = LQRTable(axes, K, x_trim, u_trim, x_dot_trim, u_ff)
+
+    if verbose:
+        n_failed = int(np.sum(~table.valid))
+        print(f" LQR table with {len(points)} points in {time.perf_counter() - start:.1f} s, {n_failed} without a "
+              f"stabilizing solution")
+
+    if path is not None:
+        # Write to a temporary file first, other processes might be loading it
+        os.makedirs(cache_dir, exist_ok=True)
+        table.save(path + f".{os.getpid()}.npz")
+        os.replace(path + f".{os.getpid()}.npz", path)
+
+    return table
+
+
+if __name__ == '__main__':
+    table = build_table()
+    point = [1.0, np.deg2rad(10), 50, 50]
+
+    n = 10000
+    start = time.perf_counter()
+    for _ in range(n):
+        table.gain(point)
+    print(f" Gain lookup: {1e6 * (time.perf_counter() - start) / n:.1f} us")
+    print(np.round(table.gain(point), 3))
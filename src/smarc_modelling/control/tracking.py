@@ -0,0 +1,235 @@
+# Closed-loop trajectory tracking with the acados NMPC
+import time
+import numpy as np
+
+
+class TrackingLoop:
+    '''
+    Closed-loop tracking of a reference trajectory with the OCP solver and integrator returned by NMPC.setup().
+
+    The OCP has to follow the convention of the NMPC classes: the parameter p = [x_ref, u_ref] of every stage, including
+    the terminal one, is the reference of that stage and the cost is the error to it. In every step
+    - the reference window of the horizon is set as the parameters of all stages at once,
+    - the state and input trajectories are warm started with the previous solution shifted by one stage,
+    - the solver time and the wall-clock time of the whole step are recorded, see timing().
+    With an SQP_RTI solver every step is a single real-time iteration. With rti_phases=True the iteration is split into
+    the preparation phase, which only needs the references and the warm start, and the feedback phase, which runs when
+    the state arrives, see prepare() and feedback(). The input latency is then the feedback time.
+    '''
+    def __init__(self, ocp_solver, integrator, budget=0.1, rti_phases=False):
+        '''
+        :param ocp_solver: AcadosOcpSolver of the NMPC
+        :param integrator: AcadosSimSolver with the same model, used by simulate()
+        :param budget: time budget of one control step in seconds, for the statistics
+        :param rti_phases: split every step into preparation and feedback, needs an SQP_RTI solver
+        '''
+        self.solver = ocp_solver
+        self.integrator = integrator
+        self.budget = budget
+        self.rti_phases = rti_phases
+        self.rti = self._nlp_solver_type() == "SQP_RTI"
+        self.N = ocp_solver.N
+        self.nx = np.size(ocp_solver.get(0, "x"))
+        self.nu = np.size(ocp_solver.get(0, "u"))
+        self.reset()
+
+    def reset(self):
+        '''
+        Forget the previous solution and the statistics, e.g. before tracking a new trajectory
+        '''
+        self.X = None
+        self.U = None
+        self.prepared = False
+        self.prepared_status = 0
+        self.prepared_solver_time = 0.0
+        self.solver_time = []
+        self.step_time = []
+        self.preparation_time = []
+        self.feedback_time = []
+        self.status = []
+
+    def _nlp_solver_type(self):
+        ocp = getattr(self.solver, "acados_ocp", None)
+        return getattr(getattr(ocp, "solver_options", None), "nlp_solver_type", None)
+
+    def _set_stages(self, field, values):
+        # One call for all stages if the acados version supports it
+        if hasattr(self.solver, "set_flat"):
+            self.solver.set_flat(field, np.ascontiguousarray(values, dtype=float).ravel())
+        else:
+            for stage, value in enumerate(values):
+                self.solver.set(stage, field, value)
+
+    def _get_stages(self, field, n_stages, size):
+        if hasattr(self.solver, "get_flat"):
+            return self.solver.get_flat(field).reshape(n_stages, size)
+        return np.array([self.solver.get(stage, field) for stage in range(n_stages)])
+
+    def reference_window(self, reference, i):
+        '''
+        The (N+1, nx+nu) references of the stages at step i. After the end of the trajectory its last row is repeated.
+        '''
+        idx = np.minimum(np.arange(i, i + self.N + 1), reference.shape[0] - 1)
+        return reference[idx]
+
+    def warm_start(self, x=None):
+        '''
+        Initialize the solver with the previous solution shifted by one stage. The last stage is repeated and the first
+        state is replaced by the current state x, if given. Without a previous solution, x is used for all stages and
+        the inputs are zero.
+        '''
+        if self.X is None:
+            X = np.tile(x, (self.N + 1, 1))
+            U = np.zeros((self.N, self.nu))
+        else:
+            X = np.concatenate((self.X[1:], self.X[-1:]))
+            U = np.concatenate((self.U[1:], self.U[-1:]))
+            if x is not None:
+                X[0] = x
+
+        self._set_stages("x", X)
+        self._set_stages("u", U)
+
+    def step(self, x, reference):
+        '''
+        One control step from the current state x.
+
+        :param x: current state (nx,)
+        :param reference: (N+1, nx+nu) references of the stages, see reference_window()
+        :return: the first control rate of the solution and the solver status
+        '''
+        if self.rti_phases:
+            if not self.prepared:
+                self.prepare(reference, x)
+            return self.feedback(x)
+
+        start = time.perf_counter()
+
+        self._set_stages("p", reference)
+        self.warm_start(x)
+        self.solver.set(0, "lbx", x)
+        self.solver.set(0, "ubx", x)
+
+        # Full real-time iteration, the phase is left at 2 by a previous feedback()
+        if self.rti:
+            self.solver.options_set("rti_phase", 0)
+        status = self.solver.solve()
+
+        self.X = self._get_stages("x", self.N + 1, self.nx)
+        self.U = self._get_stages("u", self.N, self.nu)
+
+        self.step_time.append(time.perf_counter() - start)
+        self.solver_time.append(self.solver.get_stats("time_tot"))
+        self.status.append(status)
+
+        return self.U[0], status
+
+    def prepare(self, reference, x=None):
+        '''
+        RTI preparation phase of the next step: set the references, warm start and linearize. The state is the one
+        predicted by the previous solution, unless x is given.
+        '''
+        start = time.perf_counter()
+
+        self._set_stages("p", reference)
+        self.warm_start(x)
+        self.solver.options_set("rti_phase", 1)
+        self.prepared_status = self.solver.solve()
+        self.prepared_solver_time = self.solver.get_stats("time_tot")
+        self.prepared = True
+
+        self.preparation_time.append(time.perf_counter() - start)
+
+    def feedback(self, x):
+        '''
+        RTI feedback phase: solve the prepared QP for the current state x.
+        :return: the first control rate of the solution and the solver status
+        '''
+        start = time.perf_counter()
+
+        self.solver.set(0, "lbx", x)
+        self.solver.set(0, "ubx", x)
+        self.solver.options_set("rti_phase", 2)
+        status = self.solver.solve()
+
+        # The input can be applied here, the rest is bookkeeping
+        self.feedback_time.append(time.perf_counter() - start)
+
+        self.X = self._get_stages("x", self.N + 1, self.nx)
+        self.U = self._get_stages("u", self.N, self.nu)
+        self.prepared = False
+
+        self.step_time.append(self.preparation_time[-1] + self.feedback_time[-1])
+        self.solver_time.append(self.prepared_solver_time + self.solver.get_stats("time_tot"))
+        status = status if status != 0 else self.prepared_status
+        self.status.append(status)
+
+        return self.U[0], status
+
+    def simulate(self, trajectory, x0=None, noise=None, stop_on_failure=False):
+        '''
+        Track a trajectory in closed loop with the integrator. Every step solves the OCP, there is no holding of the
+        inputs over several steps.
+
+        :param trajectory: (Nsim, nx) reference states, or (Nsim, nx+nu) with the control rate references
+        :param x0: initial state, the first reference by default
+        :param noise: optional function noise(i) -> (nx,) added to the measured state of step i
+        :param stop_on_failure: stop at the first step with a nonzero solver status, without applying its input.
+            The returned trajectories then end at that step. Otherwise the input of a failed step is applied.
+        :return: simX (Nsim+1, nx) simulated states, simU (Nsim, nu) control rates, status of the last step
+        '''
+        trajectory = np.asarray(trajectory, dtype=float)
+        if trajectory.shape[1] == self.nx:
+            # Control rate reference set to 0 to penalize fast control changes
+            trajectory = np.concatenate((trajectory, np.zeros((trajectory.shape[0], self.nu))), axis=1)
+
+        Nsim = trajectory.shape[0]
+        simX = np.zeros((Nsim + 1, self.nx))
+        simU = np.zeros((Nsim, self.nu))
+        simX[0] = trajectory[0, :self.nx] if x0 is None else x0
+
+        self.reset()
+        status = 0
+        for i in range(Nsim):
+            x = simX[i] if noise is None else simX[i] + noise(i)
+            simU[i], status = self.step(x, self.reference_window(trajectory, i))
+            if status != 0:
+                print(f" Note: acados_ocp_solver returned status: {status}")
+                if stop_on_failure:
+                    return simX[:i+1], simU[:i], status
+            simX[i+1] = self.integrator.simulate(x=x, u=simU[i])
+
+            # Prepare the next step while the system moves
+            if self.rti_phases and i + 1 < Nsim:
+                self.prepare(self.reference_window(trajectory, i + 1))
+
+        return simX, simU, status
+
+    def timing(self):
+        '''
+        Statistics of the recorded steps in milliseconds: min, median, mean, p95, p99 and max of the solver time
+        (time_tot), of the whole step and, with rti_phases, of the preparation and feedback phases, and the number of
+        steps over budget.
+        '''
+        stats = {"steps": len(self.step_time),
+                 "over_budget": int(np.sum(np.array(self.step_time) > self.budget)),
+                 "failed": int(np.sum(np.array(self.status) != 0))}
+        for name, times in (("solver", self.solver_time), ("step", self.step_time),
+                            ("preparation", self.preparation_time), ("feedback", self.feedback_time)):
+            t = 1000 * np.array(times)
+            if t.size == 0:
+                continue
+            stats[name] = {"min": float(np.min(t)), "median": float(np.median(t)), "mean": float(np.mean(t)),
+                           "p95": float(np.percentile(t, 95)), "p99": float(np.percentile(t, 99)),
+                           "max": float(np.max(t))}
+
+        return stats
+
+    def print_timing(self):
+        stats = self.timing()
+        print(f"{'ms':<12}{'min':>9}{'median':>9}{'mean':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+        for name in ("solver", "step", "preparation", "feedback"):
+            if name in stats:
+                print(f"{name:<12}" + "".join(f"{value:>9.3f}" for value in stats[name].values()))
+        print(f"{stats['over_budget']}/{stats['steps']} steps over the budget of {1000*self.budget:.0f} ms, "
+              f"{stats['failed']} failed")
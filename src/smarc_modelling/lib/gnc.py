@@ -58,6 +58,21 @@ def Smtrx(a):
 
 #------------------------------------------------------------------------------
 
+def Smtrx_batch(a):
+    """
+    S = Smtrx_batch(a) computes the (N,3,3) stack of skew-symmetric matrices
+    S(a) for a (N,3) array of vectors a.
+    """
+
+    S = np.zeros(a.shape[:-1] + (3, 3))
+    S[..., 0, 1] = -a[..., 2]
+    S[..., 0, 2] = a[..., 1]
+    S[..., 1, 0] = a[..., 2]
+    S[..., 1, 2] = -a[..., 0]
+    S[..., 2, 0] = -a[..., 1]
+    S[..., 2, 1] = a[..., 0]
+
+    return S
 
 #------------------------------------------------------------------------------
 def skew_symmetric(vector):
@@ -198,6 +213,25 @@ def dot_skew_squared(r, r_dot):
     return result
 #------------------------------------------------------------------------------
 
+def inverse_3x3(A):
+    """
+    A_inv = inverse_3x3(A) computes the inverse of a 3x3 matrix in closed form
+    from its adjugate and determinant.
+    """
+    a00, a01, a02 = A[0, 0], A[0, 1], A[0, 2]
+    a10, a11, a12 = A[1, 0], A[1, 1], A[1, 2]
+    a20, a21, a22 = A[2, 0], A[2, 1], A[2, 2]
+
+    adj = np.array([
+        [a11*a22 - a12*a21, a02*a21 - a01*a22, a01*a12 - a02*a11],
+        [a12*a20 - a10*a22, a00*a22 - a02*a20, a02*a10 - a00*a12],
+        [a10*a21 - a11*a20, a01*a20 - a00*a21, a00*a11 - a01*a10] ])
+    det = a00*adj[0, 0] + a01*adj[1, 0] + a02*adj[2, 0]
+
+    return adj / det
+
+#------------------------------------------------------------------------------
+
 def Hmtrx(r):
     """
     H = Hmtrx(r) computes the 6x6 system transformation matrix
@@ -287,6 +321,40 @@ def quaternion_to_angles(q):
     return psi, theta, phi
 # ------------------------------------------------------------------------------
 
+
+# ------------------------------------------------------------------------------
+def quaternion_to_dcm_batch(q):
+    """
+    Batched version of quaternion_to_dcm.
+
+    Parameters:
+        q (numpy array): (N, 4) array of quaternions [q0, q1, q2, q3]
+
+    Returns:
+        numpy array: (N, 3, 3) stack of Direction Cosine Matrices
+    """
+    q_scalar_last = np.roll(q, -1, axis=-1)
+    return R.from_quat(q_scalar_last).as_matrix()
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def quaternion_to_angles_batch(q):
+    """
+    Batched version of quaternion_to_angles.
+
+    Parameters:
+        q (numpy array): (N, 4) array of quaternions [q0, q1, q2, q3]
+
+    Returns:
+        tuple: (N,) arrays of Euler angles (psi, theta, phi) in radians
+    """
+    q_scalar_last = np.roll(q, -1, axis=-1)
+    rot_euler = R.from_quat(q_scalar_last).as_euler('xyz')
+
+    return rot_euler[:, 2], rot_euler[:, 1], rot_euler[:, 0]
+# ------------------------------------------------------------------------------
+
 def Tzyx(phi,theta):
     """
     T = Tzyx(phi,theta) computes the Euler angle attitude
@@ -368,6 +436,30 @@ def m2c(M, nu):
     return C
 #------------------------------------------------------------------------------
 
+def m2c_batch(M, nu):
+    """
+    C = m2c_batch(M,nu) is the batched 6-DOF version of m2c. M is either a
+    single (6,6) mass matrix or a (N,6,6) stack, nu is a (N,6) array of
+    generalized velocities. Returns the (N,6,6) stack of Coriolis matrices.
+    """
+
+    M = 0.5 * (M + np.swapaxes(M, -1, -2))     # systematization of the inertia matrix
+
+    nu1 = nu[:, 0:3]
+    nu2 = nu[:, 3:6]
+    dt_dnu1 = np.einsum('...ij,...j->...i', M[..., 0:3, 0:3], nu1) \
+            + np.einsum('...ij,...j->...i', M[..., 0:3, 3:6], nu2)
+    dt_dnu2 = np.einsum('...ji,...j->...i', M[..., 0:3, 3:6], nu1) \
+            + np.einsum('...ij,...j->...i', M[..., 3:6, 3:6], nu2)
+
+    C = np.zeros((nu.shape[0], 6, 6))
+    C[:, 0:3, 3:6] = -Smtrx_batch(dt_dnu1)
+    C[:, 3:6, 0:3] = -Smtrx_batch(dt_dnu1)
+    C[:, 3:6, 3:6] = -Smtrx_batch(dt_dnu2)
+
+    return C
+#------------------------------------------------------------------------------
+
 def Hoerner(B,T):
     """
     CY_2D = Hoerner(B,T)
@@ -597,6 +689,38 @@ def gvect(W,B,theta,phi,r_bg,r_bb):
     return g
 
 
+def gvect_batch(W,B,theta,phi,r_bg,r_bb):
+    """
+    g = gvect_batch(W,B,theta,phi,r_bg,r_bb) is the batched version of gvect.
+    theta and phi are (N,) arrays, W and B scalars or (N,) arrays and r_bg,
+    r_bb either single (3,) vectors or (N,3) arrays.
+
+    Returns:
+        g: (N,6) array of restoring forces about CO
+    """
+
+    sth  = np.sin(theta)
+    cth  = np.cos(theta)
+    sphi = np.sin(phi)
+    cphi = np.cos(phi)
+
+    r_bg = np.asarray(r_bg)
+    r_bb = np.asarray(r_bb)
+    r_W = r_bg * np.reshape(W, np.shape(W) + (1,))
+    r_B = r_bb * np.reshape(B, np.shape(B) + (1,))
+    r_diff = r_W - r_B
+
+    g = np.empty((np.shape(theta)[0], 6))
+    g[:, 0] = (W-B) * sth
+    g[:, 1] = -(W-B) * cth * sphi
+    g[:, 2] = -(W-B) * cth * cphi
+    g[:, 3] = -r_diff[..., 1] * cth * cphi + r_diff[..., 2] * cth * sphi
+    g[:, 4] = r_diff[..., 2] * sth         + r_diff[..., 0] * cth * cphi
+    g[:, 5] = -r_diff[..., 0] * cth * sphi - r_diff[..., 1] * sth
+
+    return g
+
+
 def calculate_dcm(order, angles):
     """
     Calculates the Direction Cosine Matrix (DCM) for a given rotation order and angles.
@@ -2,6 +2,9 @@
 GNC functions for the casadi model. 
 Only the necessary functions from gnc.py to make the model work are converted in this script
 
+The functions work with both ca.MX and ca.SX arguments, the result has the
+symbol type of the arguments.
+
 """
 import casadi as ca
 
@@ -35,17 +38,20 @@ def m2c_ca(M, nu):
         dt_dnu1 = ca.mtimes(M11, nu1) + ca.mtimes(M12, nu2)
         dt_dnu2 = ca.mtimes(M21, nu1) + ca.mtimes(M22, nu2)
 
-        C = ca.MX.zeros(6, 6)
-        C[0:3, 3:6] = -skew_symmetric_ca(dt_dnu1)
-        C[3:6, 0:3] = -skew_symmetric_ca(dt_dnu1)
-        C[3:6, 3:6] = -skew_symmetric_ca(dt_dnu2)
+        # Assembled from blocks, so C has the symbol type of M and nu
+        C = ca.vertcat(
+            ca.horzcat(ca.DM.zeros(3, 3), -skew_symmetric_ca(dt_dnu1)),
+            ca.horzcat(-skew_symmetric_ca(dt_dnu1), -skew_symmetric_ca(dt_dnu2))
+        )
 
     else:  # 3-DOF model (surge, sway, and yaw)
-        C = ca.MX.zeros(3, 3)
-        C[0, 2] = -M[1, 1] * nu[1] - M[1, 2] * nu[2]
-        C[1, 2] = M[0, 0] * nu[0]
-        C[2, 0] = -C[0, 2]
-        C[2, 1] = -C[1, 2]
+        C02 = -M[1, 1] * nu[1] - M[1, 2] * nu[2]
+        C12 = M[0, 0] * nu[0]
+        C = ca.vertcat(
+            ca.horzcat(0, 0, C02),
+            ca.horzcat(0, 0, C12),
+            ca.horzcat(-C02, -C12, 0)
+        )
 
     return C
 
@@ -89,7 +95,7 @@ def calculate_dcm_ca(order, angles):
         angles (list or tuple): A vector of rotation angles in radians.
 
     Returns:
-        casadi.MX: A 3x3 DCM matrix.
+        casadi.MX or casadi.SX: A 3x3 DCM matrix.
     """
 
     def rotation_matrix_ca(axis, angle):
@@ -101,7 +107,7 @@ def calculate_dcm_ca(order, angles):
             angle (float): Rotation angle in radians.
 
         Returns:
-            casadi.MX: 3x3 rotation matrix for the axis.
+            casadi.MX or casadi.SX: 3x3 rotation matrix for the axis.
         """
         c = ca.cos(angle)
         s = ca.sin(angle)
@@ -133,7 +139,7 @@ def calculate_dcm_ca(order, angles):
         raise ValueError("Order and angles must have the same number of elements.")
 
     # Compute the DCM
-    dcm = ca.MX.eye(3)  # Start with the identity matrix
+    dcm = ca.DM.eye(3)  # Start with the identity matrix
     for axis, angle in zip(order, angles):
         dcm = ca.mtimes(rotation_matrix_ca(axis, angle), dcm)
 
@@ -145,10 +151,10 @@ def quaternion_to_dcm_ca(q):
     Cosine Matrix (DCM).
 
     Parameters:
-        q (list or casadi.MX): Quaternion [q0, q1, q2, q3]
+        q (list, casadi.MX or casadi.SX): Quaternion [q0, q1, q2, q3]
 
     Returns:
-        casadi.MX: 3x3 Direction Cosine Matrix (DCM)
+        casadi.MX or casadi.SX: 3x3 Direction Cosine Matrix (DCM)
     """
     q0, q1, q2, q3 = q[0], q[1], q[2], q[3]
 
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Integrators for the vehicle models.
+
+All integrators take the dynamics as fun(x, u) -> x_dot, the same signature
+as the dynamics() methods of the vehicle classes.
+
+Single steps:
+    x_next = euler(x, u, dt, fun)
+    x_next = rk4(x, u, dt, fun)
+
+Whole trajectories:
+    X = simulate(fun, x0, u, dt, n_steps, method="rk4")
+
+simulate() writes the trajectory into a preallocated (n_steps, nx) array.
+dt is either a fixed step or an array of n_steps-1 variable steps, u is
+either a single input held over the whole trajectory or an array with one
+input per step. For batched dynamics, x0 can also be a (K, nx) stack of
+states, the trajectory is then (n_steps, K, nx). method selects the scheme: "euler", "rk4" or "rk45", an
+adaptive Dormand-Prince 5(4) scheme that steps independently of the output
+grid and fills it with its 4th order dense output.
+"""
+
+import numpy as np
+
+#------------------------------------------------------------------------------
+
+def euler(x, u, dt, fun):
+    """
+    x_next = euler(x, u, dt, fun) does one forward Euler step
+    """
+    return x + dt * fun(x, u)
+
+#------------------------------------------------------------------------------
+
+def rk4(x, u, dt, fun):
+    """
+    x_next = rk4(x, u, dt, fun) does one classic Runge-Kutta 4 step
+    """
+    k1 = fun(x, u)
+    k2 = fun(x+dt/2*k1, u)
+    k3 = fun(x+dt/2*k2, u)
+    k4 = fun(x+dt*k3, u)
+
+    return x + dt/6 * (k1 + 2*k2 + 2*k3 + k4)
+
+#------------------------------------------------------------------------------
+
+# Dormand-Prince 5(4) Butcher tableau. The last row of DP_A are the 5th order
+# weights, DP_E the difference to the embedded 4th order weights.
+DP_A = [
+    np.array([]),
+    np.array([1/5]),
+    np.array([3/40, 9/40]),
+    np.array([44/45, -56/15, 32/9]),
+    np.array([19372/6561, -25360/2187, 64448/6561, -212/729]),
+    np.array([9017/3168, -355/33, 46732/5247, 49/176, -5103/18656]),
+    np.array([35/384, 0, 500/1113, 125/192, -2187/6784, 11/84]),
+]
+DP_E = np.array([71/57600, 0, -71/16695, 71/1920, -17253/339200, 22/525, -1/40])
+
+# Coefficients of the 4th order continuous extension of Dormand-Prince
+# (Shampine 1986, as in scipy's RK45): x(t + s*dt) = x + dt * P(s) . K with
+# the polynomials of s in the rows of DP_P, lowest power s**1 first.
+DP_P = np.array([
+    [1, -8048581381/2820520608, 8663915743/2820520608, -12715105075/11282082432],
+    [0, 0, 0, 0],
+    [0, 131558114200/32700410799, -68118460800/10900136933, 87487479700/32700410799],
+    [0, -1754552775/470086768, 14199869525/1410260304, -10690763975/1880347072],
+    [0, 127303824393/49829197408, -318862633887/49829197408, 701980252875/199316789632],
+    [0, -282668133/205662961, 2019193451/616988883, -1453857185/822651844],
+    [0, 40617522/29380423, -110615467/29380423, 69997945/29380423],
+])
+
+
+def dopri5_step(x, u, dt, fun, k1):
+    """
+    x_next, K, err = dopri5_step(x, u, dt, fun, k1) does one Dormand-Prince
+    5(4) step. k1 = fun(x, u) is passed in and the (7, nx) stages K returned,
+    the last one is fun(x_next, u), so that consecutive steps share one
+    evaluation. err is the embedded error estimate.
+    """
+    K = np.empty((7,) + np.shape(x))
+    K[0] = k1
+    for i in range(1, 7):
+        K[i] = fun(x + dt * np.tensordot(DP_A[i], K[:i], axes=1), u)
+
+    x_next = x + dt * np.tensordot(DP_A[6], K[:6], axes=1)
+    err = dt * np.tensordot(DP_E, K, axes=1)
+
+    return x_next, K, err
+
+
+def dopri5_dense(t, t0, t1, x0, K):
+    """
+    Dense output of the Dormand-Prince step from (t0, x0) to t1 with the
+    stages K, at t0 <= t <= t1. It is of 4th order, like the error estimate.
+    """
+    h = t1 - t0
+    s = (t - t0) / h
+
+    return x0 + h * np.tensordot(DP_P @ (s ** np.arange(1, 5)), K, axes=1)
+
+#------------------------------------------------------------------------------
+
+def simulate(fun, x0, u, dt, n_steps=None, method="rk4", out=None,
+             update_dt=None, rtol=1e-6, atol=1e-9, max_step=np.inf, per_step=None):
+    """
+    X = simulate(fun, x0, u, dt, n_steps) integrates a whole trajectory.
+
+    Args:
+        fun: dynamics fun(x, u) -> x_dot
+        x0: initial state (nx,), or (K, nx) for batched dynamics
+        u: control input held constant, shape (nu,) or (K, nu) for batched
+            dynamics, or one input per step with a leading axis of n_steps-1,
+            (n_steps-1, nu) or (n_steps-1, K, nu)
+        dt: fixed time step, or (n_steps-1,) array of variable time steps
+        n_steps: number of samples in the trajectory, including x0. Can be
+            omitted if dt or u are given per step.
+        method: "euler", "rk4" or "rk45"
+        out: optional preallocated (n_steps, *x0.shape) array for the trajectory
+        update_dt: optional callback update_dt(dt), called whenever the step
+            size changes, e.g. vehicle.update_dt for the actuator dynamics
+        rtol, atol, max_step: step size control of "rk45"
+        per_step: whether u holds one input per step. Inferred from the shapes
+            by default. For batched dynamics a (K, nu) input with K == n_steps-1
+            is ambiguous and needs it.
+
+    Returns:
+        X: (n_steps, *x0.shape) trajectory, X[0] = x0
+    """
+    x0 = np.asarray(x0, dtype=float)
+    u = np.asarray(u, dtype=float)
+
+    if n_steps is None and np.ndim(dt) > 0:
+        n_steps = len(dt) + 1
+    if per_step is None:
+        per_step = _input_per_step(u, x0, n_steps)
+
+    if n_steps is None:
+        if not per_step:
+            raise ValueError("n_steps is needed for a fixed dt and a constant input.")
+        n_steps = u.shape[0] + 1
+    elif per_step and u.shape[0] < n_steps - 1:
+        raise ValueError(f"u has {u.shape[0]} inputs, {n_steps - 1} are needed for {n_steps} steps.")
+
+    dts = np.broadcast_to(np.asarray(dt, dtype=float), (n_steps - 1,))
+    constant_input = not per_step
+
+    if out is None:
+        out = np.empty((n_steps,) + x0.shape)
+    out[0] = x0
+
+    if method == "rk45":
+        return _simulate_rk45(fun, u, dts, out, constant_input, update_dt, rtol, atol, max_step)
+
+    if method == "euler":
+        step = euler
+    elif method == "rk4":
+        step = rk4
+    else:
+        raise ValueError(f"Unknown integration method: {method}")
+
+    dt_prev = None
+    u_k = u
+    for k in range(n_steps - 1):
+        if update_dt is not None and dts[k] != dt_prev:
+            update_dt(dts[k])
+            dt_prev = dts[k]
+        if not constant_input:
+            u_k = u[k]
+        out[k+1] = step(out[k], u_k, dts[k], fun)
+
+    return out
+
+
+def _input_per_step(u, x0, n_steps):
+    """
+    True if u holds one input per step, from the shapes of u and x0
+    """
+    if u.ndim == x0.ndim + 1:
+        return True
+    if u.ndim == 1:
+        return False
+    if u.ndim == 2 and x0.ndim == 2:
+        # (K, nu) constant or (n_steps-1, nu) per step, shared by all instances
+        per_instance = u.shape[0] == x0.shape[0]
+        per_step = n_steps is None or u.shape[0] == n_steps - 1
+        if per_instance and per_step:
+            raise ValueError(f"u of shape {u.shape} can be constant or per step, pass per_step.")
+        if per_instance or per_step:
+            return per_step
+    raise ValueError(f"u of shape {u.shape} does not fit x0 of shape {x0.shape} and {n_steps} steps.")
+
+
+def _simulate_rk45(fun, u, dts, out, constant_input, update_dt, rtol, atol, max_step):
+    """
+    Adaptive Dormand-Prince integration on the output grid given by dts.
+
+    The input is piecewise constant. With a constant input, the steps are
+    chosen independently of the output grid and the grid is filled with the
+    4th order dense output of Dormand-Prince. Otherwise, every output interval is integrated on its own,
+    since the input jumps at the grid points.
+    """
+    n_steps = out.shape[0]
+    t_grid = np.concatenate([[0.0], np.cumsum(dts)])
+
+    if update_dt is not None:
+        # The actuator dynamics of the vehicles use dt as time constant, we
+        # keep it at the nominal output step
+        update_dt(dts[0])
+
+    if constant_input:
+        segments = [(0, n_steps - 1)]
+    else:
+        segments = [(k, k + 1) for k in range(n_steps - 1)]
+
+    h = None
+    for k_start, k_end in segments:
+        u_k = u if constant_input else u[k_start]
+        t = t_grid[k_start]
+        t_end = t_grid[k_end]
+        x = out[k_start].copy()
+        f = fun(x, u_k)
+        k_next = k_start + 1
+
+        if h is None:
+            h = _initial_step(fun, x, u_k, f, rtol, atol)
+        h = min(h, max_step)
+
+        while t < t_end:
+            last_step = h >= t_end - t
+            if last_step:
+                h = t_end - t
+            x_new, K, err = dopri5_step(x, u_k, h, fun, f)
+
+            scale = atol + rtol * np.maximum(np.abs(x), np.abs(x_new))
+            err_norm = np.sqrt(np.mean((err / scale)**2))
+
+            if err_norm <= 1:
+                t_new = t_end if last_step else t + h
+                while k_next <= k_end and t_grid[k_next] <= t_new:
+                    if t_grid[k_next] == t_new:
+                        out[k_next] = x_new
+                    else:
+                        out[k_next] = dopri5_dense(t_grid[k_next], t, t_new, x, K)
+                    k_next += 1
+                t, x, f = t_new, x_new, K[6]
+
+            if err_norm == 0:
+                factor = 5
+            else:
+                factor = min(5, max(0.2, 0.9 * err_norm**(-1/5)))
+            h = min(h * factor, max_step)
+
+    return out
+
+
+def _initial_step(fun, x, u, f, rtol, atol):
+    """
+    Initial step size guess, Hairer, Norsett & Wanner (1993), sec. II.4
+    """
+    scale = atol + rtol * np.abs(x)
+    d0 = np.sqrt(np.mean((x / scale)**2))
+    d1 = np.sqrt(np.mean((f / scale)**2))
+    if d0 < 1e-5 or d1 < 1e-5:
+        h0 = 1e-6
+    else:
+        h0 = 0.01 * d0 / d1
+
+    f1 = fun(x + h0 * f, u)
+    d2 = np.sqrt(np.mean(((f1 - f) / scale)**2)) / h0
+    if max(d1, d2) <= 1e-15:
+        h1 = max(1e-6, h0 * 1e-3)
+    else:
+        h1 = (0.01 / max(d1, d2))**(1/5)
+
+    return min(100 * h0, h1)
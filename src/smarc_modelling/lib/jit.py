@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Optional JIT compilation of the vehicle dynamics kernels with numba.
+
+numba is not a hard dependency. The kernels in vehicles/*_kernel.py are plain
+Python functions on flat arrays and run without it; jit_compile() is only needed
+for the compiled fast path.
+"""
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+_compiled = {}
+
+#------------------------------------------------------------------------------
+
+def jit_available():
+    """
+    True if numba is installed and kernels can be compiled
+    """
+    return numba is not None
+
+#------------------------------------------------------------------------------
+
+def jit_compile(fun):
+    """
+    fun_jit = jit_compile(fun) returns the numba.njit compiled version of fun.
+    Compiled functions are kept per process and cached on disk by numba, so
+    only the first call in a fresh environment pays the compilation time.
+    """
+    if numba is None:
+        raise ImportError("The compiled dynamics need numba. Install it with 'pip install numba'.")
+
+    if fun not in _compiled:
+        _compiled[fun] = numba.njit(cache=True)(fun)
+
+    return _compiled[fun]
@@ -2,16 +2,15 @@
 
 import heapq
 import numpy as np
-import sys
 import random
-from joblib import Parallel, delayed
 from threading import Lock
 from scipy.spatial.transform import Rotation as R
 from scipy.spatial import KDTree
 import time
 import multiprocessing
 import csv
-from smarc_modelling.motion_planning.MotionPrimitives.MotionPrimitives import SAM_PRIMITIVES
+from smarc_modelling.motion_planning.MotionPrimitives.MotionPrimitives import SAM_PRIMITIVES, primitive_inputs
+from smarc_modelling.motion_planning.MotionPrimitives.PrimitiveLibrary import PrimitiveLibrary
 from smarc_modelling.motion_planning.MotionPrimitives.ObstacleChecker import calculate_angle_betweenVectors, calculate_angle_goalVector, compute_A_point_forward
 from smarc_modelling.motion_planning.MotionPrimitives.OptimizationAcados_doubleTree import optimization_acados_doubleTree
 from smarc_modelling.motion_planning.MotionPrimitives.OptimizationAcados_singleTree import optimization_acados_singleTree
@@ -152,18 +151,15 @@ def reconstruct_path_doubleTree(current, parents_dict, resolution_dict, map_inst
     # Return reversed path
     return final_path[::-1] 
 
-def process_input_pair(inputs, current_state, sim, map_instance, numberTree):
-    '''This is the function that is parallelized'''
-
-    # Initialize variables
-    inputLen = len(inputs)
+def process_input_batch(inputs_batch, current_state, sim, map_instance, numberTree):
+    '''
+    Computes the primitives of a batch of inputs at once and returns compact arrays:
+        inObs: (B,) True if the primitive is not valid
+        arrived: (B,) True if the primitive arrived at the goal
+        cost: (B,) cost of the primitives
+        data: (nValid, n_sim, 19) all the points of the valid primitives
+    '''
 
-    # If number of inputs is != from number of indices there is something wrong
-    if inputLen % 2 != 0:
-        print(inputs)
-        print("ERROR! INPUTS AND INDICES ARE NOT THE SAME LENGTH")
-        sys.exit(1)
-    
     # Calculate angle between goal and velocity (for dynamic primitives length)
     q0, q1, q2, q3 = current_state[3:7]
     vx, vy, vz = body_to_global_velocity((q0, q1, q2, q3), current_state[7:10])
@@ -172,17 +168,73 @@ def process_input_pair(inputs, current_state, sim, map_instance, numberTree):
     # Orientation 
     alpha = calculate_angle_goalVector(current_state, v_vector, map_instance, numberTree)
 
-    # Get all the points within one single input primitive
-    data, cost, inObs, arrived, finalState = sim.curvePrimitives(current_state, inputs[0 : inputLen//2], inputs[inputLen//2 : inputLen], map_instance, alpha, numberTree)
-    if not inObs:
-        neighbour = data[:,-1]
-        cost_path = cost
+    # Get all the points of all the primitives
+    data, cost, inObs, arrived = sim.curvePrimitives_batch(current_state, inputs_batch, map_instance, alpha, numberTree)
 
-        # Return (allPoints, (lastPoint, costPath), boolInObstacle, boolArrived, stateInGoal(or None))
-        return data, (neighbour, cost_path), inObs, arrived  
-    
-    # If no valid primitive is available, return an empty array
-    return np.array([]), ([], -1), inObs, arrived
+    return inObs, arrived, cost, data[~inObs]
+
+def unpack_primitive_batch(inObs, arrived, cost, data):
+    '''Converts the compact arrays of process_input_batch to a list with (allPoints, (lastPoint, costPath), boolInObstacle, boolArrived) for each primitive'''
+
+    results = []
+    jj = 0
+    for ii in range(len(inObs)):
+        if not inObs[ii]:
+            results.append((data[jj].T, (data[jj, -1], cost[ii]), False, arrived[ii]))
+            jj += 1
+        else:
+            results.append((np.array([]), ([], -1), True, False))
+
+    return results
+
+# State of the worker processes, see init_primitive_worker
+primitive_worker = {}
+
+def init_primitive_worker(map_instance):
+    '''Each worker holds its own simulator and map for the whole search'''
+
+    primitive_worker["sim"] = SAM_PRIMITIVES()
+    primitive_worker["map_instance"] = map_instance
+
+def expand_input_batch(current_state, inputs_batch, numberTree):
+    '''This is the function run by the workers, see process_input_batch'''
+
+    return process_input_batch(inputs_batch, current_state, primitive_worker["sim"], primitive_worker["map_instance"], numberTree)
+
+class PrimitiveWorkerPool:
+    """
+    Long-lived worker processes for the primitive generation, created once per search. The workers hold their own simulator and
+    map (see init_primitive_worker), so the expansion of a node only sends the current state and batches of inputs.
+    """
+
+    def __init__(self, map_instance, n_workers=None):
+        self.n_workers = multiprocessing.cpu_count() if n_workers is None else n_workers
+        self.pool = multiprocessing.Pool(self.n_workers, initializer=init_primitive_worker, initargs=(map_instance,))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+    def expand(self, current_state, full_input_pairs, numberTree):
+        """
+        Compute the primitives of all the inputs from current_state. The results have the same format as unpack_primitive_batch
+        """
+
+        # One vectorized batch per worker
+        batches = [batch for batch in np.array_split(full_input_pairs, self.n_workers) if len(batch) > 0]
+        batch_results = self.pool.starmap(expand_input_batch, [(current_state, batch, numberTree) for batch in batches])
+
+        results = []
+        for batch_result in batch_results:
+            results += unpack_primitive_batch(*batch_result)
+
+        return results
 
 def compute_current_orientationVector(state, map_inst, numberTree, type = "normal"):
     """
@@ -241,9 +293,44 @@ def compute_current_velocity_pointA(vertex):
 
     return v_fwd_inertial
 
-def get_neighbors(current, sim, map_instance, numberTree):
+def create_simulator():
+    """
+    This function creates the primitives simulator, with the precomputed primitive library if GlobalVariables.PRIMITIVE_LIBRARY is set
     """
-    This function is used to compute the motion primitives for the current state.
+
+    sim = SAM_PRIMITIVES()
+
+    if glbv.PRIMITIVE_LIBRARY is not None:
+        library = PrimitiveLibrary.load(glbv.PRIMITIVE_LIBRARY, sim)
+        if library.inputs.shape == primitive_inputs().shape and np.all(library.inputs == primitive_inputs()):
+            sim.library = library
+        else:
+            print("The primitive library was computed for different inputs, simulating all the primitives")
+
+    return sim
+
+def process_library_primitives(primitives, current_state, sim, map_instance, numberTree):
+    '''This function evaluates the precomputed primitives of the library, the results have the same format as unpack_primitive_batch'''
+
+    # Calculate angle between goal and velocity (for dynamic primitives length)
+    q0, q1, q2, q3 = current_state[3:7]
+    vx, vy, vz = body_to_global_velocity((q0, q1, q2, q3), current_state[7:10])
+    v_vector = np.array([vx, vy, vz])
+
+    # Orientation 
+    alpha = calculate_angle_goalVector(current_state, v_vector, map_instance, numberTree)
+    n_sim = sim.computePrimitiveLength(alpha)
+
+    # Check all the primitives at once
+    data, cost, inObs, arrived = sim.checkPrimitives_batch(primitives[:, 0:n_sim], map_instance, numberTree)
+
+    # Return (allPoints, (lastPoint, costPath), boolInObstacle, boolArrived) for each primitive
+    return unpack_primitive_batch(inObs, arrived, cost, data[~inObs])
+
+def get_neighbors(current, sim, map_instance, numberTree, pool=None):
+    """
+    This function is used to compute the motion primitives for the current state. If pool (PrimitiveWorkerPool) is given,
+    the primitives are computed by its workers, otherwise all at once in this process.
 
     This function will return:
     1) A list containing all the valid primitives (all the states within all the valid primitives)
@@ -252,46 +339,25 @@ def get_neighbors(current, sim, map_instance, numberTree):
     4) The final state and cost if we arrived at the goal
     """
     
-    dynamic_step = 3
-
     # Initialize variables
-    max_input = 7
-    step_input = dynamic_step
     reached_states = []
     last_states = []
 
-    # Change the inputs for the primitives
-    '''
-    The inputs are defined like: inputs = (values, indices of u)
-
-    An example of inputs: 
-    --> If I want to change only the RPM to 500, I will write: full_input_pairs = np.array([[500, 4]])
-    '''
-
-    # 1 # Define the inputs 
-    rudder_inputs = np.arange(-max_input, max_input, step_input)
-    stern_inputs = np.array([-7, 0, 7])
-    vbs_inputs = np.array([10, 50, 90])
-    lcg_inputs = np.array([0, 50, 100])
-    rpm_inputs = np.arange(-1000, 1000, 200)
+    # Get the inputs for the primitives
+    full_input_pairs = primitive_inputs()
 
-    # 2 # Add the name of the input into np.meshgrid(), and change the second value of .reshape(., THIS)
-    input_pairs = np.array(np.meshgrid(rudder_inputs, rpm_inputs, vbs_inputs, lcg_inputs, stern_inputs)).T.reshape(-1,5)
-
-    # 3 # Add the index in u of the input you modified in np.tile([..., HERE], ...)
-    additional_values = np.tile([3, 4, 0, 1, 2], (input_pairs.shape[0], 1))
-
-    # 4 # Do not touch
-    full_input_pairs = np.hstack((input_pairs, additional_values))
-
-    # 5 # Control all the inputs for tests if needed 
-    #full_input_pairs = np.array([[-1000, 4]]) 
-
-    # Parallelize the creation of primitives
+    # Use the precomputed primitives if available, otherwise simulate them
     arrived = False
-    results = Parallel(n_jobs=multiprocessing.cpu_count())(
-        delayed(process_input_pair)(inputs, current.state, sim, map_instance, numberTree) for inputs in full_input_pairs
-    ) 
+    primitives = None
+    if sim.library is not None:
+        primitives = sim.library.get_primitives(current.state)
+
+    if primitives is not None:
+        results = process_library_primitives(primitives, current.state, sim, map_instance, numberTree)
+    elif pool is not None:
+        results = pool.expand(current.state, full_input_pairs, numberTree)
+    else:
+        results = unpack_primitive_batch(*process_input_batch(full_input_pairs, current.state, sim, map_instance, numberTree))
 
     # Save the generated primitives
     arrived_atLeast_one = False
@@ -528,9 +594,18 @@ def double_a_star_search(ax, plt, map_instance, realTimeDraw, typeF_function, de
     This function returns (trajectory, successfulZeroOrOne, totalCost)
     """
 
+    # The worker processes for the primitives live as long as the search
+    with PrimitiveWorkerPool(map_instance) as pool:
+        return _double_a_star_search(ax, plt, map_instance, realTimeDraw, typeF_function, dec, pool)
+
+def _double_a_star_search(ax, plt, map_instance, realTimeDraw, typeF_function, dec, pool):
+    """
+    The search of double_a_star_search, using the worker pool for the primitives
+    """
+
     # Initialise general variables (valid for both trees)
     random.seed()
-    sim = SAM_PRIMITIVES()
+    sim = create_simulator()
     dt_resolution = glbv.RESOLUTION_DT
     flag = 0    # for number of iterations
     nMaxIterations = 300
@@ -617,7 +692,7 @@ def double_a_star_search(ax, plt, map_instance, realTimeDraw, typeF_function, de
 
                     # Create the list containing the two nodes to be connected
                     list_connection_full = []
-                    for _ in range(10): # If you change it, you have to recompile Acados!
+                    for _ in range(10): # The solver of the horizon bucket is used, see glbv.HORIZON_BUCKETS
                         list_connection_full.append(list_connection[0])
                     list_connection_full.append(second_path[-1])
                     
@@ -703,13 +778,13 @@ def double_a_star_search(ax, plt, map_instance, realTimeDraw, typeF_function, de
 
         # Find new neighbors (last point of the primitives) using the motion primitives
         if not arrivedPoint:
-            reached_states, last_states, neighbor_arrived, final = get_neighbors(current_node, sim, map_instance, 1)
+            reached_states, last_states, neighbor_arrived, final = get_neighbors(current_node, sim, map_instance, 1, pool)
             finalLast = final[0] # in case we arrived
             finalCost = final[1] # in case we arrived 
 
         # Find new neighbors for second tree (last point of the primitives) using the motion primitives
         if not arrivedPoint_secondTree:
-            reached_states_secondTree, last_states_secondTree, neighbor_arrived_secondTree, final_secondTree = get_neighbors(current_node_secondTree, sim, map_instance, 2)
+            reached_states_secondTree, last_states_secondTree, neighbor_arrived_secondTree, final_secondTree = get_neighbors(current_node_secondTree, sim, map_instance, 2, pool)
             finalLast_secondTree = final_secondTree[0] # in case we arrived
             finalCost_secondTree = final_secondTree[1] # in case we arrived 
 
@@ -822,9 +897,18 @@ def a_star_search(ax, plt, map_instance, realTimeDraw, typeF_function, dec):
     This function returns (trajectory, successfulZeroOrOne, totalCost)
     """
 
+    # The worker processes for the primitives live as long as the search
+    with PrimitiveWorkerPool(map_instance) as pool:
+        return _a_star_search(ax, plt, map_instance, realTimeDraw, typeF_function, dec, pool)
+
+def _a_star_search(ax, plt, map_instance, realTimeDraw, typeF_function, dec, pool):
+    """
+    The search of a_star_search, using the worker pool for the primitives
+    """
+
     # Initialise general variables (valid for both trees)
     random.seed()
-    sim = SAM_PRIMITIVES()
+    sim = create_simulator()
     dt_resolution = glbv.RESOLUTION_DT
     flag = 0    # for number of iterations
     nMaxIterations = 300
@@ -868,7 +952,7 @@ def a_star_search(ax, plt, map_instance, realTimeDraw, typeF_function, dec):
             break
 
         # Find new neighbors (last point of the primitives) using the motion primitives
-        reached_states, last_states, arrivedPoint, final = get_neighbors(current_node, sim, map_instance, 1)
+        reached_states, last_states, arrivedPoint, final = get_neighbors(current_node, sim, map_instance, 1, pool)
         finalLast = final[0] # in case we arrived
         finalCost = final[1] # in case we arrived 
 
@@ -11,4 +11,14 @@ ARRIVED_PRIM = 0
 ARRIVED_PRIM_SECONDTREE = 0
 
 # Map instance
-MAP_INSTANCE = None
\ No newline at end of file
+MAP_INSTANCE = None
+
+# Precomputed primitive library (path without extension, see PrimitiveLibrary.py), None to simulate all the primitives
+PRIMITIVE_LIBRARY = None
+
+# Directory of the compiled acados solvers (see SolverCache.py), None for MotionPrimitives/acados_solver_cache
+SOLVER_CACHE_DIR = None
+
+# Horizons of the compiled double tree solvers, shorter problems are padded to the next one (see SolverCache.py).
+# The double tree connection uses 11 waypoints.
+HORIZON_BUCKETS = (11, 20, 40, 80, 160)
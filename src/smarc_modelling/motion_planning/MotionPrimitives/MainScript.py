@@ -7,6 +7,8 @@ from smarc_modelling.motion_planning.MotionPrimitives.GenerationTree import a_st
 from smarc_modelling.motion_planning.MotionPrimitives.PlotResults import *
 from smarc_modelling.motion_planning.MotionPrimitives.trm_colors import *
 from smarc_modelling.motion_planning.MotionPrimitives.StatisticalAnalysis import runStatisticalAnalysis
+from smarc_modelling.motion_planning.MotionPrimitives.OptimizationAcados_singleTree import precompile_singleTree
+from smarc_modelling.motion_planning.MotionPrimitives.OptimizationAcados_doubleTree import precompile_doubleTree
 #from smarc_modelling.sam_sim import plot_results, Sol
 import time
 import matplotlib.animation as animation
@@ -133,6 +135,17 @@ def MotionPlanningAlgorithm(realTimeDraw, map_instance):
         print(f"{bcolors.OKGREEN}[ OK ]{bcolors.ENDC}")
     print(f"{bcolors.OKGREEN}THE END{bcolors.ENDC}")
 
+def prepareMotionPlanningROS():
+    """
+    Compile (or load from the solver cache) the acados solvers used by MotionPlanningROS: the single tree solver and one
+    double tree solver per horizon bucket. Call it once when the ROS node starts, then every query only solves.
+    """
+
+    print(">> Preparing the acados solvers")
+    precompile_singleTree()
+    precompile_doubleTree()
+    print(f"{bcolors.OKGREEN}[ OK ]{bcolors.ENDC}")
+
 def MotionPlanningROS(start_state, goal_state, map_boundaries, map_resolution):
     """
     This is the function called by the ROS node. It takes:
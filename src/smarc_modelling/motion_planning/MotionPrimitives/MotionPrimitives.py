@@ -5,11 +5,53 @@ import smarc_modelling.motion_planning.MotionPrimitives.GlobalVariables as glbv
 import sys
 sys.path.append('~/Desktop/smarc_modelling-master')
 from smarc_modelling.vehicles.SAM import SAM
+from smarc_modelling.lib.integrators import euler
 from mpl_toolkits.mplot3d import Axes3D
 from smarc_modelling.motion_planning.MotionPrimitives.ObstacleChecker import *
 import math
 
 
+def primitive_inputs():
+    """
+    This function returns the input combinations used for the motion primitives, as an array of (values, indices of u)
+    """
+
+    dynamic_step = 3
+
+    # Initialize variables
+    max_input = 7
+    step_input = dynamic_step
+
+    # Change the inputs for the primitives
+    '''
+    The inputs are defined like: inputs = (values, indices of u)
+
+    An example of inputs: 
+    --> If I want to change only the RPM to 500, I will write: full_input_pairs = np.array([[500, 4]])
+    '''
+
+    # 1 # Define the inputs 
+    rudder_inputs = np.arange(-max_input, max_input, step_input)
+    stern_inputs = np.array([-7, 0, 7])
+    vbs_inputs = np.array([10, 50, 90])
+    lcg_inputs = np.array([0, 50, 100])
+    rpm_inputs = np.arange(-1000, 1000, 200)
+
+    # 2 # Add the name of the input into np.meshgrid(), and change the second value of .reshape(., THIS)
+    input_pairs = np.array(np.meshgrid(rudder_inputs, rpm_inputs, vbs_inputs, lcg_inputs, stern_inputs)).T.reshape(-1,5)
+
+    # 3 # Add the index in u of the input you modified in np.tile([..., HERE], ...)
+    additional_values = np.tile([3, 4, 0, 1, 2], (input_pairs.shape[0], 1))
+
+    # 4 # Do not touch
+    full_input_pairs = np.hstack((input_pairs, additional_values))
+
+    # 5 # Control all the inputs for tests if needed 
+    #full_input_pairs = np.array([[-1000, 4]]) 
+
+    return full_input_pairs
+
+
 class SAM_PRIMITIVES():
     def __init__(self):
 
@@ -26,7 +68,14 @@ class SAM_PRIMITIVES():
         # Create SAM instance
         self.sam = SAM(self.dt)
 
-    def dynamics_wrapper(self, x, ds_inputs, indexes):
+        # Bounds of the dynamic primitive length, see computePrimitiveLength (in seconds)
+        self.maxPrimitiveLength = 3
+        self.minPrimitiveLength = 1.5
+
+        # Optional precomputed primitives, see PrimitiveLibrary.py
+        self.library = None
+
+    def get_input(self, ds_inputs, indexes):
         """
         u: control inputs as [x_vbs, x_lcg, delta_s (rad), delta_r (rad), rpm1, rpm2]
         index: 2 for vertical primitives and 3 for horizontal primitives
@@ -51,15 +100,20 @@ class SAM_PRIMITIVES():
             else:
                 u[int(indexes[ii])] = ds_inputs[ii]
 
-        return self.sam.dynamics(x, u)
+        return u
+
+    def dynamics_wrapper(self, x, ds_inputs, indexes):
+        """
+        Dynamics of SAM for the primitive inputs, see get_input
+        """
+        return self.sam.dynamics(x, self.get_input(ds_inputs, indexes))
 
     def curvePrimitives_singleStep(self, x, ds_inputs, indexes):
         '''
         dynamical model with forward Euler, it returns a SINGLE step within one primitive and the cost for such step
         '''
 
-        data = np.empty(len(x)) 
-        data[:] = x + self.dynamics_wrapper(x, ds_inputs, indexes) * self.dt 
+        data = euler(x, self.get_input(ds_inputs, indexes), self.dt, self.sam.dynamics)
         cost = self.computeCost(x, data[:])
 
         return data, cost
@@ -90,27 +144,8 @@ class SAM_PRIMITIVES():
             d: True if at least one point of the primitive lies in the goal area, False otherwise
         '''
 
-        # Compute the dynamical value for the primitiveLength
-        maxValue = 3 
-        minValue = 1.5
-        stepAngle = 85
-        MinAngle = np.min([angle, np.pi- angle])
-        if np.rad2deg(MinAngle) < stepAngle:
-            # Increasing exponential
-            #computedSpan = minValue*np.exp(np.log(maxValue/minValue)*np.rad2deg(MinAngle)*1/stepAngle)
-
-            # Decreasing exponential
-            computedSpan = maxValue*np.exp(np.log(minValue/maxValue)*np.rad2deg(MinAngle)*1/stepAngle)
-        else:
-            # Incr
-            #computedSpan = maxValue
-
-            # Decr
-            computedSpan = minValue
-
         # Compute the dynamic t_span
-        self.t_span = (0, computedSpan)
-        self.n_sim = int(self.t_span[1]/self.dt)
+        self.computePrimitiveLength(angle)
 
         # Initialize the variables
         cost_sum = 0
@@ -143,6 +178,134 @@ class SAM_PRIMITIVES():
                 
         return data, cost_sum, False, arrivedPointBefore, finalState
 
+    def curvePrimitives_batch(self, x0, inputs, map_instance, angle, numberTree):
+        '''
+        Vectorized curvePrimitives: all the M input combinations (M, 2*nInputs) are simulated at once from x0 as an (M, 19) array.
+        The primitives that leave the map are not simulated further, the ones that arrived at the goal keep their arrival state.
+
+        The output will be (a, b, c, d), where:
+            a: (M, n_sim, 19) sequence of points of all the primitives
+            b: (M,) the costs of the primitives
+            c: (M,) True if at least one point of the primitive lies outside the map
+            d: (M,) True if at least one point of the primitive lies in the goal area
+        '''
+
+        # Compute the dynamic t_span
+        self.computePrimitiveLength(angle)
+
+        # One control vector per input combination
+        inputLen = inputs.shape[1]
+        u = np.array([self.get_input(inputs_ii[0 : inputLen//2], inputs_ii[inputLen//2 : inputLen]) for inputs_ii in inputs])
+
+        # Initialize the variables
+        M = len(inputs)
+        data = np.empty((M, self.n_sim, len(x0)))
+        data[:, 0] = x0
+        cost_sum = np.zeros(M)
+        cost = np.zeros(M)
+        inObs = np.zeros(M, bool)
+        arrivedPoint = np.zeros(M, bool)
+
+        for i in range(self.n_sim - 1):
+            # Only the primitives inside the map and not yet at the goal are simulated
+            active = np.flatnonzero(~inObs & ~arrivedPoint)
+            if len(active) == 0:
+                data[:, i+1:] = data[:, i, None]
+                cost_sum += (self.n_sim - 1 - i) * cost
+                break
+
+            data[:, i+1] = data[:, i]
+            data[active, i+1] = euler(data[active, i], u[active], self.dt, self.sam.dynamics_batch)
+            cost[active] = np.linalg.norm(data[active, i+1, 0:3] - data[active, i, 0:3], axis=1)
+
+            # As in curvePrimitives, the primitives at the goal keep adding the cost of their last step
+            cost_sum += cost
+
+            # Find point A and B. If outside the map, reject the primitive
+            pointA, pointB = compute_AB_points_batch(data[active, i+1])
+            outside = IsOutsideTheMap_batch(pointA, map_instance) | IsOutsideTheMap_batch(pointB, map_instance)
+            inObs[active[outside]] = True
+
+            # If arrived at the goal
+            inGoal = arrived_batch(data[active, i+1, 0:3], map_instance, numberTree) \
+                    | arrived_batch(pointA, map_instance, numberTree) \
+                    | arrived_batch(pointB, map_instance, numberTree)
+            arrivedPoint[active[inGoal & ~outside]] = True
+
+        if np.any(arrivedPoint) and glbv.ARRIVED_PRIM == 0:
+            print("DONE!")
+            glbv.ARRIVED_PRIM = 1
+
+        return data, cost_sum, inObs, arrivedPoint
+
+    def computePrimitiveLength(self, angle):
+        """
+        Set the length of the primitives (self.t_span and self.n_sim) based on the misalignment angle between velocity and goal
+        """
+
+        # Compute the dynamical value for the primitiveLength
+        maxValue = self.maxPrimitiveLength
+        minValue = self.minPrimitiveLength
+        stepAngle = 85
+        MinAngle = np.min([angle, np.pi- angle])
+        if np.rad2deg(MinAngle) < stepAngle:
+            # Increasing exponential
+            #computedSpan = minValue*np.exp(np.log(maxValue/minValue)*np.rad2deg(MinAngle)*1/stepAngle)
+
+            # Decreasing exponential
+            computedSpan = maxValue*np.exp(np.log(minValue/maxValue)*np.rad2deg(MinAngle)*1/stepAngle)
+        else:
+            # Incr
+            #computedSpan = maxValue
+
+            # Decr
+            computedSpan = minValue
+
+        # Compute the dynamic t_span
+        self.t_span = (0, computedSpan)
+        self.n_sim = int(self.t_span[1]/self.dt)
+
+        return self.n_sim
+
+    def checkPrimitives_batch(self, data, map_instance, numberTree):
+        """
+        Applies the checks of curvePrimitives to already simulated primitives.
+
+        data is an (M, n_sim, 19) array with M primitives starting in data[:, 0]. It returns (a, b, c, d), where:
+            a: the primitives, where the states after arriving at the goal are replaced by the arrival state (as in curvePrimitives)
+            b: (M,) costs of the primitives
+            c: (M,) True if at least one point of the primitive lies outside the map
+            d: (M,) True if at least one point of the primitive lies in the goal area
+        """
+
+        n_sim = data.shape[1]
+        steps = np.arange(n_sim - 1)
+
+        # Find point A and B, check the goal area for all the steps
+        pointA, pointB = compute_AB_points_batch(data[:, 1:])
+        inGoal = arrived_batch(data[:, 1:, 0:3], map_instance, numberTree) \
+                | arrived_batch(pointA, map_instance, numberTree) \
+                | arrived_batch(pointB, map_instance, numberTree)
+        arrivedPoint = np.any(inGoal, axis=1)
+        if np.any(arrivedPoint) and glbv.ARRIVED_PRIM == 0:
+            print("DONE!")
+            glbv.ARRIVED_PRIM = 1
+
+        # Index of the last simulated step, the following ones stay in the arrival state
+        lastStep = np.where(arrivedPoint, np.argmax(inGoal, axis=1), n_sim - 2)
+        frozen = np.minimum(np.arange(n_sim), lastStep[:, None] + 1)
+        data = np.take_along_axis(data, frozen[:, :, None], axis=1)
+
+        # If outside the map before arriving, reject the primitive
+        outside = IsOutsideTheMap_batch(pointA, map_instance) | IsOutsideTheMap_batch(pointB, map_instance)
+        inObs = np.any(outside & (steps[None, :] <= lastStep[:, None]), axis=1)
+
+        # Cost of each step. As in curvePrimitives, the cost of the last simulated step is also added for the steps after arriving
+        stepCost = np.linalg.norm(np.diff(data[:, :, 0:3], axis=1), axis=2)
+        cost = np.sum(stepCost, axis=1) + (n_sim - 2 - lastStep) * stepCost[np.arange(len(data)), lastStep]
+
+        return data, cost, inObs, arrivedPoint & ~inObs
+
     def curvePrimitives_justToShow(self, x0, ds_inputs, indexes_u):
         '''
         ONLY USED FOR PLOTTING THE PRIMITIVES IN THIS SCRIPT
@@ -120,6 +120,62 @@ def compute_B_point_backward(state, distance=0.655):
 
     return tuple(new_point)
 
+def compute_forward_vector_batch(states):
+    """
+    Unit forward vectors (body x-axis in the world frame) for an (..., 19) array of states
+    """
+
+    # Normalized quaternions
+    q = states[..., 3:7]
+    q = q / np.linalg.norm(q, axis=-1, keepdims=True)
+    q0, q1, q2, q3 = q[..., 0], q[..., 1], q[..., 2], q[..., 3]
+
+    # First column of the rotation matrix
+    forward_world = np.stack([1 - 2*(q2**2 + q3**2),
+                              2*(q1*q2 + q0*q3),
+                              2*(q1*q3 - q0*q2)], axis=-1)
+
+    return forward_world
+
+def compute_AB_points_batch(states, distance=0.655):
+    """
+    Batched version of compute_A_point_forward and compute_B_point_backward. Returns the (..., 3) arrays of A and B points
+    """
+
+    forward_world = compute_forward_vector_batch(states)
+    position = states[..., 0:3]
+
+    return position + distance * forward_world, position - distance * forward_world
+
+def IsOutsideTheMap_batch(points, map_instance):
+    """
+    Batched version of IsOutsideTheMap for an (..., 3) array of points. Returns a boolean array
+    """
+
+    # Boundaries of the map
+    radius = 0.095
+    lower = np.array([map_instance["x_min"], map_instance["y_min"], map_instance["z_min"]]) + radius
+    upper = np.array([map_instance["x_max"], map_instance["y_max"], map_instance["z_max"]]) - radius
+
+    # Inside only if strictly within the boundaries in all directions
+    inside = np.all((points > lower) & (points < upper), axis=-1)
+
+    return ~inside
+
+def arrived_batch(points, map_instance, numberTree):
+    """
+    Batched version of arrived for an (..., 3) array of points. Returns a boolean array, without printing
+    """
+
+    # Compute goal area
+    TILESIZE = map_instance["TileSize"]
+    if numberTree == 1:
+        goal = np.asarray(map_instance["goal_pixel"][0:3], float)
+    else:
+        goal = np.asarray(map_instance["start_pos"][0:3], float)
+
+    return np.all(np.abs(points - goal) <= 0.5 * TILESIZE, axis=-1)
+
 def body_to_global_velocity(quaternion, body_velocity):
 
     """
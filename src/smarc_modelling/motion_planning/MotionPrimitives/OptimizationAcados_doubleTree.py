@@ -1,12 +1,13 @@
 import numpy as np
 import os
 from casadi import SX, vertcat, sqrt
-from acados_template import AcadosOcp, AcadosOcpSolver, AcadosModel
+from acados_template import AcadosOcp
 from smarc_modelling.control.control import *
 from smarc_modelling.vehicles.SAM_casadi import *
 import smarc_modelling.motion_planning.MotionPrimitives.GlobalVariables as glbv
+from smarc_modelling.motion_planning.MotionPrimitives.SolverCache import get_solver, horizon_bucket, add_time_scale, set_effective_horizon
 
-from casadi import SX, MX, vertcat, sqrt, horzcat
+from casadi import SX, vertcat, sqrt, horzcat
 
 def compute_A_point_forward_casadi(state, distance=0.655):
     """
@@ -94,12 +95,17 @@ def compute_B_point_backward_casadi(state, distance=0.655):
 
 # Create an OCP object
 def create_ocp(model, x0, x_last, N, map_instance):
+    '''
+    The OCP is compiled for the horizon bucket of N, see SolverCache.py. x0, x_last and the map bounds are
+    only set as bounds and references, they are changed at runtime without recompiling.
+    '''
 
     # Initialization Acados + options
     ocp = AcadosOcp()
-    ocp.model = model
+    ocp.model = add_time_scale(model)
+    ocp.parameter_values = np.ones(1)
     ts = glbv.RESOLUTION_DT
-    N_horizon = N
+    N_horizon = horizon_bucket(N)
     ocp.solver_options.N_horizon = N_horizon
     ocp.solver_options.tf = N_horizon*ts  
     ocp.solver_options.qp_solver = 'PARTIAL_CONDENSING_HPIPM'
@@ -223,29 +229,9 @@ def optimization_acados_doubleTree(waypoints, map_instance):
     #ocp = create_ocp(model, waypoints[0], waypoints[-1], len(waypoints), map_instance)
     ocp = create_ocp(model, waypoints[0], waypoints[-1], len(waypoints), map_instance)   # give waypoints[0] as the last for debugging!
 
-    # Solver setup
-    # Set directory for code generation
-    this_file_dir = os.path.dirname(os.path.abspath(__file__))
-    #root_files_dir = '/home/parallels/Desktop/smarc_modelling-master/src/smarc_modelling/motion_planning/MotionPrimitives'
-    #package_root = os.path.abspath(os.path.join(this_file_dir, '..'))
-    package_root = os.path.abspath(this_file_dir)
-    codegen_dir = os.path.join(package_root, 'optimization_double_connection')
-    ocp_dir = os.path.join(codegen_dir, 'acados_ocp.json')
-    os.makedirs(codegen_dir, exist_ok=True)
-    ocp.code_export_directory = codegen_dir
-    print(f"ext package acados dir: {codegen_dir}")        
-
-    # Solve Acados (For compiling, change both flags to true)
-    ocp_solver = AcadosOcpSolver(ocp, json_file=ocp_dir, generate=False, build=False)
-
-    # Change y_ref of last point
-    ocp_solver.set(N, "y_ref", waypoints[-1])
-
-    # Change x0 
-    ocp_solver.set(0, "lbx", waypoints[0])
-    ocp_solver.set(0, "ubx", waypoints[0]) 
-
-
+    # Solver setup: compiled once per horizon bucket, x0, y_ref of the last point and the bounds are set at runtime
+    ocp_solver = get_solver(ocp)
+    set_effective_horizon(ocp_solver, N)
 
     # Set initial guess from waypoints
     '''
@@ -263,9 +249,27 @@ def optimization_acados_doubleTree(waypoints, map_instance):
         print("Optimization successful!")
     # Extract the optimized waypoints and save them
     optimized_waypoints = []
-    for i in range(ocp.dims.N + 1):
+    for i in range(N + 1):
         x_opt = ocp_solver.get(i, "x")
         optimized_waypoints.append(x_opt)
 
     # Return optimized waypoints
     return optimized_waypoints, status
+
+def precompile_doubleTree(horizons=None):
+    """
+    Compile (or load from the solver cache) the solvers of all the horizon buckets, e.g. when the ROS node starts
+    """
+
+    if horizons is None:
+        horizons = glbv.HORIZON_BUCKETS
+
+    dt = glbv.RESOLUTION_DT
+    sam = SAM_casadi(dt)
+    x0 = np.zeros(19)
+    x0[3] = 1
+    map_instance = {"x_min": 0, "y_min": 0, "z_min": 0, "x_max": 1, "y_max": 1, "z_max": 1}
+
+    for N in horizons:
+        nmpc = NMPC(sam, dt, N, False)
+        get_solver(create_ocp(nmpc.export_dynamics_model(sam), x0, x0, N, map_instance))
@@ -1,12 +1,13 @@
 import numpy as np
 import os
 from casadi import SX, vertcat, sqrt
-from acados_template import AcadosOcp, AcadosOcpSolver, AcadosModel
+from acados_template import AcadosOcp
 from smarc_modelling.control.control import *
 from smarc_modelling.vehicles.SAM_casadi import *
 import smarc_modelling.motion_planning.MotionPrimitives.GlobalVariables as glbv
+from smarc_modelling.motion_planning.MotionPrimitives.SolverCache import get_solver
 
-from casadi import SX, MX, vertcat, sqrt, horzcat
+from casadi import SX, vertcat, sqrt, horzcat
 
 def compute_A_point_forward_casadi(state, distance=0.655):
     """
@@ -247,15 +248,8 @@ def optimization_acados_singleTree(waypoints, map_instance):
     # Create ocp
     ocp = create_ocp(model, waypoints[0], waypoints[-1], len(waypoints), map_instance)
 
-    # Solver setup
-    # Set directory for code generation
-    this_file_dir = os.path.dirname(os.path.abspath(__file__))
-    package_root = os.path.abspath(os.path.join(this_file_dir, '..'))
-    codegen_dir = os.path.join(package_root, 'optimization_single_velocity')
-    os.makedirs(codegen_dir, exist_ok=True)
-    ocp.code_export_directory = codegen_dir
-    print(f"ext package acados dir: {codegen_dir}")        
-    ocp_solver = AcadosOcpSolver(ocp, json_file='acados_ocp.json', generate=True, build=True)
+    # Solver setup: compiled once per OCP structure, x0 and the bounds are set at runtime
+    ocp_solver = get_solver(ocp)
 
     # Set initial guess from waypoints
     '''
@@ -274,7 +268,7 @@ def optimization_acados_singleTree(waypoints, map_instance):
 
     # Extract the optimized waypoints and save them
     optimized_waypoints = []
-    for i in range(ocp.dims.N + 1):
+    for i in range(ocp_solver.N + 1):
         x_opt = ocp_solver.get(i, "x")
         optimized_waypoints.append(x_opt)
 
@@ -283,3 +277,18 @@ def optimization_acados_singleTree(waypoints, map_instance):
 
     # Return optimized waypoints
     return optimized_waypoints, status
+
+def precompile_singleTree():
+    """
+    Compile (or load from the solver cache) the solver, e.g. when the ROS node starts
+    """
+
+    dt = glbv.RESOLUTION_DT
+    sam = SAM_casadi(dt)
+    x0 = np.zeros(19)
+    x0[3] = 1
+    map_instance = {"x_min": 0, "y_min": 0, "z_min": 0, "x_max": 1, "y_max": 1, "z_max": 1,
+                    "TileSize": 1, "goal_pixel": (0, 0, 0)}
+
+    nmpc = NMPC(sam, dt, 1, True)
+    get_solver(create_ocp(nmpc.export_dynamics_model(sam), x0, x0, 1, map_instance))
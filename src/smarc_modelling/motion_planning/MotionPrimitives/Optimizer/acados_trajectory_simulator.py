@@ -11,6 +11,7 @@ import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
 import numpy as np
 from smarc_modelling.motion_planning.MotionPrimitives.Optimizer.control import *
+from smarc_modelling.control.tracking import TrackingLoop
 
 from smarc_modelling.vehicles import *
 from smarc_modelling.lib import *
@@ -86,75 +87,22 @@ def main(trajectory, Q, N_hor, T_s, map_instance):       ##CHANGE: input traject
     Nsim = (trajectory.shape[0])            # The sim length should be equal to the number of waypoints
     x_axis = np.linspace(0, Ts*Nsim, Nsim)
 
-    simU = np.zeros((Nsim, nu))     # Matrix to store the optimal control derivative
-    simX = np.zeros((Nsim+1, nx))   # Matrix to store the simulated states
-
-
     # Declare the initial state
     x0 = trajectory[0] 
-    simX[0,:] = x0
-
-    # Augment the trajectory and control input reference 
-    Uref = np.zeros((trajectory.shape[0], nu))  # Derivative reference - set to 0 to penalize fast control changes
-    trajectory = np.concatenate((trajectory, Uref), axis=1) 
 
     # Run the MPC setup
     ocp_solver, integrator = nmpc.setup(x0, map_instance)
 
-    # Initialize the state and control vector as David does
-    for stage in range(N_horizon + 1):
-        ocp_solver.set(stage, "x", x0)
-    for stage in range(N_horizon):
-        ocp_solver.set(stage, "u", np.zeros(nu,))
-
-    # Array to store the time values
-    t = np.zeros((Nsim))
-
-    # closed loop - simulation
-    for i in range(Nsim):
-        #print(f"Nsim: {i}")
-
-        # extract the sub-trajectory for the horizon
-        if i <= (Nsim - N_horizon):
-            ref = trajectory[i:i + N_horizon, :]
-        else:
-            ref = trajectory[i:, :]
-
-        # Update reference vector
-        # If the end of the trajectory has been reached, (ref.shape < N_horizon)
-        # set the following waypoints in the horizon to the last waypoint of the trajectory
-        for stage in range(N_horizon):
-            #print(ref.shape[0], stage)
-            if ref.shape[0] < N_horizon and ref.shape[0] != 0:
-                ocp_solver.set(stage, "p", ref[ref.shape[0]-1,:])
-            else:
-                ocp_solver.set(stage, "p", ref[stage,:])
-
-        # Set the terminal state reference
-        ocp_solver.set(N_horizon, "yref", ref[-1,:nx])
- 
-        # Set current state
-        ocp_solver.set(0, "lbx", simX[i, :])
-        ocp_solver.set(0, "ubx", simX[i, :])
-
-        # solve ocp and get next control input
-        status = ocp_solver.solve()
-        #ocp_solver.print_statistics()
-
-
-        # simulate system
-        t[i] = ocp_solver.get_stats('time_tot')
-        simU[i, :] = ocp_solver.get(0, "u")
-        X_eval = ocp_solver.get(0, "x")
-        simX[i+1, :] = integrator.simulate(x=simX[i, :], u=simU[i, :])
+    # closed loop - simulation, warm started with the shifted previous solution
+    tracker = TrackingLoop(ocp_solver, integrator)
+    simX, simU, status = tracker.simulate(trajectory)
 
     list_waypoints = simX.tolist()
     return list_waypoints, status
 
     '''
     # evaluate timings
-    t *= 1000  # scale to milliseconds
-    print(f'Computation time in ms:\n min: {np.min(t):.3f}\nmax: {np.max(t):.3f}\navg: {np.average(t):.3f}\nstdev: {np.std(t)}\nmedian: {np.median(t):.3f}')
+    tracker.print_timing()
 
 
     # plot results
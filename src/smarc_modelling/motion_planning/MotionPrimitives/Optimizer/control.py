@@ -1,5 +1,6 @@
 # Script for the acados NMPC model
 from acados_template import AcadosOcp, AcadosOcpSolver, AcadosSimSolver, AcadosModel
+from smarc_modelling.vehicles.casadi_models import vehicle_dynamics
 from smarc_modelling.motion_planning.MotionPrimitives.ObstacleChecker import compute_A_point_forward    ## CHANGE
 import numpy as np
 import casadi as ca
@@ -258,7 +259,8 @@ class NMPC_trajectory:
 
         return new_point
     
-    # Function to create a Acados model from the casadi model
+    # Function to create a Acados model from the casadi model. For SAM_casadi and SAM_LQR only the parameters of
+    # casadi_models.model_parameters() are taken from casadi_model, other changed attributes are not exported.
     def export_dynamics_model(self, casadi_model):
         # Create symbolic state and control variables
         x_sym     = ca.MX.sym('x', 19,1)
@@ -275,7 +277,7 @@ class NMPC_trajectory:
         model.u    = u_ref_sym
 
         # Declaration of explicit and implicit expressions
-        x_dot  = casadi_model.dynamics(export=True)    # extract casadi.MX function
+        x_dot  = vehicle_dynamics(casadi_model, export=True)    # casadi.MX function, built once per parameter set
         f_expl = ca.vertcat(x_dot(x_sym[:13], x_sym[13:]), u_ref_sym)
         f_impl = x_dot_sym - f_expl
         model.f_expl_expr = f_expl
@@ -0,0 +1,300 @@
+import os
+import numpy as np
+from smarc_modelling.lib.integrators import simulate
+from smarc_modelling.lib.gnc import quaternion_to_angles_batch
+
+# Features of the state the shape of a primitive depends on: roll, pitch (rad), body velocities and actuators.
+# Position and yaw only move the primitive rigidly.
+FEATURE_NAMES = ("phi", "theta", "u", "v", "w", "p", "q", "r", "vbs", "lcg", "ds", "dr", "rpm1", "rpm2")
+
+# Default grid resolution of each feature. It is coarse so that the nodes of a search share cells, the re-anchoring in
+# get_primitives() corrects for the distance to the cell center. The rudders and the propellers are ignored (inf): they
+# follow their command within one step, so the primitives barely depend on their initial value.
+DEFAULT_RESOLUTION = np.array([np.deg2rad(10), np.deg2rad(10),
+                               0.25, 0.1, 0.1,
+                               0.2, 0.2, 0.2,
+                               25, 25, np.inf, np.inf, np.inf, np.inf])
+
+# Default bounds of the grid, states outside are always re-simulated
+DEFAULT_BOUNDS = np.array([[-np.pi/2, np.pi/2], [-np.pi/2, np.pi/2],
+                           [-2, 2], [-1, 1], [-1, 1],
+                           [-1, 1], [-1, 1], [-1, 1],
+                           [0, 100], [0, 100], [-np.deg2rad(7), np.deg2rad(7)], [-np.deg2rad(7), np.deg2rad(7)],
+                           [-1500, 1500], [-1500, 1500]])
+
+
+def state_features(state):
+    """
+    The features (FEATURE_NAMES) of an (..., 19) array of states
+    """
+
+    state = np.asarray(state, float)
+    q = state[..., 3:7].reshape(-1, 4)
+    q = q / np.linalg.norm(q, axis=1, keepdims=True)
+    _, theta, phi = quaternion_to_angles_batch(q)
+
+    angles = np.stack([phi, theta], axis=-1).reshape(state.shape[:-1] + (2,))
+
+    return np.concatenate([angles, state[..., 7:19]], axis=-1)
+
+def state_yaw(state):
+    """
+    The yaw angle (rad) of a single state
+    """
+
+    q0, q1, q2, q3 = np.asarray(state[3:7], float) / np.linalg.norm(state[3:7])
+
+    return np.arctan2(2*(q0*q3 + q1*q2), 1 - 2*(q2**2 + q3**2))
+
+def transform_primitives(primitives, position, yaw):
+    """
+    Rigidly move (..., 19) primitives computed at the origin with zero yaw to the given position and yaw
+    """
+
+    out = np.array(primitives, dtype=float)
+    c = np.cos(yaw)
+    s = np.sin(yaw)
+
+    # Rotate the positions about z and translate
+    x = out[..., 0].copy()
+    y = out[..., 1].copy()
+    out[..., 0] = position[0] + c*x - s*y
+    out[..., 1] = position[1] + s*x + c*y
+    out[..., 2] += position[2]
+
+    # Quaternion product q_yaw * q, with q_yaw = [cos(yaw/2), 0, 0, sin(yaw/2)]
+    ch = np.cos(yaw/2)
+    sh = np.sin(yaw/2)
+    q0, q1, q2, q3 = [out[..., i].copy() for i in range(3, 7)]
+    out[..., 3] = ch*q0 - sh*q3
+    out[..., 4] = ch*q1 - sh*q2
+    out[..., 5] = ch*q2 + sh*q1
+    out[..., 6] = ch*q3 + sh*q0
+
+    # Body velocities and actuators are not affected
+    return out
+
+
+def grid_states(**values):
+    """
+    States on the cartesian product of the given feature values, e.g. grid_states(theta=[-0.2, 0, 0.2], u=[0, 0.5, 1]).
+    The other features are zero, except vbs and lcg which are neutral (50).
+    """
+
+    names = list(values.keys())
+    grids = np.meshgrid(*[np.atleast_1d(values[name]) for name in names], indexing="ij")
+
+    features = np.zeros((grids[0].size if grids else 1, len(FEATURE_NAMES)))
+    features[:, FEATURE_NAMES.index("vbs")] = 50
+    features[:, FEATURE_NAMES.index("lcg")] = 50
+    for name, grid in zip(names, grids):
+        features[:, FEATURE_NAMES.index(name)] = grid.ravel()
+
+    # Quaternions from roll and pitch, zero yaw
+    phi = features[:, 0]
+    theta = features[:, 1]
+    states = np.zeros((len(features), 19))
+    states[:, 3] = np.cos(phi/2) * np.cos(theta/2)
+    states[:, 4] = np.sin(phi/2) * np.cos(theta/2)
+    states[:, 5] = np.cos(phi/2) * np.sin(theta/2)
+    states[:, 6] = -np.sin(phi/2) * np.sin(theta/2)
+    states[:, 7:19] = features[:, 2:]
+
+    return states
+
+
+def reached_states(sim, states, inputs):
+    """
+    The nodes reached by all the primitives of the given states, an (len(states)*M, 19) array. Used to build a library over
+    the body states a search actually visits.
+    """
+
+    # Large enough that no primitive leaves the map or arrives at the goal
+    map_instance = {"x_max": 1e4, "y_max": 1e4, "z_max": 1e4, "x_min": -1e4, "y_min": -1e4, "z_min": -1e4,
+                    "start_pos": (0, 0, 0), "goal_pixel": (9e3, 9e3, 9e3), "TileSize": 0.5}
+
+    sim.computePrimitiveLength(0.0)
+    nodes = []
+    for state in states:
+        data, _, _, _ = sim.curvePrimitives_batch(state, inputs, map_instance, 0.0, 1)
+        nodes.append(data[:, -1])
+
+    return np.concatenate(nodes)
+
+
+class PrimitiveLibrary():
+    """
+    Precomputed motion primitives over a discretized body-state grid.
+
+    The shape of a primitive only depends on the body-frame velocities, the actuators and roll and pitch, not on the position and
+    yaw of SAM. The library stores, for every visited grid cell of these features, all the primitives simulated from the cell
+    state at the origin with zero yaw. At expansion time they are re-anchored to the current state and rigidly moved to the
+    current position and yaw. States outside the bounds of the grid, or in cells that have not been computed (unless lazy=True),
+    return None and have to be re-simulated.
+
+    Re-anchoring: the reference input (the one closest to the mean control) is simulated from the current state, and its
+    difference to the stored reference primitive is added to all the primitives. The reference primitive is then exact, the
+    others start exactly in the current state and have an error of second order in the distance of the state from the cell
+    center and in the difference of the inputs. With the default resolution, the positions stay within 0.25 m (half a map tile)
+    of a simulation from the current state over the whole primitive, see tests/test_primitive_library.py.
+
+    On disk, the library is a <path>.npz file with the grid and the inputs and a <path>.npy file with the (nCells, M, n_steps, 19)
+    primitives, memory mapped on load.
+    """
+
+    def __init__(self, sim, inputs, resolution=None, bounds=None, lazy=False):
+        """
+        sim: SAM_PRIMITIVES instance used to simulate the primitives
+        inputs: (M, 2*nInputs) array of (values, indices) input combinations, as in get_neighbors
+        """
+
+        self.sim = sim
+        self.inputs = np.asarray(inputs, float)
+        self.dt = sim.dt
+        self.n_steps = int(sim.maxPrimitiveLength/sim.dt)
+        self.resolution = DEFAULT_RESOLUTION.copy() if resolution is None else np.asarray(resolution, float)
+        self.bounds = DEFAULT_BOUNDS.copy() if bounds is None else np.asarray(bounds, float)
+        self.lazy = lazy
+
+        # One control vector u per input combination
+        inputLen = self.inputs.shape[1]
+        self.controls = np.array([sim.get_input(inputs[0 : inputLen//2], inputs[inputLen//2 : inputLen]) for inputs in self.inputs])
+
+        # Reference input of the re-anchoring, the control closest to the mean in units of the control ranges
+        scale = np.ptp(self.controls, axis=0)
+        scale[scale == 0] = 1
+        self.reference = int(np.argmin(np.sum(((self.controls - self.controls.mean(axis=0)) / scale)**2, axis=1)))
+
+        # Grid cells and their primitives
+        self.cells = {}
+        self.primitives = []
+
+    def __len__(self):
+        return len(self.primitives)
+
+    def cell(self, state):
+        """
+        The grid cell (tuple of ints) of a state, None if it is outside the bounds
+        """
+
+        features = state_features(state)
+        if np.any(features < self.bounds[:, 0]) or np.any(features > self.bounds[:, 1]):
+            return None
+
+        return tuple(np.round(features / self.resolution).astype(int))
+
+    def cell_state(self, cell):
+        """
+        The state at the center of a grid cell, at the origin with zero yaw. Ignored features are zero.
+        """
+
+        features = np.array(cell) * np.where(np.isinf(self.resolution), 0, self.resolution)
+
+        return grid_states(**dict(zip(FEATURE_NAMES, features)))[0]
+
+    def simulate_cell(self, cell):
+        """
+        Simulate all the primitives of a cell at once with forward Euler. Returns an (M, n_steps, 19) array
+        """
+
+        x0 = np.tile(self.cell_state(cell), (len(self.controls), 1))
+        data = simulate(self.sim.sam.dynamics_batch, x0, self.controls, self.dt, self.n_steps, method="euler",
+                        per_step=False)
+
+        return np.ascontiguousarray(np.swapaxes(data, 0, 1), dtype=np.float32)
+
+    def add(self, cell):
+        """
+        Compute and store the primitives of a cell, if not yet in the library
+        """
+
+        if cell not in self.cells:
+            self.cells[cell] = len(self.primitives)
+            self.primitives.append(self.simulate_cell(cell))
+
+        return self.primitives[self.cells[cell]]
+
+    def build(self, states):
+        """
+        Precompute the cells of a list of states, e.g. a grid of body states or the nodes of previous searches
+        """
+
+        for state in states:
+            cell = self.cell(state)
+            if cell is not None:
+                self.add(cell)
+
+    def get_primitives(self, state, n_sim=None):
+        """
+        The primitives of all the inputs starting from state, in the world frame, as an (M, n_sim, 19) array.
+        Returns None if the state is not covered by the library.
+        """
+
+        cell = self.cell(state)
+        if cell is None:
+            return None
+        if cell not in self.cells:
+            if not self.lazy:
+                return None
+            self.add(cell)
+
+        if n_sim is None:
+            n_sim = self.n_steps
+        primitives = self.primitives[self.cells[cell]][:, 0:n_sim].astype(float)
+
+        # Re-anchor them to the current state at the origin with zero yaw
+        yaw = state_yaw(state)
+        local = np.array(state, dtype=float)
+        local[0:3] = 0
+        local = transform_primitives(local, np.zeros(3), -yaw)
+        reference = simulate(self.sim.sam.dynamics, local, self.controls[self.reference], self.dt, n_sim, method="euler")
+        primitives += reference - primitives[self.reference]
+
+        # The actuators do not depend on the rest of the state, they are rolled out exactly
+        actuators = local[13:19]
+        for k in range(1, n_sim):
+            actuators = actuators + self.dt * self.sim.sam.actuator_dynamics_batch(np.broadcast_to(actuators, self.controls.shape), self.controls)
+            primitives[:, k, 13:19] = actuators
+
+        # Move them to the current pose, starting exactly in the current state
+        primitives = transform_primitives(primitives, state[0:3], yaw)
+        primitives[:, 0] = state
+
+        return primitives
+
+    def save(self, path):
+        """
+        Save the library to <path>.npz and <path>.npy
+        """
+
+        cells = np.array(list(self.cells.keys()), dtype=int).reshape(-1, len(FEATURE_NAMES))
+        order = list(self.cells.values())
+        primitives = np.zeros((len(order), len(self.controls), self.n_steps, 19), np.float32)
+        for i, index in enumerate(order):
+            primitives[i] = self.primitives[index]
+
+        # Write to a temporary file first, the current primitives might be memory mapped from path
+        np.save(path + ".tmp.npy", primitives)
+        os.replace(path + ".tmp.npy", path + ".npy")
+        np.savez(path + ".npz", cells=cells, inputs=self.inputs, dt=self.dt, n_steps=self.n_steps,
+                 resolution=self.resolution, bounds=self.bounds)
+
+    @classmethod
+    def load(cls, path, sim, lazy=False):
+        """
+        Load a library saved with save(). The primitives are memory mapped.
+        """
+
+        meta = np.load(path + ".npz")
+        if meta["dt"] != sim.dt:
+            raise ValueError(f"The library was computed with dt = {meta['dt']}, not {sim.dt}")
+
+        library = cls(sim, meta["inputs"], meta["resolution"], meta["bounds"], lazy)
+        library.n_steps = int(meta["n_steps"])
+
+        primitives = np.load(path + ".npy", mmap_mode="r")
+        for i, cell in enumerate(meta["cells"]):
+            library.cells[tuple(cell)] = i
+            library.primitives.append(primitives[i])
+
+        return library
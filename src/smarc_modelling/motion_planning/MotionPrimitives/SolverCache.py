@@ -0,0 +1,201 @@
+import os
+import glob
+import json
+import hashlib
+import numpy as np
+from casadi import Function, MX, SX
+from acados_template import AcadosOcpSolver
+import smarc_modelling.motion_planning.MotionPrimitives.GlobalVariables as glbv
+
+# Default directory of the compiled solvers, one subdirectory per OCP structure
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'acados_solver_cache')
+
+# Solvers already loaded in this process: key -> (solver, dims)
+_solvers = {}
+
+
+def _is_expr(expr):
+    return isinstance(expr, (MX, SX))
+
+def _array(value):
+    return None if value is None else np.asarray(value, float).tolist()
+
+def ocp_key(ocp):
+    """
+    Hash of everything that is compiled into the solver: model name, horizon, dt, solver options, the dynamics, cost and
+    constraint expressions, the cost weights and which variables are bounded. The values that can be changed at runtime
+    (x0, yref, parameters and all the bounds) are not part of it, so OCPs that only differ in those share one solver.
+    """
+
+    model = ocp.model
+    options = ocp.solver_options
+    cost = ocp.cost
+    constraints = ocp.constraints
+
+    # Dynamics, cost and constraint expressions, serialized as a casadi Function
+    symbols = [symbol for symbol in (model.x, model.xdot, model.u, model.p) if _is_expr(symbol) and symbol.numel() > 0]
+    names = ['f_impl_expr', 'cost_y_expr_0', 'cost_y_expr', 'cost_y_expr_e', 'con_h_expr_0', 'con_h_expr', 'con_h_expr_e']
+    exprs = [(name, getattr(model, name, None)) for name in names]
+    exprs = [(name, expr) for name, expr in exprs if _is_expr(expr)]
+    functions = Function(model.name, symbols, [expr for _, expr in exprs]).serialize()
+
+    structure = {
+        'name': model.name,
+        'N': options.N_horizon,
+        'tf': options.tf,
+        'options': [getattr(options, option) for option in ('qp_solver', 'hpipm_mode', 'hessian_approx', 'integrator_type',
+                    'sim_method_newton_iter', 'nlp_solver_type', 'nlp_solver_max_iter', 'tol', 'qp_tol', 'globalization',
+                    'regularize_method')],
+        'exprs': [name for name, _ in exprs],
+        'cost': [cost.cost_type, cost.cost_type_e, _array(cost.W), _array(cost.W_e)],
+        'bounds': [_array(constraints.idxbx), _array(constraints.idxbx_e), _array(constraints.idxbu)],
+    }
+
+    digest = hashlib.sha1(json.dumps(structure, sort_keys=True, default=str).encode())
+    digest.update(functions.encode())
+
+    return digest.hexdigest()[0:16]
+
+def _is_compiled(codegen_dir, json_file, name):
+    '''
+    True if the directory holds the json and the shared library of a solver generated in that same directory
+    '''
+
+    if not os.path.isfile(json_file) or not glob.glob(os.path.join(codegen_dir, f'libacados_ocp_solver_{name}.*')):
+        return False
+
+    with open(json_file, 'r') as f:
+        export_dir = json.load(f)['code_export_directory']
+
+    return os.path.abspath(export_dir) == os.path.abspath(codegen_dir)
+
+def get_solver(ocp, cache_dir=None):
+    """
+    The AcadosOcpSolver of an ocp, with its runtime values set (see set_runtime_values).
+
+    Solvers are looked up by ocp_key(ocp): first among the ones already loaded in this process, then on disk in
+    <cache_dir>/<model name>_<key>. Only if neither exists the C code is generated and compiled.
+    """
+
+    if cache_dir is None:
+        cache_dir = glbv.SOLVER_CACHE_DIR or DEFAULT_CACHE_DIR
+
+    key = ocp_key(ocp)
+    if key not in _solvers:
+        name = ocp.model.name
+        codegen_dir = os.path.abspath(os.path.join(cache_dir, f'{name}_{key}'))
+        json_file = os.path.join(codegen_dir, 'acados_ocp.json')
+        compiled = _is_compiled(codegen_dir, json_file, name)
+
+        os.makedirs(codegen_dir, exist_ok=True)
+        ocp.code_export_directory = codegen_dir
+        solver = AcadosOcpSolver(ocp, json_file=json_file, generate=not compiled, build=not compiled, verbose=False)
+
+        with open(json_file, 'r') as f:
+            dims = json.load(f)['dims']
+        _solvers[key] = (solver, dims)
+
+    solver, dims = _solvers[key]
+    set_runtime_values(solver, dims, ocp)
+
+    return solver
+
+def _first_stage(values, name, n):
+    '''
+    The <name>_0 values of the first stage if they are set, otherwise the path values <name>
+    '''
+
+    value = getattr(values, name + '_0', None)
+    if value is None or np.size(value) != n:
+        value = getattr(values, name)
+
+    return np.asarray(value, float)
+
+def set_runtime_values(solver, dims, ocp):
+    """
+    Reset the solver and copy x0, the references, the parameters and all the bounds of the ocp into it
+    """
+
+    N = solver.N
+    cost = ocp.cost
+    constraints = ocp.constraints
+    solver.reset()
+
+    # Initial state
+    solver.constraints_set(0, 'lbx', np.asarray(constraints.lbx_0, float))
+    solver.constraints_set(0, 'ubx', np.asarray(constraints.ubx_0, float))
+
+    # Path and terminal bounds
+    for i in range(1, N):
+        if dims.get('nbx', 0) > 0:
+            solver.constraints_set(i, 'lbx', np.asarray(constraints.lbx, float))
+            solver.constraints_set(i, 'ubx', np.asarray(constraints.ubx, float))
+    for i in range(0, N):
+        if dims.get('nbu', 0) > 0:
+            solver.constraints_set(i, 'lbu', np.asarray(constraints.lbu, float))
+            solver.constraints_set(i, 'ubu', np.asarray(constraints.ubu, float))
+    if dims.get('nbx_e', 0) > 0:
+        solver.constraints_set(N, 'lbx', np.asarray(constraints.lbx_e, float))
+        solver.constraints_set(N, 'ubx', np.asarray(constraints.ubx_e, float))
+
+    # Nonlinear constraints. The first stage has its own, which might be a copy of the path constraints.
+    if dims.get('nh_0', 0) > 0:
+        solver.constraints_set(0, 'lh', _first_stage(constraints, 'lh', dims['nh_0']))
+        solver.constraints_set(0, 'uh', _first_stage(constraints, 'uh', dims['nh_0']))
+    for i in range(1, N):
+        if dims.get('nh', 0) > 0:
+            solver.constraints_set(i, 'lh', np.asarray(constraints.lh, float))
+            solver.constraints_set(i, 'uh', np.asarray(constraints.uh, float))
+    if dims.get('nh_e', 0) > 0:
+        solver.constraints_set(N, 'lh', np.asarray(constraints.lh_e, float))
+        solver.constraints_set(N, 'uh', np.asarray(constraints.uh_e, float))
+
+    # References, the first stage has the path reference unless it has its own cost
+    if dims.get('ny_0', 0) > 0:
+        solver.cost_set(0, 'yref', _first_stage(cost, 'yref', dims['ny_0']))
+    for i in range(1, N):
+        if dims.get('ny', 0) > 0:
+            solver.cost_set(i, 'yref', np.asarray(cost.yref, float))
+    if dims.get('ny_e', 0) > 0:
+        solver.cost_set(N, 'yref', np.asarray(cost.yref_e, float))
+
+    # Parameters
+    if dims.get('np', 0) > 0:
+        for i in range(N + 1):
+            solver.set(i, 'p', np.asarray(ocp.parameter_values, float))
+
+#------------------------------------------------------------------------------
+# Variable horizons. A problem with N stages is solved with the solver of the next horizon in glbv.HORIZON_BUCKETS.
+# The dynamics are scaled by the stage parameter time_scale, 1 in the first N stages and 0 in the padding, so the
+# state is frozen after N stages and the terminal cost and constraints act on x_N.
+
+def horizon_bucket(N):
+    """
+    The compiled horizon used for a problem with N stages
+    """
+
+    for bucket in sorted(glbv.HORIZON_BUCKETS):
+        if bucket >= N:
+            return bucket
+
+    return N
+
+def add_time_scale(model):
+    """
+    Make the dynamics of an AcadosModel x_dot = time_scale * f(x, u), with the stage parameter time_scale as model.p
+    """
+
+    time_scale = type(model.x).sym('time_scale', 1)
+    model.p = time_scale
+    model.f_expl_expr = time_scale * model.f_expl_expr
+    model.f_impl_expr = model.xdot - model.f_expl_expr
+
+    return model
+
+def set_effective_horizon(solver, N):
+    """
+    Only the first N stages of the solver move the state, see add_time_scale
+    """
+
+    for i in range(solver.N + 1):
+        solver.set(i, 'p', np.array([1.0 if i < N else 0.0]))
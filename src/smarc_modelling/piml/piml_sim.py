@@ -3,6 +3,7 @@
 
 import numpy as np
 from smarc_modelling.vehicles.SAM_PIML import SAM_PIML
+from smarc_modelling.lib.integrators import simulate
 from smarc_modelling.piml.utils.utility_functions import load_data_from_bag, eta_quat_to_deg
 import matplotlib.pyplot as plt
 import torch
@@ -12,13 +13,13 @@ import scienceplots
 class SIM:
     """Simulator for SAM / other UAVs"""
 
-    def __init__(self, piml_type: str, init_pose: list, time_vec: list, control_vec: list):
+    def __init__(self, piml_type: str, init_pose: list, time_vec: list, control_vec: list, piml_model=None):
 
         # Initial pose
         self.x0 = init_pose
 
         # Create vehicle instance
-        self.vehicle = SAM_PIML(dt=0.01, piml_type=piml_type)
+        self.vehicle = SAM_PIML(dt=0.01, piml_type=piml_type, piml_model=piml_model)
 
         # Controls and sim variables
         self.controls = control_vec
@@ -28,35 +29,11 @@ class SIM:
     def run_sim(self):
         print(f" Running simulator...")
         
-        # For storing results of sim
-        data = np.empty((len(self.x0), self.n_sim))
-        data[:, 0] = self.x0
+        # Sim with the variable time steps of the data
+        data = simulate(self.vehicle.dynamics, self.x0, self.controls[:self.n_sim-1], self.var_dt,
+                        method="rk4", update_dt=self.vehicle.update_dt)
 
-        for i in range(self.n_sim-1):
-
-            # Get the current time step
-            dt = self.var_dt[i]
-            self.vehicle.update_dt(dt)
-
-            # Do sim step using rk4 or ef
-            data[:, i+1] = self.rk4(data[:, i], self.controls[i], dt, self.vehicle.dynamics)
-
-        return data
-    
-    def rk4(self, x, u, dt, fun):
-        # https://github.com/smarc-project/smarc_modelling/blob/master/src/smarc_modelling/sam_sim.py#L38C1-L46C15 
-        # Runge Kutta 4
-        k1 = fun(x, u)
-        k2 = fun(x+dt/2*k1, u)
-        k3 = fun(x+dt/2*k2, u)
-        k4 = fun(x+dt*k3, u)
-        dxdt = x + dt/6 * (k1 + 2*k2 + 2*k3 + k4)
-        return dxdt
-    
-    def ef(self, x, u, dt, fun):
-        # Euler forward
-        dxdt = x + dt * fun(x, u)
-        return dxdt
+        return data.T
     
 if __name__ == "__main__":
     print(f" Starting simulator...")
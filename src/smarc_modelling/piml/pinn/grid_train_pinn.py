@@ -1,156 +1,294 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from smarc_modelling.piml.pinn.pinn import PINN, loss_function
+# Hyperparameter search over the PINN shape (amount of hidden layers x neurons per layer).
+#
+# The trials run in a process pool, each process training one model at a time with its own thread budget. Hopeless
+# trials are pruned with successive halving: all trials get a small epoch budget, the best 1/eta continue with eta
+# times the budget, and so on. The survivors of the last rung are simulated on the test bag and ranked by the
+# trajectory error. Every finished rung is appended to results.jsonl in the output directory, together with the weights
+# of the model and the optimizer and scheduler states, so the next rung continues the training where it stopped and an
+# interrupted search continues where it stopped when started again.
+#
+# Usage: python grid_train_pinn.py [random=<n trials>] [workers=<n>] [threads=<n per trial>] [out=<directory>]
+
+from smarc_modelling.piml.pinn.pinn import PINN, train_pinn, set_threads
 from smarc_modelling.piml.utils.utility_functions import load_data_from_bag, eta_quat_to_deg
 from smarc_modelling.piml.piml_sim import SIM
+import json
+import math
+import multiprocessing
+import os
+import sys
+import time
 import torch
 import numpy as np
 
 
-if __name__ == "__main__":
+TRAIN_PATH = "src/smarc_modelling/piml/data/rosbags/rosbag_tank_1970"
+VALIDATE_PATH = "src/smarc_modelling/piml/data/rosbags/rosbag_tank_2025"
+TEST_PATH = "src/smarc_modelling/piml/data/rosbags/rosbag_tank_test"
+
+# Training settings of every trial
+TRAIN_SETTINGS = {
+    "lr": 0.01,
+    "patience": 50000,
+    "scheduler_args": {"factor": 0.9, "patience": 500, "threshold": 0.01, "min_lr": 1e-5},
+    "log_every": 50000,
+}
+
+
+def grid_trials(layers=(20, 50, 100), sizes=(32, 64, 128)):
+    """All combinations of amount of layers and neurons per layer"""
+    return [{"layers": n_layers, "size": size} for n_layers in layers for size in sizes]
+
+
+def random_trials(n_trials: int, layers=(2, 100), sizes=(16, 32, 64, 128), seed: int=0):
+    """n_trials random shapes, with the amount of layers drawn from the range layers and the size from sizes"""
+    rng = np.random.default_rng(seed)
+    trials = {}
+    while len(trials) < min(n_trials, (layers[1] - layers[0] + 1) * len(sizes)):
+        trial = {"layers": int(rng.integers(layers[0], layers[1] + 1)), "size": int(rng.choice(sizes))}
+        trials[trial_name(trial)] = trial
+    return list(trials.values())
+
 
-    # Loading training data
-    train_path = "src/smarc_modelling/piml/data/rosbags/rosbag_tank_1970"
-    eta, nu, u, u_cmd, Dv_comp, Mv_dot, Cv, g_eta, tau, t = load_data_from_bag(train_path, "torch")
+def trial_name(trial):
+    return f"{trial['layers']}x{trial['size']}"
+
+
+def model_shape(trial):
+    return [19] + [trial["size"]] * trial["layers"] + [36]
+
+
+def rung_epochs(max_epochs: int, n_rungs: int, eta: int):
+    """Total epochs of a trial after every rung, growing by eta up to max_epochs"""
+    return [int(math.ceil(max_epochs / eta ** (n_rungs - 1 - rung))) for rung in range(n_rungs)]
+
+
+def load_datasets():
+    """Training and validation data as train_pinn takes them, and the test bag for the simulation"""
+
+    eta, nu, u, u_cmd, Dv_comp, Mv_dot, Cv, g_eta, tau, t = load_data_from_bag(TRAIN_PATH, "torch")
     x = torch.cat([eta, nu, u], dim=1) # State vector
+    train = (x, Dv_comp, Mv_dot, Cv, g_eta, tau, nu)
+
+    eta, nu, u, u_cmd, Dv_comp, Mv_dot, Cv, g_eta, tau, t = load_data_from_bag(VALIDATE_PATH, "torch")
+    x = torch.cat([eta, nu, u], dim=1)
+    val = (x, Dv_comp, Mv_dot, Cv, g_eta, tau, nu)
 
-    # Loading validation data
-    validate_path = "src/smarc_modelling/piml/data/rosbags/rosbag_tank_2025"
-    eta_val, nu_val, u_val, u_cmd_val, Dv_comp_val, Mv_dot_val, Cv_val, g_eta_val, tau_val, t_val = load_data_from_bag(validate_path, "torch")
-    x_val = torch.cat([eta_val, nu_val, u_val], dim=1)
-
-    # Loading the test data
-    validate_path = "src/smarc_modelling/piml/data/rosbags/rosbag_tank_test"
-    eta_test, nu_test, u_test, u_cmd_test, Dv_comp_test, Mv_dot_test, Cv_test, g_eta_test, tau_test, t_test = load_data_from_bag(validate_path, "torch")
-    x_test = torch.cat([eta_test, nu_test, u_test], dim=1)
-
-    # For flipping the sim results later
-    x0 = eta_test[0, 0].item()
-    y0 = eta_test[0, 1].item()
-    z0 = eta_test[0, 2].item()
-    eta_for_error = eta_test
+    eta, nu, u, u_cmd, Dv_comp, Mv_dot, Cv, g_eta, tau, t = load_data_from_bag(TEST_PATH, "torch")
+    test = {"x": torch.cat([eta, nu, u], dim=1), "eta": eta.clone(), "nu": nu, "u_cmd": u_cmd, "t": t}
+
+    return train, val, test
+
+
+def simulation_error(model, test):
+    """Summed squared error of the pose (in degrees) and speeds of the simulation with the model on the test bag"""
+
+    # For flipping the sim results
+    x0 = test["eta"][0, 0].item()
+    y0 = test["eta"][0, 1].item()
+    z0 = test["eta"][0, 2].item()
+    eta_for_error = test["eta"].clone()
     eta_for_error[:, 1] = 2 * y0 - eta_for_error[:, 1]
     eta_for_error[:, 2] = 2 * z0 - eta_for_error[:, 2]
     eta_test_degs = np.array([eta_quat_to_deg(eta_vec) for eta_vec in eta_for_error])
 
-    # For results
-    error_grid = np.zeros((3, 3))
-    best_error = float("inf")
-
-    # Grid params
-    for i, layers in enumerate([20, 50, 100]): # Amount of layers
-        for j, size in enumerate([32, 64, 128]): # Amount of neurons in each layer 
-
-                # NN shape
-                shape = [size] * layers # Hidden layers
-                shape.insert(0, 19) # Input layer
-                shape.append(36) # Output layer
-                
-                # Initalize model
-                model = PINN(shape)
-                optimizer = torch.optim.Adam(model.parameters(), lr=0.01)
-
-                # Adaptive learning rate
-                scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(optimizer=optimizer, mode="min", factor=0.9, patience=500, threshold=0.01, min_lr=1e-5)
-
-                # Early stopping with validation loss
-                best_val_loss = float("inf")
-                patience = 50000
-                counter = 0
-                best_model_state = None
-
-                # Training loop
-                epochs = patience * 10
-                for epoch in range(epochs):
-
-                    model.train()
-                    optimizer.zero_grad()
-
-                    # Forward pass
-                    D_pred = model(x)
-
-                    # Compute loss and optimize
-                    loss = loss_function(model, x, Dv_comp, Mv_dot, Cv, g_eta, tau, nu)
-                    loss.backward()
-                    optimizer.step()
-
-                    # Step scheduler
-                    scheduler.step(loss)
-
-                    # Evaluate model on validation data
-                    model.eval()
-                    with torch.no_grad():
-                        val_loss = loss_function(model, x_val, Dv_comp_val, Mv_dot_val, Cv_val, g_eta_val, tau_val, nu_val)
-
-                    # Handling for early stopping
-                    if val_loss.item() < best_val_loss:
-                        best_val_loss = val_loss.item()
-                        counter = 0
-                        best_model_state = model.state_dict()
-                    else:
-                        counter += 1
-
-                    # Print statement to make sure everything is still running
-                    if epoch % 500 == 0:
-                        print(f" Still training, epoch {epoch}, loss: {loss.item()}, lr: {optimizer.param_groups[0]['lr']},\n validation loss: {val_loss.item()}, shape: {layers}, {size}")
-
-                    # Break condition for early stopping
-                    if counter >= patience:
-                        print(f" Stopping early due to no improvement after {patience} epochs from epoch: {epoch-counter}")
-                        break
-                
-                # Calculating the model error
-                model.load_state_dict(best_model_state) # Loading the best model state
-                torch.save({"model_shape": shape, "state_dict": model.state_dict()}, "src/smarc_modelling/piml/models/pinn.pt") 
-                model.eval() # Just to doubly ensure that it is in eval mode
-
-                try: 
-                    # Running the SAM simulator to get predicted validation path
-                    sam_pinn = SIM("pinn", x_test[0], t_test, u_cmd_test)
-                    results = sam_pinn.run_sim()
-                    results = torch.tensor(results).T
-                    eta_pinn = results[:, 0:7]
-                    eta_pinn[:, 0] = 2 * x0 - eta_pinn[:, 0] # Flipping to NED frame
-                    eta_pinn[:, 2] = 2 * z0 - eta_pinn[:, 2]
-                    nu_pinn = results[:, 7:13]
-
-                    # Convert quat to angles
-                    eta_pinn_degs = np.array([eta_quat_to_deg(eta_vec) for eta_vec in eta_pinn])
-
-                    # Calculated summed error
-                    eta_mse = np.array((eta_pinn_degs - eta_test_degs)**2)
-                    nu_mse = np.array((nu_pinn - nu_test)**2)
-
-                    error = np.sum(eta_mse) + np.sum(nu_mse)
-                    error_grid[i,j] = error
-
-                    if error < best_error:
-                        best_error = error
-                        torch.save({"model_shape": shape, "state_dict": model.state_dict()}, "src/smarc_modelling/piml/models/pinn_best_grid.pt")
-                        best_setup = [layers, size]
-    
-                    print(" Succesful model made \n")
-
-                except Exception as e:
-                    # Since many of the models will be bad from the grid training,
-                    # they will lead to the simulator going to inf and breaking it so we need to 
-                    # have an except for these cases
-                    print(f" {e}")
-                    print(f" Error with simulator from faulty predictions\n")
-                    error_grid[i,j] = float("inf")
-
-                    print(f" Failed matrix was the following for example state {x_test[-50]}")
-                    example = model(x_test[-50])
-                    print(f" D: {example} \n")
-                        
-
-                
-    # After going trough the grid getting the smallest loss
-    min_loss_idx = np.unravel_index(np.argmin(error_grid), error_grid.shape)
-    print(f" The best loss is at {min_loss_idx}")
-    print(f" Best found configuration as: {best_setup}")
+    # Running the SAM simulator to get predicted validation path
+    sam_pinn = SIM("pinn", test["x"][0], test["t"], test["u_cmd"], piml_model=model)
+    results = sam_pinn.run_sim()
+    results = torch.tensor(results).T
+    eta_pinn = results[:, 0:7]
+    eta_pinn[:, 0] = 2 * x0 - eta_pinn[:, 0] # Flipping to NED frame
+    eta_pinn[:, 2] = 2 * z0 - eta_pinn[:, 2]
+    nu_pinn = results[:, 7:13]
+
+    # Convert quat to angles
+    eta_pinn_degs = np.array([eta_quat_to_deg(eta_vec) for eta_vec in eta_pinn])
+
+    # Calculated summed error
+    eta_mse = np.array((eta_pinn_degs - eta_test_degs)**2)
+    nu_mse = np.array((nu_pinn - test["nu"])**2)
+
+    return float(np.sum(eta_mse) + np.sum(nu_mse))
+
+#------------------------------------------------------------------------------
+# Workers. Each process loads the data once, in _init_worker, and trains with its own thread budget.
+
+_worker = {}
+
+
+def _init_worker(n_threads):
+    set_threads(n_threads, 1)
+    _worker["train"], _worker["val"], _worker["test"] = load_datasets()
+
+
+def _checkpoint_path(out_dir, trial, rung):
+    return os.path.join(out_dir, f"{trial_name(trial)}_rung{rung}.pt")
+
+
+def _run_rung(job):
+    """Continues training a trial from its previous rung up to the epochs of this rung, with the weights, the optimizer
+    and scheduler states and the early stopping of the previous rung. The last rung also simulates the model on the
+    test bag."""
+    trial, rung, epochs, last, out_dir = job
+
+    model = PINN(model_shape(trial))
+    train_state = {}
+    if rung > 0:
+        checkpoint = torch.load(_checkpoint_path(out_dir, trial, rung - 1), weights_only=True)
+        model.load_state_dict(checkpoint["state_dict"])
+        train_state = checkpoint.get("train_state", {})
+
+    start = time.perf_counter()
+    val_loss = train_pinn(model, _worker["train"], _worker["val"], epochs=epochs, state=train_state, **TRAIN_SETTINGS)
+    wall_time = time.perf_counter() - start
+    torch.save({"model_shape": model_shape(trial), "state_dict": model.state_dict(), "train_state": train_state},
+               _checkpoint_path(out_dir, trial, rung))
+
+    row = {"trial": trial_name(trial), "layers": trial["layers"], "size": trial["size"], "rung": rung,
+           "epochs": epochs, "val_loss": val_loss, "sim_error": None, "wall_time": wall_time}
+
+    if last:
+        model.eval()
+        try:
+            row["sim_error"] = simulation_error(model, _worker["test"])
+        except Exception as e:
+            # Many of the models will be bad, which leads to the simulator going to inf and breaking
+            print(f" {e}")
+            print(f" Error with simulator from faulty predictions for {trial_name(trial)}")
+            row["sim_error"] = float("inf")
+
+    return row
+
+#------------------------------------------------------------------------------
+
+def load_results(out_dir: str):
+    """The rows of results.jsonl in out_dir, keyed by (trial name, rung)"""
+    results = {}
+    path = os.path.join(out_dir, "results.jsonl")
+    if os.path.isfile(path):
+        with open(path) as f:
+            for line in f:
+                # A line cut off by a crash is dropped, its rung runs again
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                results[(row["trial"], row["rung"])] = row
+    return results
+
+
+def run_search(trials, out_dir: str="src/smarc_modelling/piml/models/search", max_epochs: int=500000,
+               n_rungs: int=3, eta: int=3, n_workers: int=None, threads_per_trial: int=1, verbose: bool=True):
+    """
+    Trains the trials with successive halving in a process pool.
+
+    trials: list of {"layers", "size"}, see grid_trials() and random_trials()
+    max_epochs: epochs of the trials that reach the last rung, the first rung has max_epochs / eta^(n_rungs - 1)
+    eta: after every rung, the best 1/eta of the trials by validation loss continue
+    n_workers: number of processes, defaults to the number of cores divided by threads_per_trial
+    out_dir: results.jsonl and the model weights of every rung go here. Rungs already in results.jsonl are not run
+        again.
+
+    Returns the table of trials, see summary()
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    results = load_results(out_dir)
+    results_path = os.path.join(out_dir, "results.jsonl")
+    cut_off = False
+    if os.path.isfile(results_path) and os.path.getsize(results_path) > 0:
+        with open(results_path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            cut_off = f.read(1) != b"\n"
+    n_workers = n_workers or max(1, os.cpu_count() // threads_per_trial)
+    epochs = rung_epochs(max_epochs, n_rungs, eta)
+
+    alive = list(trials)
+    start = time.perf_counter()
+    with multiprocessing.get_context("spawn").Pool(n_workers, initializer=_init_worker,
+                                                   initargs=(threads_per_trial,)) as pool, \
+            open(results_path, "a") as results_file:
+        # The rows of this run start on a new line, after a line cut off by a crash
+        if cut_off:
+            results_file.write("\n")
+        for rung in range(n_rungs):
+            last = rung == n_rungs - 1 or len(alive) == 1
+            jobs = [(trial, rung, epochs[rung] - (epochs[rung - 1] if rung > 0 else 0), last, out_dir)
+                    for trial in alive if (trial_name(trial), rung) not in results]
+
+            for n_done, row in enumerate(pool.imap_unordered(_run_rung, jobs), 1):
+                # Persist every finished rung right away, for resuming
+                results[(row["trial"], rung)] = row
+                results_file.write(json.dumps(row) + "\n")
+                results_file.flush()
+                if verbose:
+                    print(f" Rung {rung}: {n_done}/{len(jobs)} trials, {row['trial']} val loss {row['val_loss']:.4g}, "
+                          f"{time.perf_counter() - start:.0f} s")
+
+            if last:
+                break
+
+            # Successive halving on the validation loss, NaN losses are pruned
+            ranked = sorted(alive, key=lambda trial: _loss_key(results[(trial_name(trial), rung)]["val_loss"]))
+            alive = ranked[:max(1, len(alive) // eta)]
+
+    return summary(results, trials)
+
+
+def _loss_key(loss):
+    return float("inf") if loss is None or math.isnan(loss) else loss
+
+
+def summary(results, trials):
+    """One row per trial with its last rung, total epochs, last validation loss, simulation error (None if pruned)
+    and wall time summed over the rungs, sorted by simulation error and then validation loss"""
+    rows = []
+    for trial in trials:
+        rungs = sorted((row for (name, _), row in results.items() if name == trial_name(trial)),
+                       key=lambda row: row["rung"])
+        if not rungs:
+            continue
+        rows.append({"trial": trial_name(trial), "layers": trial["layers"], "size": trial["size"],
+                     "rung": rungs[-1]["rung"], "epochs": sum(row["epochs"] for row in rungs),
+                     "val_loss": rungs[-1]["val_loss"], "sim_error": rungs[-1]["sim_error"],
+                     "wall_time": sum(row["wall_time"] for row in rungs)})
+
+    return sorted(rows, key=lambda row: (-row["rung"], _loss_key(row["sim_error"]), _loss_key(row["val_loss"])))
+
+
+def print_summary(rows):
+    print(f"{'trial':<10}{'layers':>8}{'size':>6}{'rung':>6}{'epochs':>9}{'val loss':>12}{'sim error':>12}"
+          f"{'wall s':>10}")
+    for row in rows:
+        sim_error = "pruned" if row["sim_error"] is None else f"{row['sim_error']:.4g}"
+        print(f"{row['trial']:<10}{row['layers']:>8}{row['size']:>6}{row['rung']:>6}{row['epochs']:>9}"
+              f"{row['val_loss']:>12.4g}{sim_error:>12}{row['wall_time']:>10.1f}")
+
+
+if __name__ == "__main__":
+
+    # Command line arguments as name=value
+    args = dict(arg.split("=", 1) for arg in sys.argv[1:] if "=" in arg)
+    out_dir = args.get("out", "src/smarc_modelling/piml/models/search")
+
+    if "random" in args:
+        trials = random_trials(int(args["random"]))
+    else:
+        trials = grid_trials()
+
+    rows = run_search(trials, out_dir, n_workers=int(args["workers"]) if "workers" in args else None,
+                      threads_per_trial=int(args.get("threads", 1)))
+    print_summary(rows)
+
+    # Keeping the best model of the search, as per the simulation error
+    best = rows[0]
+    if best["sim_error"] is not None and math.isfinite(best["sim_error"]):
+        checkpoint = torch.load(os.path.join(out_dir, f"{best['trial']}_rung{best['rung']}.pt"), weights_only=True)
+        torch.save(checkpoint, "src/smarc_modelling/piml/models/pinn_best_grid.pt")
+        print(f" Best found configuration as: {[best['layers'], best['size']]}")
 
     # 6 - 128 best Jun 6 23:12
     # 12 - 32 best Jun 8 13:23
-    # 20 - 32 best Jun 8 21:23
\ No newline at end of file
+    # 20 - 32 best Jun 8 21:23
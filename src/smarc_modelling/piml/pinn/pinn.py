@@ -2,6 +2,8 @@
 # -*- coding: utf-8 -*-
 
 # Imports
+import copy
+import os
 import torch
 import torch.nn as nn
 import numpy as np
@@ -54,19 +56,174 @@ def loss_function(model, x, Dv_comp, Mv_dot, Cv, g_eta, tau, nu):
     Custom loss function that implements the physics loss.
     """
     
-    # Getting predicted D
+    # Getting predicted D and damping force
     D_pred = model(x)
+    Dv_pred = torch.bmm(nu.unsqueeze(1), D_pred).squeeze(1)
 
     # Calculate MSE physics loss using Fossen Dynamics Model
-    physics_loss = torch.mean((Mv_dot + Cv + (torch.bmm(nu.unsqueeze(1), D_pred).squeeze(1)) + g_eta - tau)**2)
+    physics_loss = torch.mean((Mv_dot + Cv + Dv_pred + g_eta - tau)**2)
 
     # Calculate data loss
-    data_loss = torch.mean((Dv_comp - (torch.bmm(nu.unsqueeze(1), D_pred).squeeze(1)))**2)
+    data_loss = torch.mean((Dv_comp - Dv_pred)**2)
 
     # Final loss is just the sum
     return physics_loss + data_loss
 
 
+def set_threads(n_threads: int=None, n_interop_threads: int=None):
+    """Sets the threads torch uses within one operation (intra-op), all cores by default, and across independent
+    operations (inter-op), one by default. The forward and backward passes of the MLP are a chain of dependent
+    operations, so the cores are better spent within them."""
+    torch.set_num_threads(n_threads or os.cpu_count())
+    try:
+        torch.set_num_interop_threads(n_interop_threads or 1)
+    except RuntimeError:
+        # Can only be set before the first inter-op parallel work, keep what is there
+        pass
+
+
+def train_pinn(model, train_data, val_data, epochs: int=5000000, lr: float=0.1, batch_size: int=None,
+               val_every: int=1, patience: int=50000, scheduler_args: dict=None, log_every: int=500,
+               history: bool=False, state: dict=None):
+    """Trains the model with Adam and a ReduceLROnPlateau scheduler, with early stopping on the validation loss.
+
+    train_data and val_data are tuples (x, Dv_comp, Mv_dot, Cv, g_eta, tau, nu) of tensors, as loss_function takes
+    them. With batch_size, every epoch goes through the training data in shuffled mini-batches, otherwise it is one
+    full-batch step. The validation loss is evaluated every val_every epochs and training stops after patience epochs
+    without improvement. The model is left with the weights of the best validation loss.
+
+    state continues the training of a previous call: a dict with the "optimizer" and "scheduler" state_dicts and the
+    early stopping "best_val_loss" and "counter", or empty to start anew. It is updated in place at the end, e.g. to
+    save it with the model.
+
+    Returns the best validation loss and, with history, a dict with the training loss and learning rate per epoch and
+    the validation losses at the epochs in "val_epoch"."""
+
+    optimizer = torch.optim.Adam(model.parameters(), lr=lr)
+    scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(optimizer=optimizer, mode="min", **(scheduler_args or {}))
+    if state:
+        optimizer.load_state_dict(state["optimizer"])
+        scheduler.load_state_dict(state["scheduler"])
+
+    n_samples = len(train_data[0])
+    if batch_size is None or batch_size >= n_samples:
+        batch_size = None
+
+    log = {"loss": [], "lr": [], "val_epoch": [], "val_loss": []}
+
+    # Early stopping using validation loss
+    best_val_loss = state.get("best_val_loss", float("inf")) if state else float("inf")
+    counter = state.get("counter", 0) if state else 0
+    # Saving a copy of the best model before overfitting takes place, state_dict() only references the live weights
+    best_model_state = copy.deepcopy(model.state_dict())
+
+    for epoch in range(epochs):
+
+        model.train()
+
+        # Shuffled mini-batches, indexed from the tensors in memory
+        if batch_size is None:
+            batches = [train_data]
+        else:
+            batches = [[data[idx] for data in train_data] for idx in torch.randperm(n_samples).split(batch_size)]
+
+        epoch_loss = 0.0
+        for batch in batches:
+            optimizer.zero_grad()
+            loss = loss_function(model, *batch)
+            loss.backward()
+            optimizer.step()
+            epoch_loss += loss.item() * len(batch[0])
+        epoch_loss /= n_samples
+
+        # Step the scheduler
+        scheduler.step(epoch_loss)
+        lr_now = optimizer.param_groups[0]['lr']
+
+        if history:
+            log["loss"].append(epoch_loss)
+            log["lr"].append(lr_now)
+
+        if epoch % log_every == 0:
+            print(f" Still training, epoch {epoch}, loss: {epoch_loss}, lr: {lr_now}")
+
+        if epoch % val_every != 0 and epoch != epochs - 1:
+            continue
+
+        # Evaluate model on validation data
+        model.eval()
+        with torch.no_grad():
+            val_loss = loss_function(model, *val_data).item()
+
+        if history:
+            log["val_epoch"].append(epoch)
+            log["val_loss"].append(val_loss)
+
+        # Early stopping based on validation loss
+        if val_loss < best_val_loss:
+            best_val_loss = val_loss
+            counter = 0 # Reset counter
+            best_model_state = copy.deepcopy(model.state_dict())
+        else:
+            counter += val_every
+
+        if counter >= patience:
+            print(f" Stopping early due to no improvement after {patience} epochs from epoch: {epoch-counter}")
+            break
+
+    # Restore the best model
+    model.load_state_dict(best_model_state)
+
+    if state is not None:
+        state.update(optimizer=optimizer.state_dict(), scheduler=scheduler.state_dict(), best_val_loss=best_val_loss,
+                     counter=counter)
+
+    if history:
+        return best_val_loss, log
+    return best_val_loss
+
+
+class PINNInference:
+
+    """
+    Forward pass of a trained PINN in plain NumPy, for evaluating D inside the
+    simulator. The weights are extracted once, there is no autograd and no
+    conversion to and from torch tensors on every call.
+
+    Takes a PINN or its state_dict. Called with a (19,) state it returns the
+    (6, 6) D, with an (N, 19) array of states the (N, 6, 6) stack.
+    """
+
+    def __init__(self, model, dtype=np.float64):
+        state_dict = model.state_dict() if hasattr(model, "state_dict") else model
+        n_layers = len([name for name in state_dict if name.endswith(".weight")])
+
+        def to_numpy(value):
+            if hasattr(value, "detach"):
+                value = value.detach().cpu().numpy()
+            return np.array(value, dtype=dtype)
+
+        # Weights as (in, out), so that a batch of states is multiplied from the left
+        self.weights = [to_numpy(state_dict[f"layers.{i}.weight"]).T.copy() for i in range(n_layers)]
+        self.biases = [to_numpy(state_dict[f"layers.{i}.bias"]) for i in range(n_layers)]
+        self.dtype = dtype
+
+    def __call__(self, x):
+        x = np.asarray(x, dtype=self.dtype)
+
+        # Apply activation function to all layers except last
+        h = x
+        for W, b in zip(self.weights[:-1], self.biases[:-1]):
+            h = h @ W
+            h += b
+            np.maximum(h, 0, out=h)
+        A_flat = h @ self.weights[-1] + self.biases[-1]
+
+        # Calculating D from A
+        A_mat = A_flat.reshape(x.shape[:-1] + (6, 6))
+        return A_mat @ np.swapaxes(A_mat, -2, -1)
+
+
 def init_pinn_model(file_name: str):
     # For easy initialization of model in other files
     dict_path = "src/smarc_modelling/piml/models/" + file_name
@@ -79,6 +236,8 @@ def init_pinn_model(file_name: str):
 
 def pinn_predict(model, eta, nu, u):
     # For easy prediction in other files
+    if isinstance(model, PINNInference):
+        return model(np.concatenate([np.ravel(eta), np.ravel(nu), np.ravel(u)]))
 
     # Flatten input
     eta = np.array(eta, dtype=np.float32).flatten()
@@ -116,74 +275,23 @@ if __name__ == "__main__":
     eta_val, nu_val, u_val, u_val_cmd, Dv_comp_val, Mv_dot_val, Cv_val, g_eta_val, tau_val, t_val = load_data_from_bag(validate_path, "torch")
     x_val = torch.cat([eta_val, nu_val, u_val], dim=1)
 
-    # Initialize model and optimizer
+    # Training settings, batch_size None trains on the full batch
+    batch_size = None
+    val_every = 1
+    set_threads()
+
+    # Initialize model
     shape = [19, 32, 64, 128, 128, 64, 36]
     model = PINN(shape)
-    optimizer = torch.optim.Adam(model.parameters(), lr=0.1)
 
-    # Adaptive learning rate
-    scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(optimizer=optimizer, mode="min", factor=0.95, patience=5000, threshold=1, min_lr=1e-5)
-
-    # For plotting loss and lr
-    if "plot" in sys.argv:
-        loss_history = []
-        val_loss_history = []
-        lr_history = []
-
-    # Early stopping using validation loss
-    best_val_loss = float("inf")
-    # How long we wait before stopping training
-    patience = 50000
-    counter = 0
-    # Saving the best model before overfitting takes place
-    best_model_state = None
-
-    # Training loop
-    epochs = 5000000
+    # Training with adaptive learning rate and early stopping on the validation loss
     print(f" Starting training...")
-    for epoch in range(epochs):
-        
-        model.train()
-        optimizer.zero_grad()
-
-        # Forward pass
-        D_pred = model(x)
-
-        # Forward pass on training and loss computation
-        loss = loss_function(model, x, Dv_comp, Mv_dot, Cv, g_eta, tau, nu)
-        loss.backward()
-        optimizer.step()
-
-        # Step the scheduler
-        scheduler.step(loss)
-
-        # Evaluate model on validation data
-        model.eval()
-        with torch.no_grad():
-            val_loss = loss_function(model, x_val, Dv_comp_val, Mv_dot_val, Cv_val, g_eta_val, tau_val, nu_val)
-
-        # Saving loss and learning rate for plotting
-        if "plot" in sys.argv:
-            loss_history.append(loss.item())
-            val_loss_history.append(val_loss.item())
-            lr_history.append(optimizer.param_groups[0]['lr'])
-
-        # Early stopping based on validation loss
-        if val_loss.item() < best_val_loss:
-            best_val_loss = val_loss.item()
-            counter = 0 # Reset counter
-            best_model_state = model.state_dict() # Saving the best model
-        else:
-            counter += 1
-
-        if epoch % 500 == 0:
-            print(f" Still training, epoch {epoch}, loss: {loss.item()}, lr: {optimizer.param_groups[0]['lr']}")
-        
-        if counter >= patience:
-            print(f" Stopping early due to no improvement after {patience} epochs from epoch: {epoch-counter}")
-            # Restore the best model
-            model.load_state_dict(best_model_state)
-            break
+    _, history = train_pinn(model,
+                            (x, Dv_comp, Mv_dot, Cv, g_eta, tau, nu),
+                            (x_val, Dv_comp_val, Mv_dot_val, Cv_val, g_eta_val, tau_val, nu_val),
+                            epochs=5000000, lr=0.1, batch_size=batch_size, val_every=val_every, patience=50000,
+                            scheduler_args={"factor": 0.95, "patience": 5000, "threshold": 1, "min_lr": 1e-5},
+                            history=True)
 
     print(f" Training done!")
     
@@ -197,16 +305,16 @@ if __name__ == "__main__":
 
         # Loss
         ax = plt.subplot(2, 1, 1)
-        plt.plot(loss_history, linestyle="-", color="green", label="Training loss")
+        plt.plot(history["loss"], linestyle="-", color="green", label="Training loss")
         ax.set_yscale('log')
         plt.xlabel("Epoch")
         plt.ylabel("log(Loss)")
-        plt.plot(val_loss_history, linestyle="-", color="red", label="Validation loss")
+        plt.plot(history["val_epoch"], history["val_loss"], linestyle="-", color="red", label="Validation loss")
         plt.legend()
 
         # Learning rate
         plt.subplot(2, 1, 2)
-        plt.plot(lr_history, linestyle="-", label="Learning Rate")
+        plt.plot(history["lr"], linestyle="-", label="Learning Rate")
         plt.xlabel("Epoch")
         plt.ylabel("Learning Rate")
         plt.ylim(0, 0.012)
@@ -3,6 +3,11 @@
 
 # Contains various functions that are used multiple times across the different PIML files
 
+import hashlib
+import json
+import os
+import shutil
+from operator import attrgetter
 import rosbag2_py
 from rclpy.serialization import deserialize_message
 from rosidl_runtime_py.utilities import get_message
@@ -12,121 +17,164 @@ import torch
 from smarc_modelling.lib.gnc import *
 
 
-def load_rosbag(bag_path: str=""):
-    """Loads the data from a rosbag and separates it out into the different state vectors"""
+# Fields read from every /synched_data message, with their attribute in the message. All headers are synched, so the
+# time is taken from lcg_cmd.
+SYNCHED_DATA_FIELDS = [
+    # Controls
+    ("lcg_cmd", "lcg_cmd.value"),
+    ("lcg_fb", "lcg_fb.value"),
+    ("dS", "thrust_vector_cmd.thruster_vertical_radians"),
+    ("dR", "thrust_vector_cmd.thruster_horizontal_radians"),
+    ("rpm1_cmd", "thruster1_cmd.rpm"),
+    ("rpm1_fb", "thruster1_fb.rpm.rpm"),
+    ("rpm2_cmd", "thruster2_cmd.rpm"),
+    ("rpm2_fb", "thruster2_fb.rpm.rpm"),
+    ("vbs_cmd", "vbs_cmd.value"),
+    ("vbs_fb", "vbs_fb.value"),
+    # Pose
+    ("x", "odom_gt.pose.pose.position.x"),
+    ("y", "odom_gt.pose.pose.position.y"),
+    ("z", "odom_gt.pose.pose.position.z"),
+    ("q1", "odom_gt.pose.pose.orientation.x"),
+    ("q2", "odom_gt.pose.pose.orientation.y"),
+    ("q3", "odom_gt.pose.pose.orientation.z"),
+    ("q4", "odom_gt.pose.pose.orientation.w"),
+    # Speeds
+    ("u", "odom_gt.twist.twist.linear.x"),
+    ("v", "odom_gt.twist.twist.linear.y"),
+    ("w", "odom_gt.twist.twist.linear.z"),
+    ("p", "odom_gt.twist.twist.angular.x"),
+    ("q", "odom_gt.twist.twist.angular.y"),
+    ("r", "odom_gt.twist.twist.angular.z"),
+]
+SYNCHED_DATA_DTYPE = np.dtype([("time", np.float64)] + [(name, np.float64) for name, _ in SYNCHED_DATA_FIELDS])
+
+
+def synched_data_cache_path(bag_path: str):
+    """Path of the decoded /synched_data next to the bag"""
+    return os.path.normpath(bag_path) + ".synched_data.npy"
 
-    # Initialize reader
+
+def read_synched_data(bag_path: str="", cache: bool=True):
+    """Reads all /synched_data messages of a rosbag into a structured array with the fields of SYNCHED_DATA_DTYPE.
+
+    With cache, the array is saved next to the bag and memory-mapped from there on later calls, unless the bag has
+    changed since."""
+
+    cache_path = synched_data_cache_path(bag_path)
+    if cache and os.path.isfile(cache_path) and os.path.getmtime(cache_path) >= _bag_mtime(bag_path):
+        return np.load(cache_path, mmap_mode="r")
+
+    # Initialize reader, only reading the synched topic
     storage_options = rosbag2_py.StorageOptions(uri=bag_path, storage_id="sqlite3")
     converter_options = rosbag2_py.ConverterOptions("cdr", "cdr")
     reader = rosbag2_py.SequentialReader()
     reader.open(storage_options, converter_options)
-
-    # Get all topics and type
-    topics = reader.get_all_topics_and_types()
+    reader.set_filter(rosbag2_py.StorageFilter(topics=["/synched_data"]))
 
     # Find message type
-    topic_type_map = {topic.name: topic.type for topic in topics}
+    topic_type_map = {topic.name: topic.type for topic in reader.get_all_topics_and_types()}
     msg_class = get_message(topic_type_map.get("/synched_data"))
 
-    # Data for output
-    time = []
-    # Controls
-    lcg_cmd = []
-    lcg_fb = []
-    dS = []
-    dR = []
-    rpm1_cmd = []
-    rpm1_fb = []
-    rpm2_cmd = []
-    rpm2_fb = []
-    vbs_cmd = []
-    vbs_fb = []
-    # Pose
-    x = []
-    y = []
-    z = []
-    q1 = []
-    q2 = []
-    q3 = []
-    q4 = []
-    # Speeds
-    u = []
-    v = []
-    w = []
-    p = []
-    q = []
-    r = []
-    # Accelerations
-    u_dot = []
-    v_dot = []
-    w_dot = []
-    p_dot = []
-    q_dot = []
-    r_dot = []
-
-    # Read messages
+    # Preallocate from the message count in the bag metadata, grown below if the bag has more messages than that
+    n_messages = sum(topic.message_count for topic in reader.get_metadata().topics_with_message_count
+                     if topic.topic_metadata.name == "/synched_data")
+    data = np.empty(n_messages, dtype=SYNCHED_DATA_DTYPE)
+    get_fields = attrgetter(*(path for _, path in SYNCHED_DATA_FIELDS))
+
+    # Read messages, one row per message
+    n = 0
     while reader.has_next():
-        (topic, data, timestamp) = reader.read_next()
-        
-        # Getting msg into right format
-        msg = deserialize_message(data, msg_class)
-
-        # Appending data to vectors
-        # Time
-        time.append(msg.lcg_cmd.header.stamp.sec + msg.lcg_cmd.header.stamp.nanosec * 1e-9) # Time from lcg_cmd but all headers are synched so really does not matter
-        
-        # Controls
-        lcg_fb.append(msg.lcg_fb.value)
-        lcg_cmd.append(msg.lcg_cmd.value)
-        dS.append(msg.thrust_vector_cmd.thruster_vertical_radians)
-        dR.append(msg.thrust_vector_cmd.thruster_horizontal_radians)
-        rpm1_fb.append(msg.thruster1_fb.rpm.rpm)
-        rpm1_cmd.append(msg.thruster1_cmd.rpm) 
-        rpm2_fb.append(msg.thruster2_fb.rpm.rpm)
-        rpm2_cmd.append(msg.thruster2_cmd.rpm)
-        vbs_fb.append(msg.vbs_fb.value)
-        vbs_cmd.append(msg.vbs_cmd.value)
-
-        # Pose
-        x.append(msg.odom_gt.pose.pose.position.x)
-        y.append(msg.odom_gt.pose.pose.position.y)
-        z.append(msg.odom_gt.pose.pose.position.z)
-        q1.append(msg.odom_gt.pose.pose.orientation.x)
-        q2.append(msg.odom_gt.pose.pose.orientation.y)
-        q3.append(msg.odom_gt.pose.pose.orientation.z)
-        q4.append(msg.odom_gt.pose.pose.orientation.w)
-
-        # Speeds
-        u.append(msg.odom_gt.twist.twist.linear.x)
-        v.append(msg.odom_gt.twist.twist.linear.y)
-        w.append(msg.odom_gt.twist.twist.linear.z)
-        p.append(msg.odom_gt.twist.twist.angular.x)
-        q.append(msg.odom_gt.twist.twist.angular.y)
-        r.append(msg.odom_gt.twist.twist.angular.z)
+        (topic, msg_data, timestamp) = reader.read_next()
+        msg = deserialize_message(msg_data, msg_class)
+        if n == len(data):
+            data = np.concatenate((data, np.empty(max(n, 1024), dtype=SYNCHED_DATA_DTYPE)))
+        stamp = msg.lcg_cmd.header.stamp
+        data[n] = (stamp.sec + stamp.nanosec * 1e-9,) + get_fields(msg)
+        n += 1
+    data = data[:n]
+
+    if cache:
+        # Write to a temporary file first, so an interrupted run does not leave a broken cache
+        tmp_path = f"{cache_path}.{os.getpid()}.npy"
+        np.save(tmp_path, data)
+        os.replace(tmp_path, cache_path)
+
+    return data
+
+
+def _bag_mtime(bag_path: str):
+    """Latest modification time of the files of a bag"""
+    if os.path.isdir(bag_path):
+        return max((os.path.getmtime(os.path.join(bag_path, name)) for name in os.listdir(bag_path)),
+                   default=os.path.getmtime(bag_path))
+    return os.path.getmtime(bag_path)
+
+
+def load_rosbag(bag_path: str="", cache: bool=True):
+    """Loads the data from a rosbag and separates it out into the different state vectors"""
+
+    data = read_synched_data(bag_path, cache)
+    time = np.array(data["time"])
 
     # Calculating acceleration numerically (No ROS source)
-    u_dot = np.gradient(u, time)
-    v_dot = np.gradient(v, time)
-    w_dot = np.gradient(w, time)
-    p_dot = np.gradient(p, time)
-    q_dot = np.gradient(q, time)
-    r_dot = np.gradient(r, time)
-    
-    eta = [x, y, z, q1, q2, q3, q4]
-    nu = [u, v, w, p, q, r]
-    acc = [u_dot, v_dot, w_dot, p_dot, q_dot, r_dot]
-    u_control = [vbs_cmd, lcg_cmd, dS, dR, rpm1_cmd, rpm2_cmd]
-    u_control_ref = [vbs_fb, lcg_fb, dS, dR, rpm1_cmd, rpm2_cmd] # We use rpm_cmd here since rpm_fb is not working atm
-    
+    acc = [np.gradient(data[name], time) for name in ("u", "v", "w", "p", "q", "r")]
+
+    eta = np.array([data[name] for name in ("x", "y", "z", "q1", "q2", "q3", "q4")])
+    nu = np.array([data[name] for name in ("u", "v", "w", "p", "q", "r")])
+    acc = np.array(acc)
+    u_control = np.array([data[name] for name in ("vbs_cmd", "lcg_cmd", "dS", "dR", "rpm1_cmd", "rpm2_cmd")])
+    u_control_ref = np.array([data[name] for name in ("vbs_fb", "lcg_fb", "dS", "dR", "rpm1_cmd", "rpm2_cmd")]) # We use rpm_cmd here since rpm_fb is not working atm
+
     return time, eta, nu, acc, u_control, u_control_ref
 
 
-def load_data_from_bag(data_file: str="", return_type: str=""):
-    """Loads the rosbag and does the needed post processing to calculate things needed for physics loss"""
+# Processed datasets are cached here, see load_data_from_bag
+DATASET_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "smarc_modelling", "piml")
+
+# Outputs of load_data_from_bag, in order
+DATASET_FIELDS = ("eta", "nu", "u_fb", "u_cmd", "Dv_comp", "Mv_dot", "Cv", "g_eta", "tau", "time")
+
+# SAM parameters the processed data depends on, directly or through the hash of the model source
+SAM_DATASET_PARAMETERS = ("vbs_factor", "inertia_factor", "damping_factor", "damping_rot", "thruster_rot_strength",
+                          "V_c", "beta_c", "inertia_cache_resolution")
+
+
+def load_data_from_bag(data_file: str="", return_type: str="", sam=None, cache: bool=True):
+    """Loads the rosbag and does the needed post processing to calculate things needed for physics loss
+
+    sam is the white-box model for the physics loss, the default SAM if None. With cache, the outputs are saved in
+    DATASET_CACHE_DIR and loaded from there, memory-mapped, as long as the bag, the parameters of sam and the code of
+    the processing are unchanged."""
 
     # Importing SAM for getting some values from dynamics function
     from smarc_modelling.vehicles.SAM import SAM
 
+    if sam is None:
+        sam = SAM()
+
+    dtype = np.float32 if return_type == "torch" else np.float64
+    if cache:
+        cache_path = os.path.join(DATASET_CACHE_DIR, dataset_key(data_file, sam, dtype))
+        if os.path.isdir(cache_path):
+            print(f" Loading processed data from cache...")
+            data = [np.load(os.path.join(cache_path, name + ".npy"), mmap_mode="c") for name in DATASET_FIELDS]
+        else:
+            data = [x.astype(dtype) for x in process_bag(data_file, sam)]
+            save_dataset(cache_path, data)
+    else:
+        data = [x.astype(dtype) for x in process_bag(data_file, sam)]
+
+    if return_type == "torch": # Return all values as torch tensors, sharing memory with the arrays
+        return tuple(torch.from_numpy(x) for x in data)
+    else: # Return all values as numpy matrices
+        return tuple(data)
+
+
+def process_bag(data_file: str, sam):
+    """Loads the rosbag and calculates the terms of the physics loss with sam. Returns the DATASET_FIELDS as float64
+    arrays."""
+
     # Loading bag
     print(f" Getting data from ROS bag...")
     time, eta, nu, acc, u_cmd, u_fb = load_rosbag(data_file)
@@ -135,72 +183,101 @@ def load_data_from_bag(data_file: str="", return_type: str=""):
     time, eta, nu, acc, u_cmd, u_fb = [np.transpose(x) for x in (time, eta, nu, acc, u_cmd, u_fb)]
     state_vector = np.concatenate([eta, nu, u_fb], axis=1) 
 
-    # SAM white-box model to get M, C and g
-    dt_vec = np.diff(time)
-    sam = SAM(dt_vec[0])
-
-    # Things needed for physics loss
-    Dv_comp = np.zeros((len(state_vector), 6))
-    Mv_dot = np.zeros_like(nu)
-    Cv = np.zeros_like(nu)
-    g_eta = np.zeros_like(nu)
-    tau = np.zeros_like(nu)
-
+    # SAM white-box model to get M, C and g. They do not depend on dt, so the whole log is evaluated at once.
     print(f" Calculating D(v)v...")
+    terms = sam.calculate_terms_batch(state_vector, u_cmd)
+    M, C, g_eta, tau = terms["M"], terms["C"], terms["g_vec"], terms["tau"]
 
-    for t in range(len(state_vector)):
-
-        # Computing acceleration if D = 0
-        try:
-            sam.update_dt(dt_vec[t])
-        except:
-            # dt vec is one shorter than the rest of the data since we used diff for it, so last value is just the mean time-step of the set
-            dt_mean = np.mean(dt_vec)
-            sam.update_dt(dt_mean)
-        sam.dynamics(state_vector[t], u_cmd[t]) # Calling the dynamics to update all matrices directly
-
-        # Calculated acceleration where we have no damping
-        v_dot_nod = sam.Minv @ (sam.tau - sam.C @ nu[t] - sam.g_vec)
+    # Things needed for physics loss
+    Mv_dot = np.einsum("nij,nj->ni", M, acc)
+    Cv = np.einsum("nij,nj->ni", C, nu)
 
-        # Calculate the damping force based on difference in model prediction and real data
-        Dv_comp[t] = sam.M @ (v_dot_nod.T - acc[t].T)
+    # Calculated acceleration where we have no damping
+    v_dot_nod = np.linalg.solve(M, (tau - Cv - g_eta)[..., None])[..., 0]
 
-        # Calculating miscellaneous things for physics loss
-        Mv_dot[t] = sam.M @ acc[t]
-        Cv[t] = sam.C @ nu[t]
-        g_eta[t] = sam.g_vec
-        tau[t] = sam.tau
+    # Calculate the damping force based on difference in model prediction and real data
+    Dv_comp = np.einsum("nij,nj->ni", M, v_dot_nod - acc)
 
     time = time - time[0] # Setting time to start at 0
 
     print(f" Data has been loaded and processed!")
-    if return_type == "torch": # Return all values as torch tensors
-        return(
-            torch.tensor(eta, dtype=torch.float32),
-            torch.tensor(nu, dtype=torch.float32),
-            torch.tensor(u_fb, dtype=torch.float32),
-            torch.tensor(u_cmd, dtype=torch.float32),
-            torch.tensor(Dv_comp, dtype=torch.float32),
-            torch.tensor(Mv_dot, dtype=torch.float32),
-            torch.tensor(Cv, dtype=torch.float32),
-            torch.tensor(g_eta, dtype=torch.float32),
-            torch.tensor(tau, dtype=torch.float32),
-            torch.tensor(time, dtype=torch.float32)
-        )
-    else: # Return all values as numpy matrices
-        return(
-            eta,
-            nu,
-            u_fb,
-            u_cmd,
-            Dv_comp,
-            Mv_dot,
-            Cv,
-            g_eta,
-            tau,
-            time
-        )
-    
+    return eta, nu, u_fb, u_cmd, Dv_comp, Mv_dot, Cv, g_eta, tau, time
+
+
+def save_dataset(cache_path: str, data):
+    """Saves the DATASET_FIELDS as one .npy file each in the directory cache_path"""
+
+    # Write to a temporary directory first, so other processes never see a partial dataset
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    os.makedirs(tmp_path, exist_ok=True)
+    for name, x in zip(DATASET_FIELDS, data):
+        np.save(os.path.join(tmp_path, name + ".npy"), x)
+    try:
+        os.rename(tmp_path, cache_path)
+    except OSError:
+        # Another process saved the same dataset first
+        shutil.rmtree(tmp_path)
+
+
+def dataset_key(data_file: str, sam, dtype=np.float32):
+    """Hash of the bag contents, the SAM parameters, the dtype and the code of the processing"""
+
+    parameters = {name: getattr(sam, name) for name in SAM_DATASET_PARAMETERS if hasattr(sam, name)}
+    parameters["m_ss"] = sam.ss.m_ss
+    content = json.dumps([bag_hash(data_file), parameters, np.dtype(dtype).name, _code_hash()], sort_keys=True,
+                         default=float)
+    return hashlib.sha1(content.encode()).hexdigest()[0:16]
+
+
+def bag_hash(bag_path: str):
+    """Hash of the contents of all files of a bag. Hashes of files with the same size and modification time as the last
+    time are taken from an index in DATASET_CACHE_DIR instead of reading the file again."""
+
+    files = sorted(os.path.join(bag_path, name) for name in os.listdir(bag_path)) if os.path.isdir(bag_path) else [bag_path]
+
+    index_path = os.path.join(DATASET_CACHE_DIR, "bag_hashes.json")
+    index = {}
+    if os.path.isfile(index_path):
+        with open(index_path) as f:
+            index = json.load(f)
+
+    digest = hashlib.sha1()
+    changed = False
+    for path in files:
+        stat = os.stat(path)
+        signature = f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+        if signature not in index:
+            file_digest = hashlib.sha1()
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    file_digest.update(chunk)
+            index[signature] = file_digest.hexdigest()
+            changed = True
+        digest.update(os.path.basename(path).encode())
+        digest.update(index[signature].encode())
+
+    if changed:
+        os.makedirs(DATASET_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{index_path}.{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, index_path)
+
+    return digest.hexdigest()
+
+
+def _code_hash():
+    """Hash of the source of this module and of the SAM model"""
+
+    from smarc_modelling.vehicles import SAM
+    from smarc_modelling.lib import gnc
+
+    digest = hashlib.sha1()
+    for path in (__file__, SAM.__file__, gnc.__file__):
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
 
 def eta_quat_to_rad(eta):
     """Turns quaternion in eta to radians"""
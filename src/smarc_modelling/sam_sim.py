@@ -2,6 +2,7 @@ import numpy as np
 from smarc_modelling.vehicles import *
 from smarc_modelling.lib import *
 from smarc_modelling.vehicles.SAM import SAM
+from smarc_modelling.lib.integrators import simulate
 import matplotlib
 import matplotlib.pyplot as plt
 import matplotlib.animation as animation
@@ -35,16 +36,6 @@ class Sol():
         self.t = t
         self.y = data
 
-        
-def rk4(x, u, dt, fun):
-    k1 = fun(x, u)
-    k2 = fun(x+dt/2*k1, u)
-    k3 = fun(x+dt/2*k2, u)
-    k4 = fun(x+dt*k3, u)
-
-    x_t = x + dt/6 * (k1 + 2*k2 + 2*k3 + k4)
-
-    return x_t
 
 # FIXME: consider removing the dynamics wrapper and just call the dynamics straight away.
 def run_simulation(t_span, x0, dt, sam):
@@ -76,17 +67,13 @@ def run_simulation(t_span, x0, dt, sam):
     # Run integration
     print(f" Start simulation")
 
-    data = np.empty((len(x0), n_sim))
-    data[:,0] = x0
-
-    # Euler forward integration
+    # RK4 integration
     # NOTE: This integrates eta, nu, u_control in the same time step.
     #   Depending on the maneuvers, we might want to integrate nu and u_control first
     #   and use these to compute eta_dot. This needs to be determined based on the 
     #   performance we see.
-    for i in range(n_sim-1):
-        data[:,i+1] = rk4(data[:,i], u, dt, sam.dynamics)
-    sol = Sol(t_eval,data)
+    data = simulate(sam.dynamics, x0, u, dt, n_sim, method="rk4")
+    sol = Sol(t_eval,data.T)
     print(f" Simulation complete!")
 
     return sol
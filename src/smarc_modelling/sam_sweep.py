@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Parallel parameter sweeps and Monte Carlo runs of the SAM model.
+
+Every simulation starts from the same initial state and uses the same
+control schedule, only the model parameters differ:
+
+    params = monte_carlo(500, damping_factor=(30, 90), V_current=(0, 0.3))
+    stats = run_sweep(params, x0, u, dt, "sweep", x_ref=x_logged)
+
+The simulations run in a process pool. The control schedule and the
+optional reference trajectory are put into shared memory once, instead of
+being pickled for every simulation. The output is columnar: a directory with
+one memory mapped .npy file per column (the parameters, the trajectories, the
+position RMSE against x_ref, ...), which each worker writes its results into
+directly. Finished simulations are on disk while the sweep is still running,
+and reading one column does not touch the others, e.g. the trajectories:
+
+    res = load_results("sweep")
+    res["damping_factor"][res["done"]], res["rmse"][res["done"]]
+"""
+
+import itertools
+import multiprocessing
+import os
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from smarc_modelling.lib.integrators import simulate
+from smarc_modelling.vehicles.SAM import SAM
+from smarc_modelling.vehicles.SAM_kernel import SAMKernel
+
+# Parameters that can be swept. V_current and beta_current (deg) are the
+# constructor arguments of SAM, the others are attributes of the instance.
+# vbs_factor is not included, it does not enter SAM.dynamics.
+ATTRIBUTE_PARAMETERS = ("inertia_factor", "damping_factor", "damping_rot")
+SWEEP_PARAMETERS = ATTRIBUTE_PARAMETERS + ("V_current", "beta_current")
+
+
+def default_parameters():
+    """
+    The parameter values of a default SAM instance
+    """
+    sam = SAM()
+    params = {name: getattr(sam, name) for name in ATTRIBUTE_PARAMETERS}
+    params["V_current"] = sam.V_c
+    params["beta_current"] = sam.beta_c / sam.D2R
+
+    return params
+
+
+def parameter_array(n):
+    """
+    Structured array of n parameter sets, filled with the default values
+    """
+    params = np.zeros(n, dtype=[(name, float) for name in SWEEP_PARAMETERS])
+    for name, value in default_parameters().items():
+        params[name] = value
+
+    return params
+
+
+def _check_names(names):
+    unknown = [name for name in names if name not in SWEEP_PARAMETERS]
+    if unknown:
+        raise ValueError(f"Cannot sweep {', '.join(unknown)}, the parameters are {', '.join(SWEEP_PARAMETERS)}.")
+
+
+def grid(**values):
+    """
+    params = grid(damping_factor=[40, 60, 80], V_current=[0, 0.1]) is the
+    cartesian product of the given values. Parameters that are not given
+    keep their default value.
+    """
+    names = list(values.keys())
+    _check_names(names)
+    combinations = list(itertools.product(*[np.atleast_1d(values[name]) for name in names]))
+
+    params = parameter_array(len(combinations))
+    for i, name in enumerate(names):
+        params[name] = [c[i] for c in combinations]
+
+    return params
+
+
+def monte_carlo(n, seed=0, **bounds):
+    """
+    params = monte_carlo(n, damping_factor=(40, 80)) draws n parameter sets
+    uniformly within the given (low, high) bounds. Parameters that are not
+    given keep their default value.
+    """
+    _check_names(bounds.keys())
+    rng = np.random.default_rng(seed)
+
+    params = parameter_array(n)
+    for name, (low, high) in bounds.items():
+        params[name] = rng.uniform(low, high, n)
+
+    return params
+
+
+def make_sam(params, dt, use_jit=False):
+    """
+    SAM instance with the parameters of one row of a parameter array (or a
+    dict of scalars), wrapped in a SAMKernel for fast evaluation
+    """
+    sam = SAM(dt, V_current=float(params["V_current"]), beta_current=float(params["beta_current"]))
+    for name in ATTRIBUTE_PARAMETERS:
+        setattr(sam, name, float(params[name]))
+
+    return SAMKernel(sam, jit=use_jit)
+
+
+def result_columns(n_sims, n_steps, nx, store_trajectory=True):
+    """
+    Columns of the output directory, as a dict of (dtype, shape)
+    """
+    columns = {name: (float, (n_sims,)) for name in SWEEP_PARAMETERS}
+    columns.update({
+        "done": (bool, (n_sims,)),
+        "finite": (bool, (n_sims,)),
+        "rmse": (float, (n_sims,)),
+        "wall_time": (float, (n_sims,)),
+        "x_final": (float, (n_sims, nx)),
+    })
+    if store_trajectory:
+        columns["x"] = (float, (n_sims, n_steps, nx))
+
+    return columns
+
+
+def load_results(path, mmap_mode="r"):
+    """
+    The columns of a sweep written by run_sweep(), as a dict of memory mapped
+    arrays
+    """
+    return {name[:-len(".npy")]: np.load(os.path.join(path, name), mmap_mode=mmap_mode)
+            for name in sorted(os.listdir(path)) if name.endswith(".npy")}
+
+#------------------------------------------------------------------------------
+# Workers. Each process attaches to the shared memory and opens the output
+# file once, in _init_worker.
+
+_worker = {}
+
+
+def _attach(name, shape):
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=float, buffer=shm.buf)
+
+
+def _init_worker(config):
+    _worker["config"] = config
+    _worker["shm"] = []
+
+    shm, _worker["u"] = _attach(config["u_name"], config["u_shape"])
+    _worker["shm"].append(shm)
+
+    _worker["x_ref"] = None
+    if config["x_ref_name"] is not None:
+        shm, _worker["x_ref"] = _attach(config["x_ref_name"], config["x_ref_shape"])
+        _worker["shm"].append(shm)
+
+    _worker["out"] = load_results(config["path"], mmap_mode="r+")
+
+
+def _run_one(i):
+    config = _worker["config"]
+    out = _worker["out"]
+    x_ref = _worker["x_ref"]
+    start = time.perf_counter()
+
+    kernel = make_sam({name: out[name][i] for name in SWEEP_PARAMETERS}, config["dt"], config["use_jit"])
+    x = simulate(kernel.dynamics, config["x0"], _worker["u"], config["dt"], config["n_steps"],
+                 method=config["method"], update_dt=kernel.update_dt)
+
+    if config["store_trajectory"]:
+        out["x"][i] = x
+    out["x_final"][i] = x[-1]
+    out["finite"][i] = np.all(np.isfinite(x))
+    if x_ref is not None:
+        out["rmse"][i] = np.sqrt(np.mean(np.sum((x[:, 0:3] - x_ref[:, 0:3])**2, axis=1)))
+    else:
+        out["rmse"][i] = np.nan
+    out["wall_time"][i] = time.perf_counter() - start
+    out["done"][i] = True
+
+    return i
+
+#------------------------------------------------------------------------------
+
+def _to_shared_memory(array):
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=float, buffer=shm.buf)[:] = array
+    return shm
+
+
+def run_sweep(params, x0, u, dt, path, n_steps=None, x_ref=None, method="rk4",
+              n_workers=None, use_jit=False, store_trajectory=True, chunksize=1,
+              verbose=True):
+    """
+    Simulate SAM for every parameter set in params.
+
+    Args:
+        params: structured parameter array, see grid() and monte_carlo()
+        x0: initial state (19,)
+        u: control input (6,) held constant, or (n_steps-1, 6) control schedule
+        dt: time step
+        path: output directory, one .npy file per column, see result_columns()
+            and load_results()
+        n_steps: number of samples per trajectory, taken from u or x_ref if omitted
+        x_ref: optional (n_steps, 19) reference, e.g. a logged run, for the
+            position RMSE
+        method: integration method, see lib/integrators.py
+        n_workers: number of processes, defaults to the number of CPUs
+        use_jit: use the numba compiled dynamics kernel
+        store_trajectory: store the full trajectories, otherwise only the
+            final state and the RMSE
+
+    Returns:
+        stats: dict with n_sims, wall_time and sims_per_second
+    """
+    x0 = np.asarray(x0, dtype=float)
+    u = np.asarray(u, dtype=float)
+    if x_ref is not None:
+        x_ref = np.asarray(x_ref, dtype=float)
+
+    if n_steps is None:
+        if u.ndim > 1:
+            n_steps = u.shape[0] + 1
+        elif x_ref is not None:
+            n_steps = x_ref.shape[0]
+        else:
+            raise ValueError("n_steps is needed for a constant control input.")
+
+    n_sims = len(params)
+    columns = result_columns(n_sims, n_steps, len(x0), store_trajectory)
+    os.makedirs(path, exist_ok=True)
+    # Drop the trajectories of an earlier sweep into the same directory
+    for name in set(result_columns(0, 0, 0)) - set(columns):
+        if os.path.exists(os.path.join(path, name + ".npy")):
+            os.remove(os.path.join(path, name + ".npy"))
+    for name, (dtype, shape) in columns.items():
+        column = open_memmap(os.path.join(path, name + ".npy"), mode="w+", dtype=dtype, shape=shape)
+        if name in SWEEP_PARAMETERS:
+            column[:] = params[name]
+        elif name == "done":
+            column[:] = False
+        column.flush()
+        del column
+
+    shms = [_to_shared_memory(u)]
+    if x_ref is not None:
+        shms.append(_to_shared_memory(x_ref))
+
+    config = {
+        "path": path,
+        "x0": x0,
+        "dt": dt,
+        "n_steps": n_steps,
+        "method": method,
+        "use_jit": use_jit,
+        "store_trajectory": store_trajectory,
+        "u_name": shms[0].name,
+        "u_shape": u.shape,
+        "x_ref_name": shms[1].name if x_ref is not None else None,
+        "x_ref_shape": x_ref.shape if x_ref is not None else None,
+    }
+
+    start = time.perf_counter()
+    try:
+        with multiprocessing.Pool(n_workers, initializer=_init_worker, initargs=(config,)) as pool:
+            for n_done, _ in enumerate(pool.imap_unordered(_run_one, range(n_sims), chunksize), 1):
+                if verbose and (n_done % max(1, n_sims // 10) == 0 or n_done == n_sims):
+                    elapsed = time.perf_counter() - start
+                    print(f" {n_done}/{n_sims} simulations, {n_done/elapsed:.1f} sims/s")
+    finally:
+        for shm in shms:
+            shm.close()
+            shm.unlink()
+
+    wall_time = time.perf_counter() - start
+    stats = {
+        "n_sims": n_sims,
+        "wall_time": wall_time,
+        "sims_per_second": n_sims / wall_time,
+    }
+
+    return stats
+
+
+if __name__ == "__main__":
+    import sys
+
+    # Initial conditions, see sam_sim.py
+    x0 = np.zeros(19)
+    x0[2] = -1
+    x0[3] = 1.0
+    x0[13] = 50
+    x0[14] = 50
+
+    dt = 0.01
+    n_steps = 500
+
+    # Dive with some rudder, then level out
+    u = np.zeros((n_steps-1, 6))
+    u[:, 0] = 50
+    u[:, 1] = 50
+    u[:, 2] = np.deg2rad(5)
+    u[:, 3] = -np.deg2rad(5)
+    u[:, 4] = 1000
+    u[:, 5] = 1000
+    u[n_steps//2:, 2] = 0
+
+    params = monte_carlo(64, damping_factor=(40, 80), inertia_factor=(5, 15),
+                         V_current=(0, 0.3), beta_current=(-180, 180))
+
+    path = sys.argv[1] if len(sys.argv) > 1 else "sam_sweep"
+    stats = run_sweep(params, x0, u, dt, path)
+    print(f" {stats['n_sims']} simulations in {stats['wall_time']:.2f} s, "
+          f"{stats['sims_per_second']:.1f} sims/s, results in {path}")
@@ -40,6 +40,10 @@ import numpy as np
 import math
 from scipy.linalg import block_diag
 from smarc_modelling.lib.gnc import *
+from smarc_modelling.vehicles.BlueROV_kernel import BlueROVKernel
+
+# Parameters that can be set per state in dynamics_batch
+BATCH_PARAMETERS = ("m", "damping_scale", "V_current", "beta_current")
 
 
 class SolidStructure:
@@ -74,6 +78,10 @@ class BlueROV():
         eta: [x, y, z, q0, q1, q2, q3] - Position and quaternion orientation
         nu: [u, v, w, p, q, r] - Body-fixed linear and angular velocities
 
+    With use_jit=True, dynamics() is evaluated by the numba compiled kernel in
+    BlueROV_kernel.py. The intermediate attributes (C, D, g_vec, tau, ...) are
+    then not updated.
+
     Vectors follow Tedrake's monogram:
     https://manipulation.csail.mit.edu/pick.html#monogram
     """
@@ -82,6 +90,7 @@ class BlueROV():
             dt=0.02,
             V_current=0,
             beta_current=0,
+            use_jit=False,
     ):
         self.dt = dt # Sim time step, necessary for evaluation of the actuator dynamics
 
@@ -157,6 +166,12 @@ class BlueROV():
 
         self.gamma = 100 # Scaling factor for numerical stability of quaternion differentiation
 
+        # Compiled fast path
+        self.use_jit = use_jit
+        self.kernel = None
+        if use_jit:
+            self.kernel = BlueROVKernel(self, jit=True)
+
     def init_vehicle(self):
         """
         Initialize all subsystems based on their respective parameters
@@ -182,6 +197,9 @@ class BlueROV():
         Returns:
             state_vector_dot: Time derivative of complete state vector
         """
+        if self.kernel is not None:
+            return self.kernel.dynamics(np.asarray(x, float), np.asarray(u_ref, float))
+
         eta = x[0:7]
         nu = x[7:13]
         u = u_ref
@@ -192,8 +210,6 @@ class BlueROV():
         self.calculate_g()
         self.calculate_tau(u)
 
-        np.set_printoptions(precision=3)
-
         nu_dot = self.Minv @ (self.tau - np.matmul(self.C,self.nu_r) - np.matmul(self.D,self.nu_r) - self.g_vec)
         eta_dot = self.eta_dynamics(eta, nu)
         x_dot = np.concatenate([eta_dot, nu_dot])
@@ -201,6 +217,89 @@ class BlueROV():
         return x_dot
 
 
+    def dynamics_batch(self, X, U_ref, params=None):
+        """
+        Vectorized dynamics for N states at once, the counterpart of
+        SAM.dynamics_batch. Evaluates the same model as dynamics() without
+        writing the intermediate results back into the vehicle.
+
+        Args:
+            X: (N, 13) array of state vectors [eta, nu]
+            U_ref: (N, 6) array of control inputs, or a single (6,) input
+                applied to all states, as forces and torques [X, Y, Z, K, M, N]
+            params: optional per-state parameters, see batch_parameters()
+
+        Returns:
+            X_dot: (N, 13) array of state vector time derivatives
+        """
+        X = np.atleast_2d(X)
+        N = X.shape[0]
+        U_ref = np.broadcast_to(U_ref, (N, 6))
+        p = self.batch_parameters(params, N)
+
+        eta = X[:, 0:7]
+        nu = X[:, 7:13]
+
+        # System state
+        quat = eta[:, 3:7] / np.linalg.norm(eta[:, 3:7], axis=1, keepdims=True)
+        psi, theta, phi = quaternion_to_angles_batch(quat)
+
+        beta_c = p["beta_current"] * self.D2R
+        nu_c = np.zeros((N, 6))
+        nu_c[:, 0] = p["V_current"] * np.cos(beta_c - psi)
+        nu_c[:, 1] = p["V_current"] * np.sin(beta_c - psi)
+        nu_r = nu - nu_c
+
+        # Mass matrix, MRB and MA are diagonal
+        MRB_diag = np.tile(np.diag(self.MRB), (N, 1))
+        MRB_diag[:, 0:3] = p["m"][:, None]
+        M_diag = MRB_diag + np.diag(self.MA)
+
+        idx = np.arange(6)
+        M = np.zeros((N, 6, 6))
+        M[:, idx, idx] = M_diag
+
+        # Coriolis, C = m2c(MRB) + m2c(MA) = m2c(M)
+        C = m2c_batch(M, nu_r)
+
+        # Linear and nonlinear damping
+        D_lin = np.diag(self.D_lin)
+        D_nl = np.array([self.Xuu, self.Yvv, self.Zww, self.Kpp, self.Mqq, self.Nrr])
+        D_diag = p["damping_scale"][:, None] * (D_lin + D_nl * np.abs(nu_r))
+
+        g_vec = gvect_batch(p["m"] * self.g, self.B, theta, phi, self.p_OG_O, self.p_OB_O)
+
+        rhs = U_ref - np.einsum('nij,nj->ni', C, nu_r) - D_diag * nu_r - g_vec
+        nu_dot = rhs / M_diag
+        eta_dot = self.eta_dynamics_batch(eta, nu)
+
+        return np.concatenate([eta_dot, nu_dot], axis=1)
+
+    def batch_parameters(self, params, N):
+        """
+        Per-state parameters for dynamics_batch. params maps the names in
+        BATCH_PARAMETERS to scalars or (N,) arrays, e.g. a dict or a
+        structured array. Missing parameters take the value of this instance.
+        damping_scale scales the linear and nonlinear damping, beta_current
+        is in degrees, like in the constructor.
+
+        Returns:
+            p: dict with an (N,) array for every name in BATCH_PARAMETERS
+        """
+        p = {
+            "m": self.m,
+            "damping_scale": 1.0,
+            "V_current": self.V_c,
+            "beta_current": self.beta_c / self.D2R,
+        }
+        if params is not None:
+            names = params.dtype.names if hasattr(params, "dtype") else params.keys()
+            for name in names:
+                if name in p:
+                    p[name] = params[name]
+
+        return {name: np.broadcast_to(np.asarray(value, float), (N,)) for name, value in p.items()}
+
     def calculate_system_state(self, x, eta):
         """
         Extract speeds etc. based on state and control inputs
@@ -299,3 +398,25 @@ class BlueROV():
 
         return np.concatenate([pos_dot, q_dot])
 
+    def eta_dynamics_batch(self, eta, nu):
+        """
+        Batched version of eta_dynamics for (N, 7) poses and (N, 6) velocities.
+        """
+        q = eta[:, 3:7]
+        q = q / np.linalg.norm(q, axis=1, keepdims=True)
+
+        C = quaternion_to_dcm_batch(q)
+        pos_dot = np.einsum('nij,nj->ni', C, nu[:, 0:3])
+
+        # Fossen 2021, eq. 2.78, written out for the stacked quaternions
+        q0, q1, q2, q3 = q.T
+        om_p, om_q, om_r = nu[:, 3], nu[:, 4], nu[:, 5]
+        q_dot = 0.5 * np.stack([
+                                -q1*om_p - q2*om_q - q3*om_r,
+                                q0*om_p - q3*om_q + q2*om_r,
+                                q3*om_p + q0*om_q - q1*om_r,
+                                -q2*om_p + q1*om_q + q0*om_r
+                                ], axis=1)
+        q_dot += self.gamma/2 * (1 - np.sum(q*q, axis=1, keepdims=True)) * q
+
+        return np.concatenate([pos_dot, q_dot], axis=1)
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+BlueROV_kernel.py:
+
+   Stateless evaluation of the BlueROV dynamics, the counterpart of
+   SAM_kernel.py for BlueROV.py:
+
+       bluerov_dynamics_kernel(x, u_ref, p, x_dot)
+
+   - p:     packed parameter vector, built once from a BlueROV instance with
+            pack_parameters(brov). Indices are given by the P_* constants.
+   - x_dot: caller-provided output buffer of length 13, written in place.
+
+   BlueROVKernel() wraps the parameters and optionally uses the numba
+   compiled kernel, see lib/jit.py:
+
+       kernel = BlueROVKernel(BlueROV(dt), jit=True)
+       x_dot = kernel.dynamics(x, u_ref)
+"""
+
+import math
+import numpy as np
+from smarc_modelling.lib.jit import jit_compile
+
+# Packed parameter layout
+P_V_C = 0
+P_BETA_C = 1
+P_W = 2
+P_B = 3
+P_GAMMA = 4
+P_M = 5                 # 6 entries, diagonal of MRB + MA
+P_M_RB = 11             # 6 entries, diagonal of MRB
+P_D_LIN = 17            # 6 entries, diagonal of D_lin
+P_D_NL = 23             # 6 entries, quadratic damping coefficients
+P_P_OG_O = 29           # 3 entries
+P_P_OB_O = 32           # 3 entries
+N_PARAMETERS = 35
+
+
+def pack_parameters(brov):
+    """
+    Collect all parameters of a BlueROV instance that enter the dynamics into
+    a flat parameter vector.
+
+    Args:
+        brov: BlueROV instance
+
+    Returns:
+        p: (N_PARAMETERS,) parameter vector
+    """
+    p = np.zeros(N_PARAMETERS)
+
+    p[P_V_C] = brov.V_c
+    p[P_BETA_C] = brov.beta_c
+    p[P_W] = brov.m * brov.g
+    p[P_B] = brov.B
+    p[P_GAMMA] = brov.gamma
+    p[P_M:P_M+6] = np.diag(brov.M)
+    p[P_M_RB:P_M_RB+6] = np.diag(brov.MRB)
+    p[P_D_LIN:P_D_LIN+6] = np.diag(brov.D_lin)
+    p[P_D_NL:P_D_NL+6] = [brov.Xuu, brov.Yvv, brov.Zww, brov.Kpp, brov.Mqq, brov.Nrr]
+    p[P_P_OG_O:P_P_OG_O+3] = brov.p_OG_O
+    p[P_P_OB_O:P_P_OB_O+3] = brov.p_OB_O
+
+    return p
+
+
+def bluerov_dynamics_kernel(x, u_ref, p, x_dot):
+    """
+    Pure-function BlueROV dynamics. Same model as BlueROV.dynamics.
+
+    Args:
+        x: state space vector with [eta, nu]
+        u_ref: control inputs as forces and torques [X, Y, Z, K, M, N]
+        p: packed parameters, see pack_parameters
+        x_dot: output buffer for the time derivative of the state vector
+
+    Returns:
+        x_dot
+    """
+    # Normalized quaternion and Euler angles (zyx convention)
+    q0 = x[3]
+    q1 = x[4]
+    q2 = x[5]
+    q3 = x[6]
+    q_norm = math.sqrt(q0*q0 + q1*q1 + q2*q2 + q3*q3)
+    q0 /= q_norm
+    q1 /= q_norm
+    q2 /= q_norm
+    q3 /= q_norm
+
+    phi = math.atan2(2*(q0*q1 + q2*q3), 1 - 2*(q1*q1 + q2*q2))
+    sin_theta = 2*(q0*q2 - q3*q1)
+    theta = math.asin(min(max(sin_theta, -1.0), 1.0))
+    psi = math.atan2(2*(q0*q3 + q1*q2), 1 - 2*(q2*q2 + q3*q3))
+
+    # Relative velocities due to current
+    u = x[7]
+    v = x[8]
+    w = x[9]
+    p_rate = x[10]
+    q_rate = x[11]
+    r_rate = x[12]
+
+    V_c = p[P_V_C]
+    ur = u - V_c * math.cos(p[P_BETA_C] - psi)
+    vr = v - V_c * math.sin(p[P_BETA_C] - psi)
+    wr = w
+
+    # Coriolis: C(nu_r) nu_r for C = m2c(MRB) + m2c(MA), both diagonal
+    t1x = p[P_M] * ur
+    t1y = p[P_M+1] * vr
+    t1z = p[P_M+2] * wr
+    t2x = p[P_M+3] * p_rate
+    t2y = p[P_M+4] * q_rate
+    t2z = p[P_M+5] * r_rate
+
+    # Gravity and buoyancy, see gvect
+    W = p[P_W]
+    B = p[P_B]
+    sth = math.sin(theta)
+    cth = math.cos(theta)
+    sphi = math.sin(phi)
+    cphi = math.cos(phi)
+    gx = p[P_P_OG_O]*W - p[P_P_OB_O]*B
+    gy = p[P_P_OG_O+1]*W - p[P_P_OB_O+1]*B
+    gz = p[P_P_OG_O+2]*W - p[P_P_OB_O+2]*B
+
+    # Linear and quadratic damping
+    d0 = p[P_D_LIN] + p[P_D_NL] * abs(ur)
+    d1 = p[P_D_LIN+1] + p[P_D_NL+1] * abs(vr)
+    d2 = p[P_D_LIN+2] + p[P_D_NL+2] * abs(wr)
+    d3 = p[P_D_LIN+3] + p[P_D_NL+3] * abs(p_rate)
+    d4 = p[P_D_LIN+4] + p[P_D_NL+4] * abs(q_rate)
+    d5 = p[P_D_LIN+5] + p[P_D_NL+5] * abs(r_rate)
+
+    # nu_dot = M^-1 (tau - C nu_r - D nu_r - g), M is diagonal
+    x_dot[7] = (u_ref[0] - (q_rate*t1z - r_rate*t1y) - d0*ur - (W-B) * sth) / p[P_M]
+    x_dot[8] = (u_ref[1] - (r_rate*t1x - p_rate*t1z) - d1*vr + (W-B) * cth * sphi) / p[P_M+1]
+    x_dot[9] = (u_ref[2] - (p_rate*t1y - q_rate*t1x) - d2*wr + (W-B) * cth * cphi) / p[P_M+2]
+    x_dot[10] = (u_ref[3] - (vr*t1z - wr*t1y) - (q_rate*t2z - r_rate*t2y) - d3*p_rate
+                 - (-gy * cth * cphi + gz * cth * sphi)) / p[P_M+3]
+    x_dot[11] = (u_ref[4] - (wr*t1x - ur*t1z) - (r_rate*t2x - p_rate*t2z) - d4*q_rate
+                 - (gz * sth + gx * cth * cphi)) / p[P_M+4]
+    x_dot[12] = (u_ref[5] - (ur*t1y - vr*t1x) - (p_rate*t2y - q_rate*t2x) - d5*r_rate
+                 - (-gx * cth * sphi - gy * sth)) / p[P_M+5]
+
+    # Position kinematics, p_dot = C(q) v
+    x_dot[0] = (1 - 2*(q2*q2 + q3*q3))*u + 2*(q1*q2 - q0*q3)*v + 2*(q1*q3 + q0*q2)*w
+    x_dot[1] = 2*(q1*q2 + q0*q3)*u + (1 - 2*(q1*q1 + q3*q3))*v + 2*(q2*q3 - q0*q1)*w
+    x_dot[2] = 2*(q1*q3 - q0*q2)*u + 2*(q2*q3 + q0*q1)*v + (1 - 2*(q1*q1 + q2*q2))*w
+
+    # Quaternion kinematics, Fossen 2021, eq. 2.78
+    q_corr = p[P_GAMMA]/2 * (1 - (q0*q0 + q1*q1 + q2*q2 + q3*q3))
+    x_dot[3] = 0.5*(-q1*p_rate - q2*q_rate - q3*r_rate) + q_corr*q0
+    x_dot[4] = 0.5*(q0*p_rate - q3*q_rate + q2*r_rate) + q_corr*q1
+    x_dot[5] = 0.5*(q3*p_rate + q0*q_rate - q1*r_rate) + q_corr*q2
+    x_dot[6] = 0.5*(-q2*p_rate + q1*q_rate + q0*r_rate) + q_corr*q3
+
+    return x_dot
+
+
+class BlueROVKernel():
+    """
+    BlueROVKernel(brov, jit=False)
+        Holds the packed parameters of a BlueROV instance and evaluates
+        bluerov_dynamics_kernel with them. With jit=True, the numba compiled
+        kernel is used.
+
+    Changes of the BlueROV parameters after construction are not picked up,
+    call update_parameters() for that.
+    """
+    def __init__(self, brov, jit=False):
+        self.brov = brov
+        self.p = pack_parameters(brov)
+        self.jit = jit
+        if jit:
+            self.kernel = jit_compile(bluerov_dynamics_kernel)
+        else:
+            self.kernel = bluerov_dynamics_kernel
+
+    def dynamics(self, x, u_ref, out=None):
+        """
+        Evaluate the dynamics. Writes into out if given, otherwise into a
+        newly allocated array.
+        """
+        if out is None:
+            out = np.empty(13)
+        return self.kernel(x, u_ref, self.p, out)
+
+    def update_parameters(self):
+        """
+        Re-read the parameters from the BlueROV instance
+        """
+        self.p[:] = pack_parameters(self.brov)
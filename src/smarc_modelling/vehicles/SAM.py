@@ -59,6 +59,11 @@ import numpy as np
 import math
 from scipy.linalg import block_diag
 from smarc_modelling.lib.gnc import *
+from smarc_modelling.vehicles.SAM_kernel import SAMKernel
+
+# Parameters that can be set per state in dynamics_batch
+BATCH_PARAMETERS = ("m_ss", "inertia_factor", "damping_factor", "damping_rot",
+                    "V_current", "beta_current")
 
 
 class SolidStructure:
@@ -172,6 +177,11 @@ class SAM():
         eta: [x, y, z, q0, q1, q2, q3] - Position and quaternion orientation
         nu: [u, v, w, p, q, r] - Body-fixed linear and angular velocities
 
+    With use_jit=True, dynamics() is evaluated by the numba compiled kernel in
+    SAM_kernel.py. The intermediate attributes (M, C, D, g_vec, tau, ...) are
+    then not updated, and parameter changes after construction need a call to
+    self.kernel.update_parameters().
+
     Vectors follow Tedrake's monogram:
     https://manipulation.csail.mit.edu/pick.html#monogram
     """
@@ -180,6 +190,7 @@ class SAM():
             dt=0.02,
             V_current=0,
             beta_current=0,
+            use_jit=False,
     ):
         self.dt = dt # Sim time step, necessary for evaluation of the actuator dynamics
         
@@ -217,6 +228,17 @@ class SAM():
         self.a = self.L / 2  # semi-axes
         self.b = self.diam / 2
 
+        # The solid structure inertia doesn't depend on the actuators
+        self.J_ss_co = self.calculate_solid_structure_inertia()
+
+        # Mass matrices only depend on the VBS and LCG positions. We cache
+        # them, keyed on these positions. Set inertia_cache_resolution to
+        # quantize the actuator positions (in m) used in the mass model.
+        # The positions then move by at most half the resolution and the
+        # mass by at most rho_w*pi*r_vbs**2*resolution/2.
+        self.inertia_cache = {}
+        self.inertia_cache_size = 1024
+        self.inertia_cache_resolution = None
 
         # Rigid-body mass matrix expressed in CO
         u_init = np.zeros(6)
@@ -285,6 +307,12 @@ class SAM():
 
         self.gamma = 100 # Scaling factor for numerical stability of quaternion differentiation
 
+        # Compiled fast path
+        self.use_jit = use_jit
+        self.kernel = None
+        if use_jit:
+            self.kernel = SAMKernel(self, jit=True)
+
     def init_vehicle(self):
         """
         Initialize all subsystems based on their respective parameters
@@ -333,6 +361,9 @@ class SAM():
         Returns:
             state_vector_dot: Time derivative of complete state vector
         """
+        if self.kernel is not None:
+            return self.kernel.dynamics(np.asarray(x, float), np.asarray(u_ref, float))
+
         eta = x[0:7]
         nu = x[7:13]
         u = x[13:19]
@@ -355,10 +386,6 @@ class SAM():
         self.D[4,4] = self.damping_rot
         self.D[5,5] = self.damping_rot
 
-        np.set_printoptions(precision=3)
-
-        np.set_printoptions(precision=3)
-
         nu_dot = self.Minv @ (self.tau - np.matmul(self.C,self.nu_r) - np.matmul(self.D,self.nu_r) - self.g_vec)
         u_dot = self.actuator_dynamics(u, u_ref)
         eta_dot = self.eta_dynamics(eta, nu)
@@ -366,6 +393,152 @@ class SAM():
 
         return x_dot
 
+    def dynamics_batch(self, X, U_ref, params=None):
+        """
+        Vectorized dynamics for N states at once. Evaluates the same model as
+        dynamics(), but with NumPy broadcasting over stacked states and
+        without writing the intermediate results (M, C, D, g_vec, tau) back
+        into the vehicle.
+
+        Args:
+            X: (N, 19) array of state vectors [eta, nu, u]
+            U_ref: (N, 6) array of control inputs, or a single (6,) input
+                applied to all states, as [x_vbs, x_lcg, delta_s, delta_r, rpm1, rpm2]
+            params: optional per-state parameters, see batch_parameters()
+
+        Returns:
+            X_dot: (N, 19) array of state vector time derivatives
+        """
+        X = np.atleast_2d(X)
+        N = X.shape[0]
+        U_ref = np.broadcast_to(U_ref, (N, 6))
+        terms = self.calculate_terms_batch(X, U_ref, params)
+
+        eta = X[:, 0:7]
+        nu = X[:, 7:13]
+        u = self.bound_actuators_batch(X[:, 13:19])
+        u_ref = self.bound_actuators_batch(U_ref)
+
+        nu_r = terms["nu_r"]
+        rhs = terms["tau"] - np.einsum('nij,nj->ni', terms["C"], nu_r) - terms["D_diag"] * nu_r - terms["g_vec"]
+        nu_dot = np.linalg.solve(terms["M"], rhs[..., None])[..., 0]
+        u_dot = self.actuator_dynamics_batch(u, u_ref)
+        eta_dot = self.eta_dynamics_batch(eta, nu)
+
+        return np.concatenate([eta_dot, nu_dot, u_dot], axis=1)
+
+    def calculate_terms_batch(self, X, U_ref, params=None):
+        """
+        The terms of eq. 8.2 for N states at once, as dynamics_batch()
+        evaluates them. Like the attributes that dynamics() sets, but stacked.
+
+        Args:
+            X: (N, 19) array of state vectors [eta, nu, u]
+            U_ref: (N, 6) array of control inputs, or a single (6,) input
+            params: optional per-state parameters, see batch_parameters()
+
+        Returns:
+            terms: dict with the (N, 6, 6) arrays "M" and "C", the
+                (N, 6) arrays "D_diag" (the diagonal of the overwritten D),
+                "g_vec", "tau" and "nu_r"
+        """
+        X = np.atleast_2d(X)
+        N = X.shape[0]
+        U_ref = np.broadcast_to(U_ref, (N, 6))
+        p = self.batch_parameters(params, N)
+
+        eta = X[:, 0:7]
+        nu = X[:, 7:13]
+        u = self.bound_actuators_batch(X[:, 13:19])
+        u_ref = self.bound_actuators_batch(U_ref)
+
+        # System state
+        quat = eta[:, 3:7] / np.linalg.norm(eta[:, 3:7], axis=1, keepdims=True)
+        psi, theta, phi = quaternion_to_angles_batch(quat)
+
+        nu_c = np.zeros((N, 6))
+        beta_c = p["beta_current"] * self.D2R
+        nu_c[:, 0] = p["V_current"] * np.cos(beta_c - psi)
+        nu_c[:, 1] = p["V_current"] * np.sin(beta_c - psi)
+        nu_r = nu - nu_c
+        U = np.linalg.norm(nu[:, 0:3], axis=1)
+
+        # Actuator positions, mass and center of gravity
+        x_vbs = (u[:, 0]/100) * self.vbs.l_vbs_l
+        p_OLcg_O = np.tile(self.lcg.p_OLcgPos_O, (N, 1))
+        p_OLcg_O[:, 0] += (u[:, 1]/100) * self.lcg.l_lcg_l
+
+        m_vbs = self.rho_w * np.pi * self.vbs.r_vbs ** 2 * x_vbs
+        m = p["m_ss"] + m_vbs + self.lcg.m_lcg
+
+        p_OG_O = (p["m_ss"][:, None] * self.ss.p_OSsg_O
+                  + m_vbs[:, None] * self.vbs.p_OVbs_O
+                  + self.lcg.m_lcg * p_OLcg_O) / m[:, None]
+
+        # Mass matrices
+        J_total = self.calculate_inertias_batch(m_vbs, x_vbs, p_OLcg_O, p["m_ss"], p["inertia_factor"])
+
+        idx = np.arange(3)
+        MRB = np.zeros((N, 6, 6))
+        MRB[:, idx, idx] = m[:, None]
+        MRB[:, 3:6, 3:6] = J_total
+
+        MA = np.zeros((N, 6, 6))
+        MA[:, 0, 0] = m * self.k1
+        MA[:, 1, 1] = m * self.k2
+        MA[:, 2, 2] = m * self.k2
+        MA[:, 3, 3] = self.r44 * J_total[:, 0, 0]
+        MA[:, 4, 4] = self.k_prime * J_total[:, 1, 1]
+        MA[:, 5, 5] = self.k_prime * J_total[:, 1, 1]
+
+        M = MRB + MA
+
+        # Coriolis, damping, restoring forces and propulsion
+        C = m2c_batch(MRB, nu_r) + m2c_batch(MA, nu_r)
+
+        D_diag = np.repeat(np.stack([p["damping_factor"], p["damping_rot"]], axis=1), 3, axis=1)
+
+        g_vec = gvect_batch(m * self.g, self.B, theta, phi, p_OG_O, self.p_OB_O)
+
+        tau = self.calculate_propeller_force_batch(u_ref, U)
+
+        return {"M": M, "C": C, "D_diag": D_diag, "g_vec": g_vec, "tau": tau, "nu_r": nu_r}
+
+    def batch_parameters(self, params, N):
+        """
+        Per-state parameters for dynamics_batch. params maps the names in
+        BATCH_PARAMETERS to scalars or (N,) arrays, e.g. a dict or a
+        structured array. Missing parameters take the value of this instance.
+        beta_current is in degrees, like in the constructor.
+
+        Returns:
+            p: dict with an (N,) array for every name in BATCH_PARAMETERS
+        """
+        p = {
+            "m_ss": self.ss.m_ss,
+            "inertia_factor": self.inertia_factor,
+            "damping_factor": self.damping_factor,
+            "damping_rot": self.damping_rot,
+            "V_current": self.V_c,
+            "beta_current": self.beta_c / self.D2R,
+        }
+        if params is not None:
+            names = params.dtype.names if hasattr(params, "dtype") else params.keys()
+            for name in names:
+                if name in p:
+                    p[name] = params[name]
+
+        return {name: np.broadcast_to(np.asarray(value, float), (N,)) for name, value in p.items()}
+
+    def bound_actuators_batch(self, U):
+        """
+        Batched version of bound_actuators for a (N, 6) array of inputs.
+        """
+        U_bound = np.array(U, dtype=float)
+        np.clip(U_bound[:, 0:2], 0, 100, out=U_bound[:, 0:2])
+
+        return U_bound
+
     def bound_actuators(self, u):
         """
         Enforce actuation limits on each actuator.
@@ -421,6 +594,10 @@ class SAM():
         # Update actuators
         self.x_vbs = self.calculate_vbs_position(u_control) 
         self.p_OLcg_O = self.calculate_lcg_position(u_control)
+        if self.inertia_cache_resolution:
+            res = self.inertia_cache_resolution
+            self.x_vbs = round(self.x_vbs / res) * res
+            self.p_OLcg_O[0] = round(self.p_OLcg_O[0] / res) * res
 
         # Update mass
         self.vbs.m_vbs = self.rho_w * np.pi * self.vbs.r_vbs ** 2 * self.x_vbs
@@ -436,15 +613,10 @@ class SAM():
 
         #print(f"OG_O: {self.p_OG_O}")
 
-    def update_inertias(self):
+    def calculate_solid_structure_inertia(self):
         """
-        Update inertias based on VBS and LCG
-        Note: The propellers add more torque rather than momentum by moving.
-            The exception would be steering, but that's complex and will change
-            in the next iteration of SAM.
+        Inertia of the solid structure w.r.t. CO
         """
-
-        # Solid structure
         # Moment of inertia of a solid elipsoid
         # https://en.wikipedia.org/wiki/List_of_moments_of_inertia
         # with b = c.
@@ -456,6 +628,41 @@ class SAM():
         S2_p_OSsg_O = skew_symmetric(self.ss.p_OSsg_O) @ skew_symmetric(self.ss.p_OSsg_O)
         J_ss_co = J_ss_cg - self.ss.m_ss * S2_p_OSsg_O
 
+        return J_ss_co
+
+    def inertia_cache_key(self):
+        """
+        Key of the current mass matrices in the inertia cache
+        """
+        return (self.x_vbs, self.p_OLcg_O[0], self.inertia_factor, self.ss.m_ss)
+
+    def clear_inertia_cache(self):
+        """
+        Drop all cached mass matrices and recompute the solid structure
+        inertia. Call this after changing any of the mass or geometry
+        parameters.
+        """
+        self.inertia_cache.clear()
+        self.J_ss_co = self.calculate_solid_structure_inertia()
+        if self.kernel is not None:
+            self.kernel.update_parameters()
+
+    def update_inertias(self):
+        """
+        Update inertias based on VBS and LCG
+        Note: The propellers add more torque rather than momentum by moving.
+            The exception would be steering, but that's complex and will change
+            in the next iteration of SAM.
+        """
+        key = self.inertia_cache_key()
+        entry = self.inertia_cache.get(key)
+        if entry is not None:
+            self.J_total = entry[0]
+            return
+
+        # Solid structure
+        J_ss_co = self.J_ss_co
+
         # VBS
         # Moment of inertia of a solid cylinder
         Ix_vbs = (1/2) * self.vbs.m_vbs * self.vbs.r_vbs**2
@@ -479,10 +686,57 @@ class SAM():
         self.J_total = J_ss_co + J_vbs_co + J_lcg_co
         self.J_total[0, 0] *= self.inertia_factor
 
+        # The cached arrays are shared with the vehicle attributes, read-only
+        # so that in-place edits cannot corrupt the cache
+        self.J_total.flags.writeable = False
+
+        if len(self.inertia_cache) >= self.inertia_cache_size:
+            self.inertia_cache.pop(next(iter(self.inertia_cache)))
+        self.inertia_cache[key] = [self.J_total, None]
+
+    def calculate_inertias_batch(self, m_vbs, x_vbs, p_OLcg_O, m_ss=None, inertia_factor=None):
+        """
+        Batched version of update_inertias. Takes the (N,) VBS masses and
+        positions and the (N, 3) LCG positions and returns the (N, 3, 3)
+        stack of total inertia tensors in CO. m_ss and inertia_factor
+        optionally override the parameters of this instance per state.
+        """
+        if inertia_factor is None:
+            inertia_factor = self.inertia_factor
+
+        # Solid structure, the inertia scales linearly with its mass
+        J_ss_co = self.J_ss_co
+        if m_ss is not None:
+            J_ss_co = (np.asarray(m_ss) / self.ss.m_ss)[:, None, None] * J_ss_co
+
+        # VBS
+        Ix_vbs = (1/2) * m_vbs * self.vbs.r_vbs**2
+        Iy_vbs = (1/12) * m_vbs * (3*self.vbs.r_vbs**2 + x_vbs**2)
+        S2_r_vbs_cg = skew_symmetric(self.vbs.p_OVbs_O) @ skew_symmetric(self.vbs.p_OVbs_O)
+        J_vbs_co = -m_vbs[:, None, None] * S2_r_vbs_cg
+        J_vbs_co[:, 0, 0] += Ix_vbs
+        J_vbs_co[:, 1, 1] += Iy_vbs
+        J_vbs_co[:, 2, 2] += Iy_vbs
+
+        # LCG
+        Ix_lcg = (1/2) * self.lcg.m_lcg * (self.lcg.h_lcg_dim/2)**2
+        Iy_lcg = (1/12) * self.lcg.m_lcg* (3*(self.lcg.h_lcg_dim/2)**2 + self.lcg.l_lcg_l**2)
+        S_r_lcg_cg = Smtrx_batch(p_OLcg_O)
+        J_lcg_co = np.diag([Ix_lcg, Iy_lcg, Iy_lcg]) - self.lcg.m_lcg * (S_r_lcg_cg @ S_r_lcg_cg)
+
+        J_total = J_ss_co + J_vbs_co + J_lcg_co
+        J_total[:, 0, 0] *= inertia_factor
+
+        return J_total
+
     def calculate_M(self):
         """
         Calculated the mass matrix M
         """
+        entry = self.inertia_cache.get(self.inertia_cache_key())
+        if entry is not None and entry[1] is not None:
+            self.MRB, self.MA, self.M, self.Minv = entry[1]
+            return
 
         # Rigid-body mass matrix expressed in CO
         m_diag = np.diag([self.m, self.m, self.m])
@@ -506,11 +760,19 @@ class SAM():
 
         # Mass matrix including added mass
         self.M = self.MRB + self.MA
-        self.Minv = np.linalg.inv(self.M)
-        #print(f"MRB: {MRB_check}, MA: {self.MA}, M: {self.M}")
-        #print(f"MRB:\n {np.sign(self.MRB)}")
-        #print(f"MA:\n {np.sign(self.MA)}")
-        #print(f"M:\n {np.sign(self.M)}")
+
+        # M is block diagonal with a diagonal translational block, so we
+        # invert it blockwise instead of calling np.linalg.inv
+        self.Minv = np.zeros((6,6))
+        self.Minv[0,0] = 1 / self.M[0,0]
+        self.Minv[1,1] = 1 / self.M[1,1]
+        self.Minv[2,2] = 1 / self.M[2,2]
+        self.Minv[3:6,3:6] = inverse_3x3(self.M[3:6,3:6])
+
+        if entry is not None:
+            for matrix in (self.MRB, self.MA, self.M, self.Minv):
+                matrix.flags.writeable = False
+            entry[1] = (self.MRB, self.MA, self.M, self.Minv)
 
     def calculate_C(self):
         """
@@ -643,6 +905,67 @@ class SAM():
 
         return tau_prop
 
+    def calculate_propeller_force_batch(self, u, U):
+        """
+        Batched version of calculate_propeller_force.
+        u: (N, 6) control inputs as [x_vbs, x_lcg, delta_s, delta_r, rpm1, rpm2]
+        U: (N,) vehicle speeds
+        """
+        N = u.shape[0]
+        delta_s = -u[:, 2]
+        delta_r = -u[:, 3]
+        n_rps = u[:, 4:] / 60
+        Va = self.Va_coef * U
+
+        # C_T2C = calculate_dcm(order=[2, 3], angles=[delta_s, delta_r]), written out
+        cs, ss = np.cos(delta_s), np.sin(delta_s)
+        cr, sr = np.cos(delta_r), np.sin(delta_r)
+        C_T2C = np.empty((N, 3, 3))
+        C_T2C[:, 0, 0] = cr * cs
+        C_T2C[:, 0, 1] = sr
+        C_T2C[:, 0, 2] = -cr * ss
+        C_T2C[:, 1, 0] = -sr * cs
+        C_T2C[:, 1, 1] = cr
+        C_T2C[:, 1, 2] = sr * ss
+        C_T2C[:, 2, 0] = ss
+        C_T2C[:, 2, 1] = 0
+        C_T2C[:, 2, 2] = cs
+
+        tau_prop = np.zeros((N, 6))
+        for i in range(n_rps.shape[1]):
+            n = n_rps[:, i]
+            forward = n > 0
+
+            X_prop_i = np.where(
+                    forward,
+                    self.rho*(self.D_prop**4)*(
+                        self.KT_0*np.abs(n)*n +
+                        (self.KT_max-self.KT_0)/self.Ja_max * (Va/self.D_prop) * np.abs(n)),
+                    self.rho * (self.D_prop ** 4) * self.KT_0*np.abs(n)*n / 10)
+            K_prop_i = np.where(
+                    forward,
+                    self.rho * (self.D_prop**5) * (
+                        self.KQ_0 * np.abs(n) * n +
+                        (self.KQ_max-self.KQ_0)/self.Ja_max * (Va/self.D_prop) * np.abs(n)),
+                    self.rho * (self.D_prop ** 5) * self.KQ_0 * np.abs(n) * n / 10)
+            dir_flip = np.where(forward, 1.0, -1.0)
+
+            F_prop_b = C_T2C[:, :, 0] * X_prop_i[:, None]
+            r_prop_i = C_T2C @ self.propellers.r_t_p_sh[i] - self.p_OC_O
+            M_prop_i = np.cross(r_prop_i, F_prop_b)
+            M_prop_i[:, 0] += (-1)**i * K_prop_i
+
+            M_prop_i *= self.thruster_rot_strength
+            M_prop_i[:, 1] *= dir_flip
+
+            # Swap yaw and roll to the order the model uses
+            tau_prop[:, 0:3] += F_prop_b
+            tau_prop[:, 3] += M_prop_i[:, 2]
+            tau_prop[:, 4] += M_prop_i[:, 1]
+            tau_prop[:, 5] += M_prop_i[:, 0]
+
+        return tau_prop
+
     def calculate_vbs_position(self, u):
         """
         Control input is scaled between 0 and 100. This converts it into the actual position
@@ -699,6 +1022,39 @@ class SAM():
 
         return np.concatenate([pos_dot, q_dot])
 
+    def eta_dynamics_batch(self, eta, nu):
+        """
+        Batched version of eta_dynamics for (N, 7) poses and (N, 6) velocities.
+        """
+        q = eta[:, 3:7]
+        q = q / np.linalg.norm(q, axis=1, keepdims=True)
+
+        C = quaternion_to_dcm_batch(q)
+        pos_dot = np.einsum('nij,nj->ni', C, nu[:, 0:3])
+
+        # Fossen 2021, eq. 2.78, written out for the stacked quaternions
+        q0, q1, q2, q3 = q.T
+        om_p, om_q, om_r = nu[:, 3], nu[:, 4], nu[:, 5]
+        q_dot = 0.5 * np.stack([
+                                -q1*om_p - q2*om_q - q3*om_r,
+                                q0*om_p - q3*om_q + q2*om_r,
+                                q3*om_p + q0*om_q - q1*om_r,
+                                -q2*om_p + q1*om_q + q0*om_r
+                                ], axis=1)
+        q_dot += self.gamma/2 * (1 - np.sum(q*q, axis=1, keepdims=True)) * q
+
+        return np.concatenate([pos_dot, q_dot], axis=1)
+
+    def actuator_dynamics_batch(self, u_cur, u_ref):
+        """
+        Batched version of actuator_dynamics for (N, 6) inputs.
+        """
+        u_dot = (u_ref - u_cur)/self.dt
+        np.clip(u_dot[:, 0], -self.vbs.x_vbs_dot_max, self.vbs.x_vbs_dot_max, out=u_dot[:, 0])
+        np.clip(u_dot[:, 1], -self.lcg.x_lcg_dot_max, self.lcg.x_lcg_dot_max, out=u_dot[:, 1])
+
+        return u_dot
+
     def actuator_dynamics(self, u_cur, u_ref):
         """
         Compute the actuator dynamics.
@@ -723,3 +1079,5 @@ class SAM():
         Updates dt for when doing simulations
         """
         self.dt = dt
+        if self.kernel is not None:
+            self.kernel.update_dt(dt)
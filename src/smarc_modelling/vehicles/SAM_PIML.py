@@ -59,7 +59,7 @@ import numpy as np
 import math
 from scipy.linalg import block_diag
 from smarc_modelling.lib.gnc import *
-from smarc_modelling.piml.pinn.pinn import init_pinn_model, pinn_predict
+from smarc_modelling.piml.pinn.pinn import init_pinn_model, PINNInference
 
 
 class SolidStructure:
@@ -181,7 +181,8 @@ class SAM_PIML():
             dt=0.02,
             V_current=0,
             beta_current=0,
-            piml_type=None
+            piml_type=None,
+            piml_model=None
     ):
         self.dt = dt # Sim time step, necessary for evaluation of the actuator dynamics
         
@@ -283,7 +284,8 @@ class SAM_PIML():
 
         if self.piml_type == "pinn":
             print(f" Physics Informed Neural Network model initialized")
-            self.piml_model = init_pinn_model("pinn.pt")
+            # A trained model can be passed directly, otherwise the saved one is loaded. It is evaluated in NumPy.
+            self.piml_model = PINNInference(piml_model if piml_model is not None else init_pinn_model("pinn.pt"))
 
         # For white-box
         if piml_type == None:
@@ -537,7 +539,7 @@ class SAM_PIML():
             self.D[5,5] = self.damping_rot
 
         if self.piml_type == "pinn":
-            self.D = pinn_predict(self.piml_model, eta, nu, u)
+            self.D = self.piml_model(np.concatenate([eta, nu, u]))
 
     def calculate_g(self):
         """
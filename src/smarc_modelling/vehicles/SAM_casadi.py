@@ -130,8 +130,8 @@ class LongitudinalCenterOfGravityControl:
         self.l_lcg_r    = l_lcg_r    # Maximum x-direction position (m)
         self.m_lcg      = m_lcg      # Mass of LCG (kg)
         self.h_lcg_dim  = h_lcg_dim  # Height of LCG structure (m)
-        p_CLcgpos_O     = ca.MX(np.array([0.608+self.l_lcg_l/2, 0, 0.130])) # "Beginning" of the LCG in C frame. Mass moves from here
-        self.p_OLcgPos_O = ca.MX(p_OC_O) + p_CLcgpos_O # Vector from CO to LCG position 0 in O
+        p_CLcgpos_O     = ca.DM(np.array([0.608+self.l_lcg_l/2, 0, 0.130])) # "Beginning" of the LCG in C frame. Mass moves from here
+        self.p_OLcgPos_O = ca.DM(p_OC_O) + p_CLcgpos_O # Vector from CO to LCG position 0 in O
 
         # Motion bounds
         self.x_lcg_min = 0  # Minimum LCG position (m)
@@ -191,7 +191,7 @@ class SAM_casadi():
         self.thruster_rot_strength = 2  # Just making the thruster a bit stronger for rotation
 
         # Constants
-        self.p_OC_O = ca.MX(np.array([-0.75, 0, 0.06], float))  # Measurement frame C in CO (O)
+        self.p_OC_O = ca.DM(np.array([-0.75, 0, 0.06], float))  # Measurement frame C in CO (O)
         self.D2R = math.pi / 180  # Degrees to radians
         self.rho_w = self.rho = 1026  # Water density (kg/m³)
         self.g = 9.81  # Gravity acceleration (m/s²)
@@ -199,6 +199,7 @@ class SAM_casadi():
         # Initialize Subsystems:
         self.init_vehicle()
         self.create_model = True
+        self.sym = ca.MX  # Symbol type of the model, see dynamics()
         # Reference values and current
         self.V_c = V_current  # Current water speed
         self.beta_c = beta_current * self.D2R  # Current water direction (rad)
@@ -321,7 +322,7 @@ class SAM_casadi():
             ]
         )
 
-    def dynamics(self, export = False):
+    def dynamics(self, export = False, sym = ca.MX):
         """
         Main dynamics function for integrating the complete AUV state.
 
@@ -330,6 +331,9 @@ class SAM_casadi():
             x: state space vector with [eta, nu, u]
             u_ref: control inputs as [x_vbs, x_lcg, delta_s, delta_r, rpm1, rpm2]
             export: export the model to acados [bool]. Standard is False
+            sym: symbol type, ca.MX or ca.SX. SX graphs are expanded to scalar
+                operations, which gives faster generated code for this model size.
+                Only used when the model is built, i.e. on export or the first call.
 
         Returns:
             state_vector_dot: Time derivative of complete state vector
@@ -337,8 +341,9 @@ class SAM_casadi():
         
         # Create the dynamical model the first time this method is executed
         if self.create_model == True and export == False:
-            x_sym = ca.MX.sym('x', 19,1)
-            u_ref_sym = ca.MX.sym('u_ref', 6,1)
+            self.sym = sym
+            x_sym = sym.sym('x', 19,1)
+            u_ref_sym = sym.sym('u_ref', 6,1)
             eta = x_sym[0:7]
             nu = x_sym[7:13]
             u = x_sym[13:19]
@@ -370,8 +375,9 @@ class SAM_casadi():
 
         # Export the casadi model to acados or for the LQR
         elif export == True:
-            x_sym = ca.MX.sym('x', 13,1)
-            u_ref_sym = ca.MX.sym('u_ref', 6,1)
+            self.sym = sym
+            x_sym = sym.sym('x', 13,1)
+            u_ref_sym = sym.sym('u_ref', 6,1)
             eta = x_sym[0:7]
             nu = x_sym[7:13]
 
@@ -393,12 +399,12 @@ class SAM_casadi():
             self.x_dot_sym = ca.Function('x_dot', [x_sym, u_ref_sym], [x_dot])
 
         #return self.x_dot_sym(x, u_ref) # returns a ca.DM
-        return self.x_dot_sym  # returns a casadi MX.function
+        return self.x_dot_sym  # returns a casadi function of sym
 
     # def export_dynamics_model(self):
     #     # Create symbolic state and control variables
     #     x_sym     = ca.MX.sym('x', 19,1)
-    #     u_ref_sym = ca.MX.sym('u_ref', 6,1)
+    #     u_ref_sym = sym.sym('u_ref', 6,1)
 
     #     # Create symbolic derivative
     #     x_dot_sym = ca.MX.sym('x_dot', 19, 1)
@@ -560,7 +566,7 @@ class SAM_casadi():
         Calculate damping
         """
         # Init CasADi matrix
-        self.D = ca.MX.zeros(6, 6)
+        self.D = self.sym.zeros(6, 6)
 
         # Nonlinear damping
         self.D[0,0] = self.Xuu * ca.fabs(self.nu_r[0])
@@ -616,7 +622,7 @@ class SAM_casadi():
         n_rps = n_rpm / 60   
         Va = self.Va_coef * self.U
 
-        tau_prop = ca.MX.zeros(6)  # Initialize tau_prop as a CasADi MX vector
+        tau_prop = self.sym.zeros(6)  # Initialize tau_prop as a CasADi vector
         for i in range(n_rpm.size1()):
             X_prop_i = ca.if_else(n_rps[i] > 0,
                                 self.rho * (self.D_prop**4) * (self.KT_0 * ca.fabs(n_rps[i]) * n_rps[i] +
@@ -676,7 +682,7 @@ class SAM_casadi():
         p_LcgPos_LcgO = ca.vertcat(index0, index1, index2)# Position of the LCG w.r.t fixed LCG point
         p_OLcg_O = self.lcg.p_OLcgPos_O + p_LcgPos_LcgO
 
-        return ca.MX(p_OLcg_O)
+        return p_OLcg_O
 
     def eta_dynamics(self, eta, nu):
         """
@@ -723,7 +729,7 @@ class SAM_casadi():
         u: control inputs as [x_vbs, x_lcg, delta_s, delta_r, rpm1, rpm2]
         """
 
-        u_dot = ca.MX.zeros(6)
+        u_dot = self.sym.zeros(6)
 
         u_dot = (u_ref - u_cur)/self.dt
 
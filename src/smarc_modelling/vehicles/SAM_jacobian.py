@@ -0,0 +1,415 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+SAM_jacobian.py:
+
+   Linearizations of the SAM dynamics, A = df/dx and B = df/du_ref, for many
+   operating points at once, e.g. for gain scheduling or an EKF.
+
+   The NumPy model in SAM.py has no derivatives. Here sam_dynamics_kernel from
+   SAM_kernel.py is written out once more with CasADi SX scalars, in the same
+   order and with the same packed parameters, so CasADi can differentiate it
+   exactly. The resulting function is mapped over the batch:
+
+       jac = SAMJacobian(SAM(dt))
+       A, B = jac.jacobians(X, U)      # (N, 19, 19), (N, 19, 6)
+
+   With compiled=True the function is generated as C code and compiled once
+   into CACHE_DIR, see compile(). check_jacobians() compares the result with
+   central finite differences of SAM.dynamics_batch.
+
+   NOTE: The bounds on the actuators and the actuator rates are not
+       differentiable. At the bounds, the derivative of the active side is
+       returned.
+"""
+
+import math
+import os
+import subprocess
+import numpy as np
+import casadi as ca
+from smarc_modelling.vehicles.SAM_kernel import (
+    P_B, P_BETA_C, P_DAMPING_FACTOR, P_DAMPING_ROT, P_DT, P_D_PROP, P_G, P_GAMMA, P_INERTIA_FACTOR, P_IX_LCG,
+    P_IY_LCG, P_JA_MAX, P_J_SS_CO, P_K1, P_K2, P_KQ_0, P_KQ_MAX, P_KT_0, P_KT_MAX, P_K_PRIME, P_L_LCG, P_L_VBS,
+    P_M_LCG, P_M_SS, P_P_OB_O, P_P_OC_O, P_P_OLCGPOS_O, P_P_OSSG_O, P_P_OVBS_O, P_R44, P_RHO, P_R_PROP_1, P_R_PROP_2,
+    P_R_VBS, P_S2_VBS, P_THRUSTER_ROT_STRENGTH, P_VA_COEF, P_V_C, P_X_LCG_DOT_MAX, P_X_VBS_DOT_MAX, N_PARAMETERS,
+    pack_parameters)
+
+# Directory of the compiled functions
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "smarc_modelling")
+
+# The symbolic functions are the same for every parameter set, build them once
+_functions = {}
+
+
+def _clip(value, lower, upper):
+    return ca.fmin(ca.fmax(value, lower), upper)
+
+
+def sam_dynamics_sx(x, u_ref, p):
+    """
+    Symbolic twin of sam_dynamics_kernel, same model as SAM.dynamics.
+
+    Args:
+        x: (19,) ca.SX state space vector with [eta, nu, u]
+        u_ref: (6,) ca.SX control inputs as [x_vbs, x_lcg, delta_s, delta_r, rpm1, rpm2]
+        p: (N_PARAMETERS,) ca.SX packed parameters, see pack_parameters
+
+    Returns:
+        x_dot: (19,) ca.SX time derivative of the state vector
+    """
+    # Bound actuators
+    u_vbs = _clip(x[13], 0.0, 100.0)
+    u_lcg = _clip(x[14], 0.0, 100.0)
+    ur_vbs = _clip(u_ref[0], 0.0, 100.0)
+    ur_lcg = _clip(u_ref[1], 0.0, 100.0)
+
+    # Normalized quaternion and Euler angles (zyx convention)
+    q_norm = ca.sqrt(x[3]*x[3] + x[4]*x[4] + x[5]*x[5] + x[6]*x[6])
+    q0 = x[3] / q_norm
+    q1 = x[4] / q_norm
+    q2 = x[5] / q_norm
+    q3 = x[6] / q_norm
+
+    phi = ca.atan2(2*(q0*q1 + q2*q3), 1 - 2*(q1*q1 + q2*q2))
+    theta = ca.asin(_clip(2*(q0*q2 - q3*q1), -1.0, 1.0))
+    psi = ca.atan2(2*(q0*q3 + q1*q2), 1 - 2*(q2*q2 + q3*q3))
+
+    # Relative velocities due to current
+    u, v, w = x[7], x[8], x[9]
+    p_rate, q_rate, r_rate = x[10], x[11], x[12]
+
+    V_c = p[P_V_C]
+    ur = u - V_c * ca.cos(p[P_BETA_C] - psi)
+    vr = v - V_c * ca.sin(p[P_BETA_C] - psi)
+    wr = w
+    U = ca.sqrt(u*u + v*v + w*w)
+
+    # Actuator positions and mass
+    x_vbs = (u_vbs/100) * p[P_L_VBS]
+    x_lcg = p[P_P_OLCGPOS_O] + (u_lcg/100) * p[P_L_LCG]
+    y_lcg = p[P_P_OLCGPOS_O+1]
+    z_lcg = p[P_P_OLCGPOS_O+2]
+
+    m_ss = p[P_M_SS]
+    m_lcg = p[P_M_LCG]
+    r_vbs = p[P_R_VBS]
+    m_vbs = p[P_RHO] * math.pi * r_vbs ** 2 * x_vbs
+    m = m_ss + m_vbs + m_lcg
+
+    # Center of gravity
+    x_g = (m_ss*p[P_P_OSSG_O] + m_vbs*p[P_P_OVBS_O] + m_lcg*x_lcg) / m
+    y_g = (m_ss*p[P_P_OSSG_O+1] + m_vbs*p[P_P_OVBS_O+1] + m_lcg*y_lcg) / m
+    z_g = (m_ss*p[P_P_OSSG_O+2] + m_vbs*p[P_P_OVBS_O+2] + m_lcg*z_lcg) / m
+
+    # Total inertia J = J_ss + J_vbs + J_lcg, with S(r)^2 = r r^T - |r|^2 I
+    lcg = (x_lcg, y_lcg, z_lcg)
+    lcg_sq = x_lcg*x_lcg + y_lcg*y_lcg + z_lcg*z_lcg
+    J = [p[P_J_SS_CO+3*i+j] - m_vbs * p[P_S2_VBS+3*i+j] - m_lcg * lcg[i] * lcg[j]
+         for i in range(3) for j in range(3)]
+    Ix_vbs = (1/2) * m_vbs * r_vbs**2
+    Iy_vbs = (1/12) * m_vbs * (3*r_vbs**2 + x_vbs**2)
+    J[0] = (J[0] + Ix_vbs + p[P_IX_LCG] + m_lcg * lcg_sq) * p[P_INERTIA_FACTOR]
+    J[4] = J[4] + Iy_vbs + p[P_IY_LCG] + m_lcg * lcg_sq
+    J[8] = J[8] + Iy_vbs + p[P_IY_LCG] + m_lcg * lcg_sq
+
+    # Mass matrix: diagonal translational block, rotational block J + MA_22
+    m11 = m * (1 + p[P_K1])
+    m22 = m * (1 + p[P_K2])
+    a00 = J[0] + p[P_R44] * J[0]
+    a11 = J[4] + p[P_K_PRIME] * J[4]
+    a22 = J[8] + p[P_K_PRIME] * J[4]
+    a01, a02, a10, a12, a20, a21 = J[1], J[2], J[3], J[5], J[6], J[7]
+
+    # Coriolis: C(nu_r) nu_r for C = m2c(MRB) + m2c(MA), Fossen 2021, eq. 3.46
+    t1x = m11 * ur
+    t1y = m22 * vr
+    t1z = m22 * wr
+    sa01 = 0.5 * (a01 + a10)
+    sa02 = 0.5 * (a02 + a20)
+    sa12 = 0.5 * (a12 + a21)
+    t2x = a00 * p_rate + sa01 * q_rate + sa02 * r_rate
+    t2y = sa01 * p_rate + a11 * q_rate + sa12 * r_rate
+    t2z = sa02 * p_rate + sa12 * q_rate + a22 * r_rate
+
+    # Gravity and buoyancy, see gvect
+    W = m * p[P_G]
+    B = p[P_B]
+    sth = ca.sin(theta)
+    cth = ca.cos(theta)
+    sphi = ca.sin(phi)
+    cphi = ca.cos(phi)
+    gx = x_g*W - p[P_P_OB_O]*B
+    gy = y_g*W - p[P_P_OB_O+1]*B
+    gz = z_g*W - p[P_P_OB_O+2]*B
+
+    d_lin = p[P_DAMPING_FACTOR]
+    d_rot = p[P_DAMPING_ROT]
+    rhs = [
+        -(q_rate*t1z - r_rate*t1y) - d_lin*ur - (W-B) * sth,
+        -(r_rate*t1x - p_rate*t1z) - d_lin*vr + (W-B) * cth * sphi,
+        -(p_rate*t1y - q_rate*t1x) - d_lin*wr + (W-B) * cth * cphi,
+        -(vr*t1z - wr*t1y) - (q_rate*t2z - r_rate*t2y) - d_rot*p_rate - (-gy * cth * cphi + gz * cth * sphi),
+        -(wr*t1x - ur*t1z) - (r_rate*t2x - p_rate*t2z) - d_rot*q_rate - (gz * sth + gx * cth * cphi),
+        -(ur*t1y - vr*t1x) - (p_rate*t2y - q_rate*t2x) - d_rot*r_rate - (-gx * cth * sphi - gy * sth),
+    ]
+
+    # Propellers, see SAM.calculate_propeller_force
+    cs = ca.cos(-u_ref[2])
+    ss = ca.sin(-u_ref[2])
+    cr = ca.cos(-u_ref[3])
+    sr = ca.sin(-u_ref[3])
+    C_T2C = [cr * cs, sr, -cr * ss,
+             -sr * cs, cr, sr * ss,
+             ss, 0.0, cs]
+
+    rho = p[P_RHO]
+    D_prop = p[P_D_PROP]
+    KT_0 = p[P_KT_0]
+    KQ_0 = p[P_KQ_0]
+    Ja_max = p[P_JA_MAX]
+    rot_strength = p[P_THRUSTER_ROT_STRENGTH]
+    Va = p[P_VA_COEF] * U
+
+    for i, r_sh in enumerate((P_R_PROP_1, P_R_PROP_2)):
+        n_rps = u_ref[4+i] / 60
+        forward = n_rps > 0
+        X_prop = ca.if_else(forward,
+                            rho * D_prop**4 * (KT_0 * ca.fabs(n_rps) * n_rps +
+                                               (p[P_KT_MAX]-KT_0)/Ja_max * (Va/D_prop) * ca.fabs(n_rps)),
+                            rho * D_prop**4 * KT_0 * ca.fabs(n_rps) * n_rps / 10)
+        K_prop = ca.if_else(forward,
+                            rho * D_prop**5 * (KQ_0 * ca.fabs(n_rps) * n_rps +
+                                               (p[P_KQ_MAX]-KQ_0)/Ja_max * (Va/D_prop) * ca.fabs(n_rps)),
+                            rho * D_prop**5 * KQ_0 * ca.fabs(n_rps) * n_rps / 10)
+        dir_flip = ca.if_else(forward, 1.0, -1.0)
+        if i == 1:
+            K_prop = -K_prop
+
+        Fx = C_T2C[0] * X_prop
+        Fy = C_T2C[3] * X_prop
+        Fz = C_T2C[6] * X_prop
+        rx = C_T2C[0]*p[r_sh] + C_T2C[1]*p[r_sh+1] + C_T2C[2]*p[r_sh+2] - p[P_P_OC_O]
+        ry = C_T2C[3]*p[r_sh] + C_T2C[4]*p[r_sh+1] + C_T2C[5]*p[r_sh+2] - p[P_P_OC_O+1]
+        rz = C_T2C[6]*p[r_sh] + C_T2C[7]*p[r_sh+1] + C_T2C[8]*p[r_sh+2] - p[P_P_OC_O+2]
+
+        rhs[0] += Fx
+        rhs[1] += Fy
+        rhs[2] += Fz
+        # Moments are returned as yaw, pitch, roll and swapped into the model order
+        rhs[3] += rot_strength * (rx*Fy - ry*Fx)
+        rhs[4] += rot_strength * dir_flip * (rz*Fx - rx*Fz)
+        rhs[5] += rot_strength * (ry*Fz - rz*Fy + K_prop)
+
+    # nu_dot = M^-1 rhs, block inverse of the mass matrix
+    c00 = a11*a22 - a12*a21
+    c01 = a02*a21 - a01*a22
+    c02 = a01*a12 - a02*a11
+    c10 = a12*a20 - a10*a22
+    c11 = a00*a22 - a02*a20
+    c12 = a02*a10 - a00*a12
+    c20 = a10*a21 - a11*a20
+    c21 = a01*a20 - a00*a21
+    c22 = a00*a11 - a01*a10
+    det = a00*c00 + a01*c10 + a02*c20
+    nu_dot = [rhs[0] / m11,
+              rhs[1] / m22,
+              rhs[2] / m22,
+              (c00*rhs[3] + c01*rhs[4] + c02*rhs[5]) / det,
+              (c10*rhs[3] + c11*rhs[4] + c12*rhs[5]) / det,
+              (c20*rhs[3] + c21*rhs[4] + c22*rhs[5]) / det]
+
+    # Position kinematics, p_dot = C(q) v
+    pos_dot = [(1 - 2*(q2*q2 + q3*q3))*u + 2*(q1*q2 - q0*q3)*v + 2*(q1*q3 + q0*q2)*w,
+               2*(q1*q2 + q0*q3)*u + (1 - 2*(q1*q1 + q3*q3))*v + 2*(q2*q3 - q0*q1)*w,
+               2*(q1*q3 - q0*q2)*u + 2*(q2*q3 + q0*q1)*v + (1 - 2*(q1*q1 + q2*q2))*w]
+
+    # Quaternion kinematics, Fossen 2021, eq. 2.78
+    q_corr = p[P_GAMMA]/2 * (1 - (q0*q0 + q1*q1 + q2*q2 + q3*q3))
+    q_dot = [0.5*(-q1*p_rate - q2*q_rate - q3*r_rate) + q_corr*q0,
+             0.5*(q0*p_rate - q3*q_rate + q2*r_rate) + q_corr*q1,
+             0.5*(q3*p_rate + q0*q_rate - q1*r_rate) + q_corr*q2,
+             0.5*(-q2*p_rate + q1*q_rate + q0*r_rate) + q_corr*q3]
+
+    # Actuator dynamics
+    dt = p[P_DT]
+    u_dot = [_clip((ur_vbs - u_vbs)/dt, -p[P_X_VBS_DOT_MAX], p[P_X_VBS_DOT_MAX]),
+             _clip((ur_lcg - u_lcg)/dt, -p[P_X_LCG_DOT_MAX], p[P_X_LCG_DOT_MAX]),
+             (u_ref[2] - x[15])/dt,
+             (u_ref[3] - x[16])/dt,
+             (u_ref[4] - x[17])/dt,
+             (u_ref[5] - x[18])/dt]
+
+    return ca.vertcat(*pos_dot, *q_dot, *nu_dot, *u_dot)
+
+
+def jacobian_function():
+    """
+    ca.Function (x, u_ref, p) -> (x_dot, A, B) of a single operating point,
+    with dense A and B
+    """
+    if "jacobians" not in _functions:
+        x = ca.SX.sym('x', 19)
+        u_ref = ca.SX.sym('u_ref', 6)
+        p = ca.SX.sym('p', N_PARAMETERS)
+        x_dot = sam_dynamics_sx(x, u_ref, p)
+        _functions["jacobians"] = ca.Function('sam_jacobians', [x, u_ref, p],
+                                              [x_dot, ca.densify(ca.jacobian(x_dot, x)),
+                                               ca.densify(ca.jacobian(x_dot, u_ref))],
+                                              ['x', 'u_ref', 'p'], ['x_dot', 'A', 'B'])
+
+    return _functions["jacobians"]
+
+
+def compile(cache_dir=None):
+    """
+    Generate C code for jacobian_function() and compile it with -O3. The library
+    is kept in cache_dir (CACHE_DIR by default) and only rebuilt if the
+    generated code changes.
+
+    Returns:
+        ca.Function with the same signature, evaluating the compiled code
+    """
+    if cache_dir is None:
+        cache_dir = CACHE_DIR
+
+    if "compiled" not in _functions:
+        function = jacobian_function()
+        os.makedirs(cache_dir, exist_ok=True)
+        source = os.path.join(cache_dir, function.name() + ".c")
+        library = os.path.join(cache_dir, function.name() + ".so")
+
+        code = ca.CodeGenerator(function.name() + ".c")
+        code.add(function)
+        code = code.dump()
+        old_code = None
+        if os.path.isfile(source):
+            with open(source) as f:
+                old_code = f.read()
+
+        if code != old_code or not os.path.isfile(library):
+            with open(source, "w") as f:
+                f.write(code)
+            # Build next to the library and move it in place, other processes might be loading it
+            subprocess.run(["gcc", "-O3", "-fPIC", "-shared", source, "-o", library + f".{os.getpid()}"], check=True)
+            os.replace(library + f".{os.getpid()}", library)
+
+        _functions["compiled"] = ca.external(function.name(), library)
+
+    return _functions["compiled"]
+
+
+class SAMJacobian():
+    """
+    SAMJacobian(sam, compiled=False)
+        Batched linearizations of a SAM instance. With compiled=True, the
+        generated C code is used, see compile().
+
+    Like SAMKernel, changes of the SAM parameters after construction are not
+    picked up, call update_parameters() for that.
+    """
+    def __init__(self, sam, compiled=False):
+        self.sam = sam
+        self.p = pack_parameters(sam)
+        self.function = compile() if compiled else jacobian_function()
+        self.maps = {}
+
+    def update_parameters(self):
+        """
+        Re-read the parameters from the SAM instance
+        """
+        self.p[:] = pack_parameters(self.sam)
+
+    def evaluate(self, X, U_ref, P=None):
+        """
+        Dynamics and their Jacobians for N operating points.
+
+        Args:
+            X: (N, 19) array of state vectors, or a single (19,) state
+            U_ref: (N, 6) array of control inputs, or a single (6,) input
+            P: optional (N, N_PARAMETERS) packed parameters per operating point,
+                e.g. from pack_parameters() of differently tuned vehicles
+
+        Returns:
+            X_dot: (N, 19) time derivatives
+            A: (N, 19, 19) df/dx
+            B: (N, 19, 6) df/du_ref
+        """
+        X = np.ascontiguousarray(np.atleast_2d(X), dtype=float)
+        N = X.shape[0]
+        U_ref = np.ascontiguousarray(np.broadcast_to(np.asarray(U_ref, float), (N, 6)))
+        P = np.ascontiguousarray(np.broadcast_to(self.p if P is None else np.asarray(P, float), (N, N_PARAMETERS)))
+
+        # The mapped function reads from and writes to the NumPy arrays directly. CasADi matrices are column-major,
+        # so the (N, 19) state array is its (19, N) input and A comes out transposed.
+        if N not in self.maps:
+            self.maps[N] = self.function.map(N).buffer()
+        buffer, evaluate = self.maps[N]
+
+        X_dot = np.empty((N, 19))
+        A_T = np.empty((N, 19, 19))
+        B_T = np.empty((N, 6, 19))
+        for i, arg in enumerate((X, U_ref, P)):
+            buffer.set_arg(i, memoryview(arg))
+        for i, res in enumerate((X_dot, A_T, B_T)):
+            buffer.set_res(i, memoryview(res))
+        evaluate()
+
+        A = np.ascontiguousarray(A_T.transpose(0, 2, 1))
+        B = np.ascontiguousarray(B_T.transpose(0, 2, 1))
+
+        return X_dot, A, B
+
+    def jacobians(self, X, U_ref, P=None):
+        """
+        A = df/dx (N, 19, 19) and B = df/du_ref (N, 19, 6), see evaluate()
+        """
+        _, A, B = self.evaluate(X, U_ref, P)
+        return A, B
+
+
+def finite_difference_jacobians(sam, X, U_ref, eps=1e-6):
+    """
+    Central finite differences of SAM.dynamics_batch, with a relative step of
+    eps. All perturbations of one operating point are evaluated in one batch.
+
+    Returns:
+        A: (N, 19, 19) df/dx
+        B: (N, 19, 6) df/du_ref
+    """
+    X = np.atleast_2d(np.asarray(X, float))
+    N = X.shape[0]
+    U_ref = np.broadcast_to(np.asarray(U_ref, float), (N, 6))
+
+    Z = np.concatenate((X, U_ref), axis=1)
+    h = eps * np.maximum(1.0, np.abs(Z))
+    steps = h[:, None, :] * np.eye(25)
+
+    Z_plus = (Z[:, None, :] + steps).reshape(-1, 25)
+    Z_minus = (Z[:, None, :] - steps).reshape(-1, 25)
+    F_plus = sam.dynamics_batch(Z_plus[:, :19], Z_plus[:, 19:]).reshape(N, 25, 19)
+    F_minus = sam.dynamics_batch(Z_minus[:, :19], Z_minus[:, 19:]).reshape(N, 25, 19)
+
+    J = ((F_plus - F_minus) / (2 * h[:, :, None])).transpose(0, 2, 1)
+
+    return J[:, :, :19], J[:, :, 19:]
+
+
+def check_jacobians(sam, X, U_ref, eps=1e-6, compiled=False):
+    """
+    Compare SAMJacobian with SAM.dynamics_batch and its finite differences.
+
+    Returns:
+        dict with the max. relative error of x_dot, A and B, relative to
+        1 + |finite difference|
+    """
+    X_dot, A, B = SAMJacobian(sam, compiled).evaluate(X, U_ref)
+    A_fd, B_fd = finite_difference_jacobians(sam, X, U_ref, eps)
+    X_dot_ref = sam.dynamics_batch(X, U_ref)
+
+    return {
+        "x_dot": np.max(np.abs(X_dot - X_dot_ref) / (1 + np.abs(X_dot_ref))),
+        "A": np.max(np.abs(A - A_fd) / (1 + np.abs(A_fd))),
+        "B": np.max(np.abs(B - B_fd) / (1 + np.abs(B_fd))),
+    }
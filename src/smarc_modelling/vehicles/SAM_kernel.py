@@ -0,0 +1,440 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+SAM_kernel.py:
+
+   Stateless, allocation-free evaluation of the SAM dynamics.
+
+   The reference model in SAM.py evaluates x_dot = f(x, u_ref) by updating a
+   number of attributes on the vehicle (M, C, D, g_vec, tau) and builds several
+   small NumPy arrays on every call. Here the same model is written out as a
+   pure function on flat arrays:
+
+       sam_dynamics_kernel(x, u_ref, p, ws, x_dot)
+
+   - p:     packed parameter vector, built once from a SAM instance with
+            pack_parameters(sam). Indices are given by the P_* constants.
+   - ws:    preallocated workspace of length WORKSPACE_SIZE, see make_workspace().
+   - x_dot: caller-provided output buffer of length 19, written in place.
+
+   The function only uses scalar arithmetic and array indexing, no Python
+   objects or SciPy calls. That keeps the per-call overhead low and makes the
+   kernel compilable as is. With jit=True it is compiled with numba, see
+   lib/jit.py.
+
+   SAMKernel() wraps parameters and workspace for convenience:
+
+       kernel = SAMKernel(SAM(dt), jit=False)
+       x_dot = kernel.dynamics(x, u_ref)
+
+   NOTE: The kernel reproduces the effective damping used in SAM.dynamics, i.e.
+       the diagonal damping with damping_factor and damping_rot.
+"""
+
+import math
+import numpy as np
+from smarc_modelling.lib.jit import jit_compile
+
+# Packed parameter layout
+P_DT = 0
+P_V_C = 1
+P_BETA_C = 2
+P_RHO = 3
+P_G = 4
+P_B = 5
+P_M_SS = 6
+P_M_LCG = 7
+P_L_VBS = 8
+P_R_VBS = 9
+P_L_LCG = 10
+P_X_VBS_DOT_MAX = 11
+P_X_LCG_DOT_MAX = 12
+P_INERTIA_FACTOR = 13
+P_DAMPING_FACTOR = 14
+P_DAMPING_ROT = 15
+P_THRUSTER_ROT_STRENGTH = 16
+P_K1 = 17
+P_K2 = 18
+P_K_PRIME = 19
+P_R44 = 20
+P_D_PROP = 21
+P_VA_COEF = 22
+P_KT_0 = 23
+P_KQ_0 = 24
+P_KT_MAX = 25
+P_KQ_MAX = 26
+P_JA_MAX = 27
+P_GAMMA = 28
+P_IX_LCG = 29
+P_IY_LCG = 30
+P_P_OSSG_O = 31         # 3 entries
+P_P_OVBS_O = 34         # 3 entries
+P_P_OLCGPOS_O = 37      # 3 entries
+P_P_OB_O = 40           # 3 entries
+P_P_OC_O = 43           # 3 entries
+P_R_PROP_1 = 46         # 3 entries
+P_R_PROP_2 = 49         # 3 entries
+P_J_SS_CO = 52          # 9 entries, row major
+P_S2_VBS = 61           # 9 entries, row major
+N_PARAMETERS = 70
+
+# Workspace layout
+WS_J = 0                # 9 entries, total inertia in CO
+WS_C_T2C = 9            # 9 entries, thruster to body DCM
+WS_RHS = 18             # 6 entries, tau - C nu_r - D nu_r - g
+WORKSPACE_SIZE = 24
+
+
+def pack_parameters(sam):
+    """
+    Collect all parameters of a SAM instance that enter the dynamics into a
+    flat parameter vector. Constant terms, such as the inertia of the solid
+    structure, are evaluated once here.
+
+    Args:
+        sam: SAM instance
+
+    Returns:
+        p: (N_PARAMETERS,) parameter vector
+    """
+    p = np.zeros(N_PARAMETERS)
+
+    p[P_DT] = sam.dt
+    p[P_V_C] = sam.V_c
+    p[P_BETA_C] = sam.beta_c
+    p[P_RHO] = sam.rho
+    p[P_G] = sam.g
+    p[P_B] = sam.B
+    p[P_M_SS] = sam.ss.m_ss
+    p[P_M_LCG] = sam.lcg.m_lcg
+    p[P_L_VBS] = sam.vbs.l_vbs_l
+    p[P_R_VBS] = sam.vbs.r_vbs
+    p[P_L_LCG] = sam.lcg.l_lcg_l
+    p[P_X_VBS_DOT_MAX] = sam.vbs.x_vbs_dot_max
+    p[P_X_LCG_DOT_MAX] = sam.lcg.x_lcg_dot_max
+    p[P_INERTIA_FACTOR] = sam.inertia_factor
+    p[P_DAMPING_FACTOR] = sam.damping_factor
+    p[P_DAMPING_ROT] = sam.damping_rot
+    p[P_THRUSTER_ROT_STRENGTH] = sam.thruster_rot_strength
+    p[P_K1] = sam.k1
+    p[P_K2] = sam.k2
+    p[P_K_PRIME] = sam.k_prime
+    p[P_R44] = sam.r44
+    p[P_D_PROP] = sam.D_prop
+    p[P_VA_COEF] = sam.Va_coef
+    p[P_KT_0] = sam.KT_0
+    p[P_KQ_0] = sam.KQ_0
+    p[P_KT_MAX] = sam.KT_max
+    p[P_KQ_MAX] = sam.KQ_max
+    p[P_JA_MAX] = sam.Ja_max
+    p[P_GAMMA] = sam.gamma
+
+    # LCG moments of inertia of a solid cylinder, see SAM.update_inertias
+    p[P_IX_LCG] = (1/2) * sam.lcg.m_lcg * (sam.lcg.h_lcg_dim/2)**2
+    p[P_IY_LCG] = (1/12) * sam.lcg.m_lcg * (3*(sam.lcg.h_lcg_dim/2)**2 + sam.lcg.l_lcg_l**2)
+
+    p[P_P_OSSG_O:P_P_OSSG_O+3] = sam.ss.p_OSsg_O
+    p[P_P_OVBS_O:P_P_OVBS_O+3] = sam.vbs.p_OVbs_O
+    p[P_P_OLCGPOS_O:P_P_OLCGPOS_O+3] = sam.lcg.p_OLcgPos_O
+    p[P_P_OB_O:P_P_OB_O+3] = sam.p_OB_O
+    p[P_P_OC_O:P_P_OC_O+3] = sam.p_OC_O
+    p[P_R_PROP_1:P_R_PROP_1+3] = sam.propellers.r_t_p_sh[0]
+    p[P_R_PROP_2:P_R_PROP_2+3] = sam.propellers.r_t_p_sh[1]
+
+    # Solid structure inertia in CO, constant
+    p[P_J_SS_CO:P_J_SS_CO+9] = sam.J_ss_co.ravel()
+
+    # Squared skew-symmetric matrix of the VBS position, constant
+    r = sam.vbs.p_OVbs_O
+    p[P_S2_VBS:P_S2_VBS+9] = (np.outer(r, r) - np.dot(r, r) * np.eye(3)).ravel()
+
+    return p
+
+
+def make_workspace():
+    """
+    Allocate the workspace used by sam_dynamics_kernel.
+    """
+    return np.zeros(WORKSPACE_SIZE)
+
+
+def sam_dynamics_kernel(x, u_ref, p, ws, x_dot):
+    """
+    Pure-function SAM dynamics. Same model as SAM.dynamics.
+
+    Args:
+        x: state space vector with [eta, nu, u]
+        u_ref: control inputs as [x_vbs, x_lcg, delta_s, delta_r, rpm1, rpm2]
+        p: packed parameters, see pack_parameters
+        ws: workspace, see make_workspace
+        x_dot: output buffer for the time derivative of the state vector
+
+    Returns:
+        x_dot
+    """
+    # Bound actuators
+    u_vbs = min(max(x[13], 0.0), 100.0)
+    u_lcg = min(max(x[14], 0.0), 100.0)
+    ur_vbs = min(max(u_ref[0], 0.0), 100.0)
+    ur_lcg = min(max(u_ref[1], 0.0), 100.0)
+
+    # Normalized quaternion and Euler angles (zyx convention)
+    q0 = x[3]
+    q1 = x[4]
+    q2 = x[5]
+    q3 = x[6]
+    q_norm = math.sqrt(q0*q0 + q1*q1 + q2*q2 + q3*q3)
+    q0 /= q_norm
+    q1 /= q_norm
+    q2 /= q_norm
+    q3 /= q_norm
+
+    phi = math.atan2(2*(q0*q1 + q2*q3), 1 - 2*(q1*q1 + q2*q2))
+    sin_theta = 2*(q0*q2 - q3*q1)
+    theta = math.asin(min(max(sin_theta, -1.0), 1.0))
+    psi = math.atan2(2*(q0*q3 + q1*q2), 1 - 2*(q2*q2 + q3*q3))
+
+    # Relative velocities due to current
+    u = x[7]
+    v = x[8]
+    w = x[9]
+    p_rate = x[10]
+    q_rate = x[11]
+    r_rate = x[12]
+
+    V_c = p[P_V_C]
+    ur = u - V_c * math.cos(p[P_BETA_C] - psi)
+    vr = v - V_c * math.sin(p[P_BETA_C] - psi)
+    wr = w
+    U = math.sqrt(u*u + v*v + w*w)
+
+    # Actuator positions and mass
+    x_vbs = (u_vbs/100) * p[P_L_VBS]
+    x_lcg = p[P_P_OLCGPOS_O] + (u_lcg/100) * p[P_L_LCG]
+    y_lcg = p[P_P_OLCGPOS_O+1]
+    z_lcg = p[P_P_OLCGPOS_O+2]
+
+    m_ss = p[P_M_SS]
+    m_lcg = p[P_M_LCG]
+    r_vbs = p[P_R_VBS]
+    m_vbs = p[P_RHO] * math.pi * r_vbs ** 2 * x_vbs
+    m = m_ss + m_vbs + m_lcg
+
+    # Center of gravity
+    x_g = (m_ss*p[P_P_OSSG_O] + m_vbs*p[P_P_OVBS_O] + m_lcg*x_lcg) / m
+    y_g = (m_ss*p[P_P_OSSG_O+1] + m_vbs*p[P_P_OVBS_O+1] + m_lcg*y_lcg) / m
+    z_g = (m_ss*p[P_P_OSSG_O+2] + m_vbs*p[P_P_OVBS_O+2] + m_lcg*z_lcg) / m
+
+    # Total inertia J = J_ss + J_vbs + J_lcg, with S(r)^2 = r r^T - |r|^2 I
+    J = ws[WS_J:WS_J+9]
+    lcg = (x_lcg, y_lcg, z_lcg)
+    lcg_sq = x_lcg*x_lcg + y_lcg*y_lcg + z_lcg*z_lcg
+    for i in range(3):
+        for j in range(3):
+            J[3*i+j] = p[P_J_SS_CO+3*i+j] \
+                        - m_vbs * p[P_S2_VBS+3*i+j] \
+                        - m_lcg * lcg[i] * lcg[j]
+    Ix_vbs = (1/2) * m_vbs * r_vbs**2
+    Iy_vbs = (1/12) * m_vbs * (3*r_vbs**2 + x_vbs**2)
+    J[0] += Ix_vbs + p[P_IX_LCG] + m_lcg * lcg_sq
+    J[4] += Iy_vbs + p[P_IY_LCG] + m_lcg * lcg_sq
+    J[8] += Iy_vbs + p[P_IY_LCG] + m_lcg * lcg_sq
+    J[0] *= p[P_INERTIA_FACTOR]
+
+    # Mass matrix: diagonal translational block, rotational block J + MA_22
+    m11 = m * (1 + p[P_K1])
+    m22 = m * (1 + p[P_K2])
+    a00 = J[0] + p[P_R44] * J[0]
+    a11 = J[4] + p[P_K_PRIME] * J[4]
+    a22 = J[8] + p[P_K_PRIME] * J[4]
+    a01 = J[1]
+    a02 = J[2]
+    a10 = J[3]
+    a12 = J[5]
+    a20 = J[6]
+    a21 = J[7]
+
+    # Coriolis: C(nu_r) nu_r for C = m2c(MRB) + m2c(MA), Fossen 2021, eq. 3.46
+    t1x = m11 * ur
+    t1y = m22 * vr
+    t1z = m22 * wr
+    sa01 = 0.5 * (a01 + a10)
+    sa02 = 0.5 * (a02 + a20)
+    sa12 = 0.5 * (a12 + a21)
+    t2x = a00 * p_rate + sa01 * q_rate + sa02 * r_rate
+    t2y = sa01 * p_rate + a11 * q_rate + sa12 * r_rate
+    t2z = sa02 * p_rate + sa12 * q_rate + a22 * r_rate
+
+    # Gravity and buoyancy, see gvect
+    W = m * p[P_G]
+    B = p[P_B]
+    sth = math.sin(theta)
+    cth = math.cos(theta)
+    sphi = math.sin(phi)
+    cphi = math.cos(phi)
+    gx = x_g*W - p[P_P_OB_O]*B
+    gy = y_g*W - p[P_P_OB_O+1]*B
+    gz = z_g*W - p[P_P_OB_O+2]*B
+
+    rhs = ws[WS_RHS:WS_RHS+6]
+    d_lin = p[P_DAMPING_FACTOR]
+    d_rot = p[P_DAMPING_ROT]
+    rhs[0] = -(q_rate*t1z - r_rate*t1y) - d_lin*ur - (W-B) * sth
+    rhs[1] = -(r_rate*t1x - p_rate*t1z) - d_lin*vr + (W-B) * cth * sphi
+    rhs[2] = -(p_rate*t1y - q_rate*t1x) - d_lin*wr + (W-B) * cth * cphi
+    rhs[3] = -(vr*t1z - wr*t1y) - (q_rate*t2z - r_rate*t2y) - d_rot*p_rate \
+             - (-gy * cth * cphi + gz * cth * sphi)
+    rhs[4] = -(wr*t1x - ur*t1z) - (r_rate*t2x - p_rate*t2z) - d_rot*q_rate \
+             - (gz * sth + gx * cth * cphi)
+    rhs[5] = -(ur*t1y - vr*t1x) - (p_rate*t2y - q_rate*t2x) - d_rot*r_rate \
+             - (-gx * cth * sphi - gy * sth)
+
+    # Propellers, see SAM.calculate_propeller_force
+    delta_s = -u_ref[2]
+    delta_r = -u_ref[3]
+    cs = math.cos(delta_s)
+    ss = math.sin(delta_s)
+    cr = math.cos(delta_r)
+    sr = math.sin(delta_r)
+    C_T2C = ws[WS_C_T2C:WS_C_T2C+9]
+    C_T2C[0] = cr * cs
+    C_T2C[1] = sr
+    C_T2C[2] = -cr * ss
+    C_T2C[3] = -sr * cs
+    C_T2C[4] = cr
+    C_T2C[5] = sr * ss
+    C_T2C[6] = ss
+    C_T2C[7] = 0.0
+    C_T2C[8] = cs
+
+    rho = p[P_RHO]
+    D_prop = p[P_D_PROP]
+    KT_0 = p[P_KT_0]
+    KQ_0 = p[P_KQ_0]
+    Ja_max = p[P_JA_MAX]
+    rot_strength = p[P_THRUSTER_ROT_STRENGTH]
+    Va = p[P_VA_COEF] * U
+
+    for i in range(2):
+        n_rps = u_ref[4+i] / 60
+        if n_rps > 0:
+            X_prop = rho * D_prop**4 * (
+                    KT_0 * abs(n_rps) * n_rps +
+                    (p[P_KT_MAX]-KT_0)/Ja_max * (Va/D_prop) * abs(n_rps))
+            K_prop = rho * D_prop**5 * (
+                    KQ_0 * abs(n_rps) * n_rps +
+                    (p[P_KQ_MAX]-KQ_0)/Ja_max * (Va/D_prop) * abs(n_rps))
+            dir_flip = 1.0
+        else:
+            X_prop = rho * D_prop**4 * KT_0 * abs(n_rps) * n_rps / 10
+            K_prop = rho * D_prop**5 * KQ_0 * abs(n_rps) * n_rps / 10
+            dir_flip = -1.0
+
+        if i == 0:
+            r_sh = P_R_PROP_1
+        else:
+            r_sh = P_R_PROP_2
+            K_prop = -K_prop
+
+        Fx = C_T2C[0] * X_prop
+        Fy = C_T2C[3] * X_prop
+        Fz = C_T2C[6] * X_prop
+        rx = C_T2C[0]*p[r_sh] + C_T2C[1]*p[r_sh+1] + C_T2C[2]*p[r_sh+2] - p[P_P_OC_O]
+        ry = C_T2C[3]*p[r_sh] + C_T2C[4]*p[r_sh+1] + C_T2C[5]*p[r_sh+2] - p[P_P_OC_O+1]
+        rz = C_T2C[6]*p[r_sh] + C_T2C[7]*p[r_sh+1] + C_T2C[8]*p[r_sh+2] - p[P_P_OC_O+2]
+
+        rhs[0] += Fx
+        rhs[1] += Fy
+        rhs[2] += Fz
+        # Moments are returned as yaw, pitch, roll and swapped into the model order
+        rhs[3] += rot_strength * (rx*Fy - ry*Fx)
+        rhs[4] += rot_strength * dir_flip * (rz*Fx - rx*Fz)
+        rhs[5] += rot_strength * (ry*Fz - rz*Fy + K_prop)
+
+    # nu_dot = M^-1 rhs, block inverse of the mass matrix
+    x_dot[7] = rhs[0] / m11
+    x_dot[8] = rhs[1] / m22
+    x_dot[9] = rhs[2] / m22
+
+    c00 = a11*a22 - a12*a21
+    c01 = a02*a21 - a01*a22
+    c02 = a01*a12 - a02*a11
+    c10 = a12*a20 - a10*a22
+    c11 = a00*a22 - a02*a20
+    c12 = a02*a10 - a00*a12
+    c20 = a10*a21 - a11*a20
+    c21 = a01*a20 - a00*a21
+    c22 = a00*a11 - a01*a10
+    det = a00*c00 + a01*c10 + a02*c20
+    x_dot[10] = (c00*rhs[3] + c01*rhs[4] + c02*rhs[5]) / det
+    x_dot[11] = (c10*rhs[3] + c11*rhs[4] + c12*rhs[5]) / det
+    x_dot[12] = (c20*rhs[3] + c21*rhs[4] + c22*rhs[5]) / det
+
+    # Position kinematics, p_dot = C(q) v
+    x_dot[0] = (1 - 2*(q2*q2 + q3*q3))*u + 2*(q1*q2 - q0*q3)*v + 2*(q1*q3 + q0*q2)*w
+    x_dot[1] = 2*(q1*q2 + q0*q3)*u + (1 - 2*(q1*q1 + q3*q3))*v + 2*(q2*q3 - q0*q1)*w
+    x_dot[2] = 2*(q1*q3 - q0*q2)*u + 2*(q2*q3 + q0*q1)*v + (1 - 2*(q1*q1 + q2*q2))*w
+
+    # Quaternion kinematics, Fossen 2021, eq. 2.78
+    q_corr = p[P_GAMMA]/2 * (1 - (q0*q0 + q1*q1 + q2*q2 + q3*q3))
+    x_dot[3] = 0.5*(-q1*p_rate - q2*q_rate - q3*r_rate) + q_corr*q0
+    x_dot[4] = 0.5*(q0*p_rate - q3*q_rate + q2*r_rate) + q_corr*q1
+    x_dot[5] = 0.5*(q3*p_rate + q0*q_rate - q1*r_rate) + q_corr*q2
+    x_dot[6] = 0.5*(-q2*p_rate + q1*q_rate + q0*r_rate) + q_corr*q3
+
+    # Actuator dynamics
+    dt = p[P_DT]
+    u_dot_vbs = (ur_vbs - u_vbs)/dt
+    u_dot_lcg = (ur_lcg - u_lcg)/dt
+    x_dot[13] = min(max(u_dot_vbs, -p[P_X_VBS_DOT_MAX]), p[P_X_VBS_DOT_MAX])
+    x_dot[14] = min(max(u_dot_lcg, -p[P_X_LCG_DOT_MAX]), p[P_X_LCG_DOT_MAX])
+    x_dot[15] = (u_ref[2] - x[15])/dt
+    x_dot[16] = (u_ref[3] - x[16])/dt
+    x_dot[17] = (u_ref[4] - x[17])/dt
+    x_dot[18] = (u_ref[5] - x[18])/dt
+
+    return x_dot
+
+
+class SAMKernel():
+    """
+    SAMKernel(sam, jit=False)
+        Holds the packed parameters and the workspace of a SAM instance and
+        evaluates sam_dynamics_kernel with them. With jit=True, the numba
+        compiled kernel is used.
+
+    Changes of the SAM parameters after construction are not picked up, call
+    update_parameters() for that.
+    """
+    def __init__(self, sam, jit=False):
+        self.sam = sam
+        self.p = pack_parameters(sam)
+        self.ws = make_workspace()
+        self.jit = jit
+        if jit:
+            self.kernel = jit_compile(sam_dynamics_kernel)
+        else:
+            self.kernel = sam_dynamics_kernel
+
+    def dynamics(self, x, u_ref, out=None):
+        """
+        Evaluate the dynamics. Writes into out if given, otherwise into a
+        newly allocated array.
+        """
+        if out is None:
+            out = np.empty(19)
+        return self.kernel(x, u_ref, self.p, self.ws, out)
+
+    def update_parameters(self):
+        """
+        Re-read the parameters from the SAM instance
+        """
+        self.p[:] = pack_parameters(self.sam)
+
+    def update_dt(self, dt):
+        """
+        Updates dt for when doing simulations
+        """
+        self.sam.dt = dt
+        self.p[P_DT] = dt
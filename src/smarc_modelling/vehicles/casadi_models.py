@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+casadi_models.py:
+
+   Factory for the symbolic dynamics of SAM_casadi and SAM_LQR. Tracing the
+   Python model code into a CasADi graph takes tens of milliseconds and was
+   repeated by every dynamics(export=True) call, e.g. once per NMPC and once
+   per planning query. Here the resulting ca.Function is built once per
+   parameter set and memoized:
+
+       x_dot = dynamics_function("SAM_casadi", export=True, dt=0.1)
+       x_dot = vehicle_dynamics(sam, export=True)    # tuning parameters of an instance
+       x_dot = vehicle_dynamics(sam, export=True, sym=ca.SX)
+
+   If CACHE_DIR is set, the functions are also serialized there with
+   Function.save and later processes load them instead of tracing the model.
+   The cache key contains the source of the model and of gnc_casadi, so
+   edited model code is traced again.
+"""
+
+import functools
+import hashlib
+import inspect
+import json
+import os
+
+import casadi as ca
+
+from smarc_modelling.lib import gnc_casadi
+from smarc_modelling.vehicles.SAM_casadi import SAM_casadi
+from smarc_modelling.vehicles.SAM_LQR import SAM_LQR
+
+MODELS = {
+    "SAM_casadi": SAM_casadi,
+    "SAM_LQR": SAM_LQR,
+}
+
+# Attributes that are tuned after construction, where the model has them
+TUNING_PARAMETERS = ("vbs_factor", "inertia_factor", "damping_factor", "damping_rot", "thruster_rot_strength")
+
+# Directory for the serialized functions, None to only memoize them in memory
+CACHE_DIR = None
+
+# Functions built in this process, key -> ca.Function
+_functions = {}
+
+
+def model_parameters(vehicle):
+    """
+    The parameter set of a model instance: the constructor arguments and the
+    tuning attributes. These are not changed by tracing, so the instance may
+    already have been used.
+    """
+    params = {
+        "dt": vehicle.dt,
+        "V_current": vehicle.V_c,
+        "beta_current": vehicle.beta_c / vehicle.D2R,
+    }
+    for name in TUNING_PARAMETERS:
+        if hasattr(vehicle, name):
+            params[name] = getattr(vehicle, name)
+
+    return params
+
+
+def make_vehicle(model, **parameters):
+    """
+    A fresh model instance with the given parameter set
+    """
+    params = dict(parameters)
+    vehicle = MODELS[model](dt=params.pop("dt", 0.02), V_current=params.pop("V_current", 0),
+                            beta_current=params.pop("beta_current", 0))
+    for name, value in params.items():
+        if not hasattr(vehicle, name):
+            raise ValueError(f"{model} has no parameter {name}")
+        setattr(vehicle, name, value)
+
+    return vehicle
+
+
+@functools.lru_cache(maxsize=None)
+def _source_hash(model):
+    digest = hashlib.sha1()
+    for module in (inspect.getmodule(MODELS[model]), gnc_casadi):
+        with open(inspect.getsourcefile(module), "rb") as f:
+            digest.update(f.read())
+
+    return digest.hexdigest()
+
+
+def function_key(model, export, sym=ca.MX, **parameters):
+    """
+    Hash of the model, the export flag, the symbol type, the parameter set and
+    the model source
+    """
+    params = {name: float(value) for name, value in parameters.items()}
+    content = json.dumps([model, bool(export), sym.__name__, params, _source_hash(model)], sort_keys=True)
+
+    return hashlib.sha1(content.encode()).hexdigest()[0:16]
+
+
+def dynamics_function(model="SAM_casadi", export=False, cache_dir=None, sym=ca.MX, **parameters):
+    """
+    The ca.Function of model.dynamics(export, sym) for a parameter set, see
+    make_vehicle(). Built once per process, or loaded from cache_dir
+    (CACHE_DIR by default) if it was saved there before.
+
+    Returns:
+        x_dot: ca.Function x_dot(x, u_ref), with x = [eta, nu] for export=True
+            and x = [eta, nu, u] otherwise
+    """
+    if cache_dir is None:
+        cache_dir = CACHE_DIR
+
+    key = function_key(model, export, sym, **parameters)
+    if key in _functions:
+        return _functions[key]
+
+    path = None
+    if cache_dir is not None:
+        path = os.path.join(cache_dir, f"{model}_{'export' if export else 'full'}_{sym.__name__}_{key}.casadi")
+
+    if path is not None and os.path.isfile(path):
+        function = ca.Function.load(path)
+    else:
+        function = make_vehicle(model, **parameters).dynamics(export=export, sym=sym)
+        if path is not None:
+            # Write to a temporary file first, other processes might be loading it
+            os.makedirs(cache_dir, exist_ok=True)
+            function.save(path + f".{os.getpid()}.tmp")
+            os.replace(path + f".{os.getpid()}.tmp", path)
+
+    _functions[key] = function
+
+    return function
+
+
+def vehicle_dynamics(vehicle, export=False, cache_dir=None, sym=ca.MX):
+    """
+    dynamics_function() with the parameters of a SAM_casadi or SAM_LQR instance.
+    Other models are traced as before with vehicle.dynamics(export, sym).
+
+    Only the parameters of model_parameters() are taken from the instance, the
+    function is built from a fresh instance with them. Any other attribute
+    changed on the instance, e.g. the mass or the geometry, is not part of the
+    function, call vehicle.dynamics(export, sym) directly for such a model.
+    """
+    if type(vehicle).__name__ not in MODELS:
+        return vehicle.dynamics(export=export, sym=sym)
+
+    return dynamics_function(type(vehicle).__name__, export, cache_dir, sym, **model_parameters(vehicle))
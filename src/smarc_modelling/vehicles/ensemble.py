@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+ensemble.py:
+
+   Simulation of K independent vehicles in lockstep, e.g. for swarms or
+   ensemble forecasts. The states are stacked into a (K, nx) array and every
+   integration stage is a single call of the vehicle's dynamics_batch, instead
+   of K vehicle objects each doing their own linear algebra.
+
+   Every instance can have its own parameters, see SAM.batch_parameters and
+   BlueROV.batch_parameters for the available ones:
+
+       ensemble = Ensemble(SAM(dt), {"damping_factor": [40, 60, 80],
+                                     "V_current": [0, 0.1, 0.2]})
+       X = ensemble.simulate(X0, U, dt, n_steps)    # (n_steps, K, 19)
+
+   The parameter arrays of sam_sweep.py can be used directly.
+"""
+
+import numpy as np
+from smarc_modelling.lib.integrators import rk4, euler, simulate
+
+
+class Ensemble():
+    """
+    Ensemble(vehicle, params)
+        K instances of vehicle, which has to provide dynamics_batch(X, U_ref,
+        params), with per-instance params. params maps parameter names to
+        (K,) arrays, or is a structured array of length K. Scalars are used
+        for all instances.
+    """
+    def __init__(self, vehicle, params):
+        self.vehicle = vehicle
+        self.params = params
+
+        names = params.dtype.names if hasattr(params, "dtype") else params.keys()
+        if not names:
+            raise ValueError("Ensemble needs at least one parameter to know the number of instances")
+
+        sizes = {name: np.size(params[name]) for name in names}
+        self.K = max(sizes.values())
+        mismatched = {name: size for name, size in sizes.items() if size not in (1, self.K)}
+        if mismatched:
+            raise ValueError(f"Ensemble parameters do not broadcast to K = {self.K} instances: {mismatched}")
+
+    def dynamics(self, X, U_ref):
+        """
+        X_dot = dynamics(X, U_ref) for the (K, nx) stacked states. U_ref is
+        either a (K, nu) array or a single input for all instances.
+        """
+        return self.vehicle.dynamics_batch(X, U_ref, self.params)
+
+    def step(self, X, U_ref, dt, method="rk4"):
+        """
+        One integration step of all instances
+        """
+        if method == "rk4":
+            return rk4(X, U_ref, dt, self.dynamics)
+        elif method == "euler":
+            return euler(X, U_ref, dt, self.dynamics)
+        else:
+            raise ValueError(f"Unknown integration method: {method}")
+
+    def simulate(self, X0, U, dt, n_steps=None, method="rk4", per_step=None):
+        """
+        Integrate all instances from the (K, nx) initial states X0. U is a
+        constant input, (nu,) or (K, nu), or one input per step with a leading
+        axis of n_steps-1. per_step resolves a (K, nu) U with K == n_steps-1,
+        see lib/integrators.py.
+
+        Returns:
+            X: (n_steps, K, nx) trajectories
+        """
+        X0 = np.broadcast_to(np.asarray(X0, dtype=float), (self.K, np.shape(X0)[-1]))
+        update_dt = getattr(self.vehicle, "update_dt", None)
+
+        return simulate(self.dynamics, X0, U, dt, n_steps, method=method, update_dt=update_dt,
+                        per_step=per_step)
@@ -0,0 +1,75 @@
+import importlib
+import sys
+import types
+
+import matplotlib
+import pytest
+
+# The names the motion planning and control modules import from acados_template
+ACADOS_NAMES = ("AcadosOcp", "AcadosOcpSolver", "AcadosModel", "AcadosSim", "AcadosSimSolver")
+
+# The modules the PIML data loading, training and simulation import at module level, with the names they use
+PIML_MODULES = {
+    "rosbag2_py": {},
+    "rclpy": {},
+    "rclpy.serialization": {"deserialize_message": None},
+    "rosidl_runtime_py": {},
+    "rosidl_runtime_py.utilities": {"get_message": None},
+    "torch": {"Tensor": type("Tensor", (), {}), "nn": types.SimpleNamespace(Module=object)},
+    "torch.nn": {"Module": object},
+    "scienceplots": {},
+}
+
+
+def stub_missing(monkeypatch, modules):
+    '''
+    Put a stub with the given attributes into sys.modules for every module that cannot be imported
+    '''
+    for name, attributes in modules.items():
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            monkeypatch.setitem(sys.modules, name, types.SimpleNamespace(**attributes))
+
+
+def import_and_forget():
+    '''
+    Yields importlib.import_module, the modules of the package imported with it are removed again afterwards, so they
+    are not left behind with stubbed dependencies
+    '''
+    before = set(sys.modules)
+    yield importlib.import_module
+    for name in set(sys.modules) - before:
+        if name.startswith("smarc_modelling."):
+            sys.modules.pop(name)
+
+
+@pytest.fixture
+def import_without_acados(monkeypatch):
+    '''
+    import_without_acados(name) imports a module that needs acados_template and a display at import time, e.g. the
+    motion planning. acados_template is stubbed if it is missing and matplotlib.use() does nothing, so the TkAgg backend
+    is not required. The modules of the package imported this way are removed again afterwards.
+    '''
+    stub_missing(monkeypatch, {"acados_template": dict.fromkeys(ACADOS_NAMES, object)})
+    monkeypatch.setattr(matplotlib, "use", lambda *args, **kwargs: None)
+    yield from import_and_forget()
+
+
+@pytest.fixture
+def import_without_ros(monkeypatch):
+    '''
+    import_without_ros(name) imports a PIML module without ROS 2, torch or scienceplots. Each of them is only stubbed if
+    it is missing, tests that need torch itself request the torch fixture first.
+    '''
+    stub_missing(monkeypatch, PIML_MODULES)
+    yield from import_and_forget()
+
+
+@pytest.fixture
+def torch():
+    '''
+    torch itself, the test is skipped if it is not installed. Requested before import_without_ros, so that its stub is
+    not mistaken for torch.
+    '''
+    return pytest.importorskip("torch")
@@ -0,0 +1,88 @@
+import numpy as np
+
+from smarc_modelling.apps.benchmark_dynamics import random_states, max_rel_error
+from smarc_modelling.vehicles.SAM import SAM
+
+N_STATES = 100
+
+
+def sam_with(params, k, dt=0.01):
+    '''
+    A SAM instance with the k-th of the per-state parameters of dynamics_batch
+    '''
+    sam = SAM(dt, V_current=params["V_current"][k], beta_current=params["beta_current"][k])
+    sam.ss.m_ss = params["m_ss"][k]
+    sam.inertia_factor = params["inertia_factor"][k]
+    sam.damping_factor = params["damping_factor"][k]
+    sam.damping_rot = params["damping_rot"][k]
+    sam.clear_inertia_cache()
+    return sam
+
+
+def random_parameters(n, seed=1):
+    rng = np.random.default_rng(seed)
+    return {
+        "m_ss": rng.uniform(12, 16, n),
+        "inertia_factor": rng.uniform(1, 20, n),
+        "damping_factor": rng.uniform(20, 100, n),
+        "damping_rot": rng.uniform(1, 10, n),
+        "V_current": rng.uniform(0, 0.5, n),
+        "beta_current": rng.uniform(-180, 180, n),
+    }
+
+
+def test_dynamics_batch_matches_dynamics():
+    X, U = random_states(N_STATES)
+    sam = SAM(0.01)
+
+    x_dot_ref = np.array([sam.dynamics(x, u) for x, u in zip(X, U)])
+
+    assert max_rel_error(SAM(0.01).dynamics_batch(X, U), x_dot_ref) < 1e-12
+
+
+def test_dynamics_batch_broadcasts_a_single_input():
+    X, U = random_states(N_STATES)
+    sam = SAM(0.01)
+
+    x_dot_ref = np.array([sam.dynamics(x, U[0]) for x in X])
+
+    assert max_rel_error(SAM(0.01).dynamics_batch(X, U[0]), x_dot_ref) < 1e-12
+
+
+def test_dynamics_batch_with_per_state_parameters():
+    X, U = random_states(N_STATES)
+    params = random_parameters(N_STATES)
+
+    x_dot_ref = np.array([sam_with(params, k).dynamics(X[k], U[k]) for k in range(N_STATES)])
+    terms = SAM(0.01).calculate_terms_batch(X, U, params)
+
+    assert max_rel_error(SAM(0.01).dynamics_batch(X, U, params), x_dot_ref) < 1e-12
+    for k in range(N_STATES):
+        sam = sam_with(params, k)
+        sam.dynamics(X[k], U[k])
+        for name in ("M", "C", "g_vec", "tau"):
+            assert max_rel_error(terms[name][k], getattr(sam, name)) < 1e-12, name
+
+
+def test_batch_parameters():
+    sam = SAM(0.01, V_current=0.2, beta_current=30)
+    params = random_parameters(5)
+
+    # Defaults from the instance, beta_current in degrees
+    p = sam.batch_parameters(None, 5)
+    assert set(p) == set(params)
+    assert np.all(p["V_current"] == 0.2) and np.allclose(p["beta_current"], 30)
+    assert np.all(p["m_ss"] == sam.ss.m_ss) and np.all(p["damping_factor"] == sam.damping_factor)
+
+    # Scalars broadcast, arrays are taken per state and unknown names are ignored
+    p = sam.batch_parameters({"m_ss": 13.0, "damping_rot": params["damping_rot"], "unknown": 1.0}, 5)
+    assert p["m_ss"].shape == (5,) and np.all(p["m_ss"] == 13.0)
+    assert np.array_equal(p["damping_rot"], params["damping_rot"])
+    assert np.all(p["inertia_factor"] == sam.inertia_factor)
+
+    # Structured arrays work like dicts
+    records = np.zeros(5, dtype=[("damping_factor", float), ("V_current", float)])
+    records["damping_factor"] = params["damping_factor"]
+    p = sam.batch_parameters(records, 5)
+    assert np.array_equal(p["damping_factor"], params["damping_factor"])
+    assert np.all(p["V_current"] == 0)
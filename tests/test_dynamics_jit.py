@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from smarc_modelling.apps.benchmark_dynamics import random_states, max_rel_error
+from smarc_modelling.lib.jit import jit_available
+from smarc_modelling.vehicles.SAM import SAM
+from smarc_modelling.vehicles.BlueROV import BlueROV
+
+pytestmark = pytest.mark.skipif(not jit_available(), reason="numba is not installed")
+
+N_STATES = 200
+
+
+def test_sam_jit_matches_reference():
+    X, U = random_states(N_STATES)
+    sam = SAM(0.01)
+    sam_jit = SAM(0.01, use_jit=True)
+
+    x_dot_ref = np.array([sam.dynamics(x, u) for x, u in zip(X, U)])
+    x_dot_jit = np.array([sam_jit.dynamics(x, u) for x, u in zip(X, U)])
+
+    assert max_rel_error(x_dot_jit, x_dot_ref) < 1e-12
+
+
+def test_bluerov_jit_matches_reference():
+    X, _ = random_states(N_STATES)
+    X = X[:, 0:13]
+    U = np.random.default_rng(1).normal(scale=10, size=(N_STATES, 6))
+    brov = BlueROV(0.01)
+    brov_jit = BlueROV(0.01, use_jit=True)
+
+    x_dot_ref = np.array([brov.dynamics(x, u) for x, u in zip(X, U)])
+    x_dot_jit = np.array([brov_jit.dynamics(x, u) for x, u in zip(X, U)])
+
+    assert max_rel_error(x_dot_jit, x_dot_ref) < 1e-12
+
+
+def test_jit_update_dt():
+    # The compiled kernel holds its own copy of dt, used by the actuator dynamics
+    X, U = random_states(20)
+    sam = SAM(0.01)
+    sam_jit = SAM(0.01, use_jit=True)
+    sam.update_dt(0.05)
+    sam_jit.update_dt(0.05)
+
+    x_dot_ref = np.array([sam.dynamics(x, u) for x, u in zip(X, U)])
+    x_dot_jit = np.array([sam_jit.dynamics(x, u) for x, u in zip(X, U)])
+
+    assert max_rel_error(x_dot_jit, x_dot_ref) < 1e-12
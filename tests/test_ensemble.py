@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from smarc_modelling.apps.benchmark_dynamics import random_states
+from smarc_modelling.lib.integrators import rk4
+from smarc_modelling.vehicles.SAM import SAM
+from smarc_modelling.vehicles.ensemble import Ensemble
+
+DT = 0.01
+PARAMS = {
+    "m_ss": [13.0, 14.0, 15.0],
+    "inertia_factor": [2.0, 5.0, 10.0],
+    "damping_factor": [40.0, 60.0, 80.0],
+    "damping_rot": 3.0,
+    "V_current": [0.0, 0.1, 0.2],
+    "beta_current": [0.0, 45.0, -90.0],
+}
+
+
+def sam_with(params, k):
+    '''
+    A plain SAM instance with the k-th parameters of the ensemble
+    '''
+    value = {name: np.broadcast_to(params[name], 3)[k] for name in params}
+    sam = SAM(DT, V_current=value["V_current"], beta_current=value["beta_current"])
+    sam.ss.m_ss = value["m_ss"]
+    sam.inertia_factor = value["inertia_factor"]
+    sam.damping_factor = value["damping_factor"]
+    sam.damping_rot = value["damping_rot"]
+    sam.clear_inertia_cache()
+    return sam
+
+
+def test_step_matches_separate_sams():
+    X, U = random_states(3, seed=4)
+    ensemble = Ensemble(SAM(DT), PARAMS)
+
+    X_next = ensemble.step(X, U, DT)
+
+    assert ensemble.K == 3
+    for k in range(3):
+        x_ref = rk4(X[k], U[k], DT, sam_with(PARAMS, k).dynamics)
+        assert np.allclose(X_next[k], x_ref, rtol=1e-12, atol=1e-12), k
+
+
+def test_structured_params():
+    records = np.zeros(3, dtype=[("damping_factor", float), ("V_current", float)])
+    records["damping_factor"] = PARAMS["damping_factor"]
+    assert Ensemble(SAM(DT), records).K == 3
+
+
+def test_empty_params_raise():
+    with pytest.raises(ValueError, match="at least one parameter"):
+        Ensemble(SAM(DT), {})
+
+
+def test_mismatched_params_raise():
+    with pytest.raises(ValueError, match="damping_factor"):
+        Ensemble(SAM(DT), {"V_current": [0.0, 0.1, 0.2], "damping_factor": [40.0, 60.0]})
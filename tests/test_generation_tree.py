@@ -0,0 +1,31 @@
+import numpy as np
+
+# Some primitives leave the map and others reach the goal
+MAP = {"x_max": 2.5, "y_max": 1.5, "z_max": 0, "x_min": -1.5, "y_min": -1.5, "z_min": -5,
+       "start_pos": (1.0, 0, -1.0), "goal_pixel": (1.5, 0, -1.5), "TileSize": 0.5}
+
+X0 = np.array([0, 0, -1.5, 1, 0, 0, 0, 0.5, 0, 0, 0, 0, 0, 50, 50, 0, 0, 0, 0], float)
+
+
+def test_get_neighbors_with_pool_matches_serial(import_without_acados):
+    GenerationTree = import_without_acados("smarc_modelling.motion_planning.MotionPrimitives.GenerationTree")
+    sim = GenerationTree.SAM_PRIMITIVES()
+    current = GenerationTree.Node(X0)
+
+    reached, last, arrived, (final_state, final_cost) = GenerationTree.get_neighbors(current, sim, MAP, 1)
+    with GenerationTree.PrimitiveWorkerPool(MAP, n_workers=3) as pool:
+        reached_pool, last_pool, arrived_pool, (final_state_pool, final_cost_pool) = \
+            GenerationTree.get_neighbors(current, sim, MAP, 1, pool)
+
+    # Some primitives are rejected, the others are returned in the same order
+    assert 0 < len(reached) < len(GenerationTree.primitive_inputs())
+    assert len(reached_pool) == len(reached) and len(last_pool) == len(last)
+    for data, data_pool in zip(reached, reached_pool):
+        assert np.allclose(data_pool, data, rtol=1e-12, atol=1e-12)
+    for (state, cost), (state_pool, cost_pool) in zip(last, last_pool):
+        assert np.allclose(state_pool, state, rtol=1e-12, atol=1e-12)
+        assert np.isclose(cost_pool, cost, rtol=1e-12)
+
+    assert arrived and arrived_pool
+    assert np.allclose(final_state_pool, final_state, rtol=1e-12, atol=1e-12)
+    assert np.isclose(final_cost_pool, final_cost, rtol=1e-12)
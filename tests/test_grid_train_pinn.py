@@ -0,0 +1,138 @@
+import math
+import os
+import pickle
+from types import SimpleNamespace
+
+import pytest
+
+# Validation loss of every trial after 3, 5 and 9 epochs, the ranking changes after the first rung
+VAL_LOSSES = {
+    "1x4": {3: 3.0},
+    "1x8": {3: float("nan")},
+    "2x4": {3: 1.0, 5: 0.8},
+    "2x8": {3: 2.0, 5: 0.5, 9: 0.4},
+}
+SEARCH = {"max_epochs": 9, "n_rungs": 3, "eta": 2, "n_workers": 1, "verbose": False}
+
+
+def outcome(rows):
+    return [(row["trial"], row["rung"], row["epochs"], row["sim_error"]) for row in rows]
+
+
+class FakeModel:
+    '''
+    Stands in for PINN, its "weights" count the epochs it was trained for
+    '''
+    def __init__(self, shape):
+        self.name = f"{len(shape) - 2}x{shape[1]}"
+        self.epochs = 0
+
+    def state_dict(self):
+        return {"name": self.name, "epochs": self.epochs}
+
+    def load_state_dict(self, state_dict):
+        assert state_dict["name"] == self.name
+        self.epochs = state_dict["epochs"]
+
+    def eval(self):
+        pass
+
+
+class SerialPool:
+    '''
+    multiprocessing.Pool in this process, so that the monkeypatched functions are used
+    '''
+    def __init__(self, n_workers, initializer, initargs):
+        initializer(*initargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def imap_unordered(self, function, jobs):
+        return map(function, jobs)
+
+
+def pickle_load(path, weights_only=False):
+    assert weights_only
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def pickle_save(obj, path):
+    with open(path, "wb") as f:
+        pickle.dump(obj, f)
+
+
+@pytest.fixture
+def search(import_without_ros, monkeypatch):
+    '''
+    grid_train_pinn with a stubbed trainer and simulation, which record their calls
+    '''
+    grid_train_pinn = import_without_ros("smarc_modelling.piml.pinn.grid_train_pinn")
+    calls = {"train": [], "simulate": []}
+
+    def train_pinn(model, train_data, val_data, epochs, state, **settings):
+        calls["train"].append((model.name, model.epochs, epochs, dict(state)))
+        model.epochs += epochs
+        state["counter"] = state.get("counter", 0) + 1
+        return VAL_LOSSES[model.name][model.epochs]
+
+    def simulation_error(model, test):
+        calls["simulate"].append((model.name, model.epochs))
+        return 0.1 * model.epochs
+
+    monkeypatch.setattr(grid_train_pinn, "train_pinn", train_pinn)
+    monkeypatch.setattr(grid_train_pinn, "simulation_error", simulation_error)
+    monkeypatch.setattr(grid_train_pinn, "PINN", FakeModel)
+    monkeypatch.setattr(grid_train_pinn, "set_threads", lambda *args: None)
+    monkeypatch.setattr(grid_train_pinn, "load_datasets", lambda: ("train", "val", "test"))
+    monkeypatch.setattr(grid_train_pinn, "torch", SimpleNamespace(save=pickle_save, load=pickle_load))
+    monkeypatch.setattr(grid_train_pinn, "multiprocessing",
+                        SimpleNamespace(get_context=lambda method: SimpleNamespace(Pool=SerialPool)))
+    return grid_train_pinn, calls
+
+
+def test_run_search_prunes_by_validation_loss(search, tmp_path):
+    grid_train_pinn, calls = search
+    trials = grid_train_pinn.grid_trials(layers=(1, 2), sizes=(4, 8))
+
+    rows = grid_train_pinn.run_search(trials, str(tmp_path), **SEARCH)
+
+    # All trials for 3 epochs, the best half for 2 more, NaN counts as the worst, then the best one for 4 more, each
+    # continuing from the weights and the training state of its previous rung
+    assert calls["train"] == [("1x4", 0, 3, {}), ("1x8", 0, 3, {}), ("2x4", 0, 3, {}), ("2x8", 0, 3, {}),
+                              ("2x4", 3, 2, {"counter": 1}), ("2x8", 3, 2, {"counter": 1}),
+                              ("2x8", 5, 4, {"counter": 2})]
+    assert calls["simulate"] == [("2x8", 9)]
+
+    assert [(row["trial"], row["rung"], row["epochs"]) for row in rows] == [
+        ("2x8", 2, 9), ("2x4", 1, 5), ("1x4", 0, 3), ("1x8", 0, 3)]
+    assert rows[0]["val_loss"] == 0.4 and math.isclose(rows[0]["sim_error"], 0.9)
+    assert all(row["sim_error"] is None for row in rows[1:])
+    assert math.isnan(rows[3]["val_loss"])
+    assert os.path.isfile(tmp_path / "2x8_rung2.pt") and not os.path.exists(tmp_path / "2x4_rung2.pt")
+
+
+def test_run_search_resumes_after_the_finished_rungs(search, tmp_path):
+    grid_train_pinn, calls = search
+    trials = grid_train_pinn.grid_trials(layers=(1, 2), sizes=(4, 8))
+    rows = grid_train_pinn.run_search(trials, str(tmp_path), **SEARCH)
+
+    # Interrupted during rung 1: the first rung and half of a line of the next are in the results
+    path = tmp_path / "results.jsonl"
+    lines = path.read_text().splitlines(keepends=True)
+    path.write_text("".join(lines[:4]) + lines[4][:20])
+    calls["train"].clear()
+    calls["simulate"].clear()
+
+    assert outcome(grid_train_pinn.run_search(trials, str(tmp_path), **SEARCH)) == outcome(rows)
+    assert [call[0:3] for call in calls["train"]] == [("2x4", 3, 2), ("2x8", 3, 2), ("2x8", 5, 4)]
+    assert calls["simulate"] == [("2x8", 9)]
+
+    # Nothing left to run
+    calls["train"].clear()
+    assert outcome(grid_train_pinn.run_search(trials, str(tmp_path), **SEARCH)) == outcome(rows)
+    assert calls["train"] == []
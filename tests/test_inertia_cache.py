@@ -0,0 +1,92 @@
+import numpy as np
+
+from smarc_modelling.apps.benchmark_dynamics import random_states
+from smarc_modelling.lib.gnc import inverse_3x3
+from smarc_modelling.vehicles.SAM import SAM
+
+N_STATES = 100
+
+
+def uncached(sam, x, u):
+    '''
+    The mass matrices of a state, computed with an empty cache
+    '''
+    sam.clear_inertia_cache()
+    sam.dynamics(x, u)
+    return sam.M.copy(), sam.Minv.copy()
+
+
+def test_inverse_3x3_matches_numpy():
+    rng = np.random.default_rng(0)
+    for _ in range(100):
+        A = rng.normal(size=(3, 3)) + 3*np.eye(3)
+        A_inv = np.linalg.inv(A)
+        assert np.max(np.abs(inverse_3x3(A) - A_inv)) < 1e-12 * np.max(np.abs(A_inv)) * np.linalg.cond(A)
+
+
+def test_minv_matches_numpy():
+    X, U = random_states(N_STATES)
+    sam = SAM(0.01)
+    for x, u in zip(X, U):
+        sam.dynamics(x, u)
+        assert np.allclose(sam.Minv, np.linalg.inv(sam.M), rtol=1e-12, atol=1e-14)
+
+
+def test_cached_matrices_equal_uncached():
+    X, U = random_states(N_STATES)
+    sam = SAM(0.01)
+    reference = SAM(0.01)
+
+    # Evaluate every state twice, the second time from the cache
+    for _ in range(2):
+        for x, u in zip(X, U):
+            sam.dynamics(x, u)
+            M, Minv = uncached(reference, x, u)
+            assert np.array_equal(sam.M, M)
+            assert np.array_equal(sam.Minv, Minv)
+    assert 0 < len(sam.inertia_cache) <= sam.inertia_cache_size
+
+
+def test_cached_matrices_are_read_only():
+    X, U = random_states(1)
+    sam = SAM(0.01)
+    sam.dynamics(X[0], U[0])
+    sam.dynamics(X[0], U[0])
+    assert not sam.M.flags.writeable and not sam.J_total.flags.writeable
+
+
+def test_clear_inertia_cache_invalidates():
+    X, U = random_states(1)
+    sam = SAM(0.01)
+    sam.dynamics(X[0], U[0])
+    M_before = sam.M.copy()
+
+    # A parameter that is not part of the cache key, the cached matrices go stale until the cache is cleared
+    sam.lcg.m_lcg *= 2
+    sam.dynamics(X[0], U[0])
+    assert np.array_equal(sam.M[3:6, 3:6], M_before[3:6, 3:6])
+
+    sam.clear_inertia_cache()
+    sam.dynamics(X[0], U[0])
+    reference = SAM(0.01)
+    reference.lcg.m_lcg *= 2
+    M, Minv = uncached(reference, X[0], U[0])
+    assert not np.array_equal(sam.M, M_before)
+    assert np.array_equal(sam.M, M) and np.array_equal(sam.Minv, Minv)
+
+
+def test_inertia_cache_resolution_bound():
+    X, U = random_states(N_STATES)
+    for resolution in (1e-4, 1e-3):
+        sam = SAM(0.01)
+        quantized = SAM(0.01)
+        quantized.inertia_cache_resolution = resolution
+        dm_max = sam.rho_w * np.pi * sam.vbs.r_vbs**2 * resolution / 2
+
+        for x, u in zip(X, U):
+            sam.dynamics(x, u)
+            quantized.dynamics(x, u)
+            assert abs(quantized.x_vbs - sam.x_vbs) <= resolution/2 + 1e-15
+            assert abs(quantized.p_OLcg_O[0] - sam.p_OLcg_O[0]) <= resolution/2 + 1e-15
+            assert abs(quantized.m - sam.m) <= dm_max + 1e-12
+            assert np.max(np.abs(quantized.M[0:3, 0:3] - sam.M[0:3, 0:3])) <= (1 + max(sam.k1, sam.k2)) * dm_max + 1e-12
@@ -0,0 +1,113 @@
+import numpy as np
+import pytest
+from scipy.integrate import solve_ivp
+
+from smarc_modelling.lib.integrators import dopri5_dense, dopri5_step, simulate
+from smarc_modelling.vehicles.SAM import SAM
+
+
+def linear(x, u):
+    return -x + u
+
+
+def test_shared_per_step_input_batched():
+    x0 = np.zeros((3, 2))
+    u = np.arange(10.0)[:, None] * np.ones(2)
+    X = simulate(linear, x0, u, 0.1, 11, method="euler")
+    x_ref = simulate(linear, x0[0], u, 0.1, 11, method="euler")
+    for k in range(3):
+        assert np.array_equal(X[:, k], x_ref)
+
+
+def test_constant_per_instance_input_batched():
+    x0 = np.zeros((3, 2))
+    u = np.array([[1.0, 1.0], [2.0, 2.0], [3.0, 3.0]])
+    X = simulate(linear, x0, u, 0.1, 11, method="euler")
+    for k in range(3):
+        assert np.array_equal(X[:, k], simulate(linear, x0[k], u[k], 0.1, 11, method="euler"))
+
+
+def test_ambiguous_input_needs_per_step():
+    x0 = np.zeros((3, 2))
+    u = np.ones((3, 2))
+    with pytest.raises(ValueError):
+        simulate(linear, x0, u, 0.1, 4)
+    X_const = simulate(linear, x0, u, 0.1, 4, per_step=False)
+    X_step = simulate(linear, x0, u, 0.1, 4, per_step=True)
+    assert np.allclose(X_const, X_step)
+
+
+def test_input_length_checked():
+    with pytest.raises(ValueError):
+        simulate(linear, np.zeros(2), np.ones((5, 2)), 0.1, 11)
+    with pytest.raises(ValueError):
+        simulate(linear, np.zeros((3, 2)), np.ones((5, 2)), 0.1, 11)
+
+
+def sam_case():
+    x0 = np.zeros(19)
+    x0[2] = -1
+    x0[3] = 1.0
+    x0[13] = 50
+    x0[14] = 50
+    u = np.array([60, 40, np.deg2rad(7), -np.deg2rad(7), 1000, 1000])
+    return x0, u
+
+
+def old_rk4(x, u, dt, fun):
+    '''
+    The RK4 step of sam_sim.py before lib/integrators.py
+    '''
+    k1 = fun(x, u)
+    k2 = fun(x+dt/2*k1, u)
+    k3 = fun(x+dt/2*k2, u)
+    k4 = fun(x+dt*k3, u)
+
+    x_t = x + dt/6 * (k1 + 2*k2 + 2*k3 + k4)
+
+    return x_t
+
+
+def test_rk4_matches_old_sam_sim_loop():
+    x0, u = sam_case()
+    sam = SAM(0.02)
+    n_sim = 200
+
+    data = np.empty((len(x0), n_sim))
+    data[:, 0] = x0
+    for i in range(n_sim-1):
+        data[:, i+1] = old_rk4(data[:, i], u, 0.02, sam.dynamics)
+
+    assert np.array_equal(simulate(sam.dynamics, x0, u, 0.02, n_sim, method="rk4"), data.T)
+
+
+@pytest.mark.parametrize("per_step", [False, True])
+def test_rk45_matches_tight_reference_on_sam(per_step):
+    x0, u = sam_case()
+    dt = 0.1
+    n_steps = 51
+    sam = SAM(dt)
+    t_eval = np.arange(n_steps) * dt
+    x_ref = solve_ivp(lambda t, x: sam.dynamics(x, u), (0, t_eval[-1]), x0, method="DOP853",
+                      rtol=1e-12, atol=1e-12, t_eval=t_eval).y.T
+
+    u_sim = np.tile(u, (n_steps - 1, 1)) if per_step else u
+    X = simulate(sam.dynamics, x0, u_sim, dt, n_steps, method="rk45", update_dt=sam.update_dt)
+
+    assert np.max(np.abs(X - x_ref) / (1 + np.abs(x_ref))) < 1e-4
+
+
+def test_dopri5_dense_output_is_4th_order():
+    # Local error of the dense output inside one step on x' = -x, O(h**5)
+    fun = lambda x, u: -x
+    errors = []
+    for h in (0.4, 0.2):
+        x0 = np.array([1.0])
+        _, K, _ = dopri5_step(x0, None, h, fun, fun(x0, None))
+        t = np.linspace(0, h, 11)
+        x = np.array([dopri5_dense(ti, 0, h, x0, K) for ti in t])[:, 0]
+        errors.append(np.max(np.abs(x - np.exp(-t))))
+        # It ends in the step result
+        assert np.allclose(dopri5_dense(h, 0, h, x0, K), x0 + h * (K[0:6].T @ [35/384, 0, 500/1113, 125/192, -2187/6784, 11/84]))
+
+    assert errors[0] / errors[1] > 2**4.5
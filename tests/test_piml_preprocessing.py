@@ -0,0 +1,237 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from smarc_modelling.vehicles.SAM import SAM
+
+N_SAMPLES = 300
+
+
+@pytest.fixture
+def utility_functions(import_without_ros):
+    return import_without_ros("smarc_modelling.piml.utils.utility_functions")
+
+
+def synthetic_log(n=N_SAMPLES, seed=3):
+    '''
+    A log in the layout of load_rosbag(): time (n,), eta (7, n), nu (6, n), acc (6, n), u_cmd (6, n), u_fb (6, n)
+    '''
+    rng = np.random.default_rng(seed)
+    time = 100 + np.cumsum(rng.uniform(0.005, 0.015, n))
+    q = rng.normal(size=(n, 4))
+    q /= np.linalg.norm(q, axis=1)[:, None]
+    eta = np.column_stack([rng.normal(size=(n, 3)), q])
+    nu = rng.normal(size=(n, 6)) * 0.5
+    acc = np.gradient(nu, time, axis=0)
+    u_fb = np.column_stack([rng.uniform(0, 100, (n, 2)), rng.normal(size=(n, 2)) * 0.1,
+                            rng.integers(-1500, 1500, (n, 2))])
+    u_cmd = np.column_stack([rng.uniform(-10, 110, (n, 2)), rng.normal(size=(n, 2)) * 0.1,
+                             rng.integers(-1500, 1500, (n, 2))])
+    return time, eta.T, nu.T, acc.T, u_cmd.T, u_fb.T
+
+
+def reference_terms(time, eta, nu, acc, u_cmd, u_fb):
+    '''
+    The physics loss terms with one sam.dynamics() call per sample, as load_data_from_bag computed them before
+    '''
+    time, eta, nu, acc, u_cmd, u_fb = [np.transpose(x) for x in (time, eta, nu, acc, u_cmd, u_fb)]
+    state_vector = np.concatenate([eta, nu, u_fb], axis=1)
+
+    dt_vec = np.diff(time)
+    sam = SAM(dt_vec[0])
+    terms = {name: np.zeros_like(nu) for name in ("Dv_comp", "Mv_dot", "Cv", "g_eta", "tau")}
+    for t in range(len(state_vector)):
+        sam.update_dt(dt_vec[t] if t < len(dt_vec) else np.mean(dt_vec))
+        sam.dynamics(state_vector[t], u_cmd[t])
+
+        v_dot_nod = sam.Minv @ (sam.tau - sam.C @ nu[t] - sam.g_vec)
+        terms["Dv_comp"][t] = sam.M @ (v_dot_nod - acc[t])
+        terms["Mv_dot"][t] = sam.M @ acc[t]
+        terms["Cv"][t] = sam.C @ nu[t]
+        terms["g_eta"][t] = sam.g_vec
+        terms["tau"][t] = sam.tau
+
+    return terms
+
+
+def max_rel_error(x, x_ref):
+    '''
+    Max. deviation from the reference, relative to the norm of the reference row
+    '''
+    return np.max(np.linalg.norm(x - x_ref, axis=-1) / np.linalg.norm(x_ref, axis=-1))
+
+
+def test_load_data_from_bag_matches_per_sample_loop(utility_functions, monkeypatch):
+    log = synthetic_log()
+    monkeypatch.setattr(utility_functions, "load_rosbag", lambda *args, **kwargs: log)
+
+    data = dict(zip(utility_functions.DATASET_FIELDS, utility_functions.load_data_from_bag("synthetic", cache=False)))
+    reference = reference_terms(*log)
+
+    for name, x_ref in reference.items():
+        assert data[name].dtype == np.float64
+        assert max_rel_error(data[name], x_ref) < 1e-12, name
+    assert np.array_equal(data["time"], log[0] - log[0][0])
+    assert np.array_equal(data["u_fb"], log[5].T)
+
+
+def test_calculate_terms_batch_matches_dynamics():
+    time, eta, nu, acc, u_cmd, u_fb = synthetic_log(50)
+    X = np.concatenate([eta, nu, u_fb]).T
+    U = u_cmd.T
+
+    terms = SAM(0.01).calculate_terms_batch(X, U)
+    sam = SAM(0.01)
+    for k in range(len(X)):
+        sam.dynamics(X[k], U[k])
+        for name, attribute in (("M", "M"), ("C", "C"), ("g_vec", "g_vec"), ("tau", "tau")):
+            assert max_rel_error(terms[name][k], getattr(sam, attribute)) < 1e-12, name
+
+
+def test_dataset_cache_follows_the_sam_parameters_and_the_bag(utility_functions, monkeypatch, tmp_path):
+    bag = tmp_path / "bag.db3"
+    bag.write_bytes(b"first recording")
+    monkeypatch.setattr(utility_functions, "DATASET_CACHE_DIR", str(tmp_path / "cache"))
+    log = synthetic_log(50)
+    loads = []
+    monkeypatch.setattr(utility_functions, "load_rosbag", lambda *args, **kwargs: loads.append(args) or log)
+    sam = SAM(0.01)
+
+    def load():
+        data = dict(zip(utility_functions.DATASET_FIELDS, utility_functions.load_data_from_bag(str(bag), sam=sam)))
+        return utility_functions.dataset_key(str(bag), sam, np.float64), data
+
+    key, data = load()
+    assert len(loads) == 1 and (tmp_path / "cache" / key).is_dir()
+    assert (tmp_path / "cache" / "bag_hashes.json").is_file()
+
+    # Unchanged, from the cache
+    assert load()[0] == key and len(loads) == 1
+
+    # Every parameter change is processed anew, and going back finds the first dataset again
+    keys = {key}
+    for name, value in (("damping_factor", 2 * sam.damping_factor), ("inertia_factor", 2 * sam.inertia_factor)):
+        default = getattr(sam, name)
+        setattr(sam, name, value)
+        new_key, _ = load()
+        assert new_key not in keys and len(loads) == len(keys) + 1, name
+        keys.add(new_key)
+        setattr(sam, name, default)
+
+    key_again, data_again = load()
+    assert key_again == key and len(loads) == 3
+    for name in utility_functions.DATASET_FIELDS:
+        assert np.array_equal(data_again[name], data[name]), name
+
+    # A new recording in the same file
+    bag.write_bytes(b"second recording")
+    assert load()[0] not in keys and len(loads) == 4
+
+
+def synched_message(rng):
+    '''
+    A /synched_data message with a different value in every field
+    '''
+    def value():
+        return SimpleNamespace(value=rng.normal())
+
+    def stamped():
+        return SimpleNamespace(value=rng.normal(), header=SimpleNamespace(stamp=SimpleNamespace(
+            sec=int(rng.integers(100, 200)), nanosec=int(rng.integers(0, 10**9)))))
+
+    def xyz(**extra):
+        return SimpleNamespace(x=rng.normal(), y=rng.normal(), z=rng.normal(), **extra)
+
+    def rpm():
+        return SimpleNamespace(rpm=rng.normal())
+
+    pose = SimpleNamespace(pose=SimpleNamespace(position=xyz(), orientation=xyz(w=rng.normal())))
+    twist = SimpleNamespace(twist=SimpleNamespace(linear=xyz(), angular=xyz()))
+    return SimpleNamespace(
+        lcg_cmd=stamped(), lcg_fb=value(), vbs_cmd=value(), vbs_fb=value(),
+        thrust_vector_cmd=SimpleNamespace(thruster_vertical_radians=rng.normal(),
+                                          thruster_horizontal_radians=rng.normal()),
+        thruster1_cmd=rpm(), thruster1_fb=SimpleNamespace(rpm=rpm()),
+        thruster2_cmd=rpm(), thruster2_fb=SimpleNamespace(rpm=rpm()),
+        odom_gt=SimpleNamespace(pose=pose, twist=twist))
+
+
+def list_based_rosbag(messages):
+    '''
+    The outputs of load_rosbag() from the messages, one list per signal as the loader appended them before
+    '''
+    time = [msg.lcg_cmd.header.stamp.sec + msg.lcg_cmd.header.stamp.nanosec * 1e-9 for msg in messages]
+    pose = [msg.odom_gt.pose.pose for msg in messages]
+    twist = [msg.odom_gt.twist.twist for msg in messages]
+    eta = [[p.position.x for p in pose], [p.position.y for p in pose], [p.position.z for p in pose],
+           [p.orientation.x for p in pose], [p.orientation.y for p in pose], [p.orientation.z for p in pose],
+           [p.orientation.w for p in pose]]
+    nu = [[t.linear.x for t in twist], [t.linear.y for t in twist], [t.linear.z for t in twist],
+          [t.angular.x for t in twist], [t.angular.y for t in twist], [t.angular.z for t in twist]]
+    acc = [np.gradient(x, time) for x in nu]
+    dS = [msg.thrust_vector_cmd.thruster_vertical_radians for msg in messages]
+    dR = [msg.thrust_vector_cmd.thruster_horizontal_radians for msg in messages]
+    rpm1_cmd = [msg.thruster1_cmd.rpm for msg in messages]
+    rpm2_cmd = [msg.thruster2_cmd.rpm for msg in messages]
+    u_control = [[msg.vbs_cmd.value for msg in messages], [msg.lcg_cmd.value for msg in messages], dS, dR, rpm1_cmd,
+                 rpm2_cmd]
+    u_control_ref = [[msg.vbs_fb.value for msg in messages], [msg.lcg_fb.value for msg in messages], dS, dR, rpm1_cmd,
+                     rpm2_cmd]
+    return time, eta, nu, acc, u_control, u_control_ref
+
+
+class FakeReader:
+    '''
+    rosbag2_py.SequentialReader of a bag with the given messages, and message_count in its metadata
+    '''
+    def __init__(self, messages, message_count):
+        self.messages = list(messages)
+        self.message_count = message_count
+
+    def open(self, storage_options, converter_options):
+        pass
+
+    def set_filter(self, storage_filter):
+        pass
+
+    def get_all_topics_and_types(self):
+        return [SimpleNamespace(name="/synched_data", type="piml_msgs/msg/SynchedData")]
+
+    def get_metadata(self):
+        topic = SimpleNamespace(topic_metadata=SimpleNamespace(name="/synched_data"), message_count=self.message_count)
+        return SimpleNamespace(topics_with_message_count=[topic])
+
+    def has_next(self):
+        return bool(self.messages)
+
+    def read_next(self):
+        return "/synched_data", self.messages.pop(0), 0
+
+
+@pytest.mark.parametrize("message_count", [0, 7, 40, 100])
+def test_read_synched_data_matches_list_based_loader(utility_functions, monkeypatch, tmp_path, message_count):
+    rng = np.random.default_rng(5)
+    messages = [synched_message(rng) for _ in range(40)]
+    messages.sort(key=lambda msg: (msg.lcg_cmd.header.stamp.sec, msg.lcg_cmd.header.stamp.nanosec))
+    readers = []
+
+    def sequential_reader():
+        readers.append(FakeReader(messages, message_count))
+        return readers[-1]
+
+    monkeypatch.setattr(utility_functions, "rosbag2_py", SimpleNamespace(
+        StorageOptions=lambda **kwargs: None, ConverterOptions=lambda *args: None,
+        StorageFilter=lambda **kwargs: None, SequentialReader=sequential_reader))
+    monkeypatch.setattr(utility_functions, "get_message", lambda name: None)
+    monkeypatch.setattr(utility_functions, "deserialize_message", lambda data, msg_class: data)
+    bag = tmp_path / "bag.db3"
+    bag.write_bytes(b"")
+
+    reference = list_based_rosbag(messages)
+    for cache in (False, True, True):
+        for x, x_ref in zip(utility_functions.load_rosbag(str(bag), cache), reference):
+            assert np.array_equal(x, np.array(x_ref))
+
+    # Read once without and once with the cache, then loaded from the cache
+    assert len(readers) == 2
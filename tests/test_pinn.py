@@ -0,0 +1,163 @@
+import numpy as np
+import pytest
+
+LAYER_SIZES = [19, 8, 5, 36]
+
+
+@pytest.fixture
+def pinn(import_without_ros):
+    return import_without_ros("smarc_modelling.piml.pinn.pinn")
+
+
+def random_state_dict(seed=0):
+    '''
+    A state_dict of NumPy arrays in the layout of PINN, weights as (out, in)
+    '''
+    rng = np.random.default_rng(seed)
+    state_dict = {}
+    for i, (n_in, n_out) in enumerate(zip(LAYER_SIZES[:-1], LAYER_SIZES[1:])):
+        state_dict[f"layers.{i}.weight"] = rng.normal(size=(n_out, n_in)) / np.sqrt(n_in)
+        state_dict[f"layers.{i}.bias"] = rng.normal(size=n_out) * 0.1
+    return state_dict
+
+
+def forward(state_dict, x):
+    '''
+    The forward pass of PINN for a single (19,) state, written out layer by layer
+    '''
+    h = np.maximum(state_dict["layers.0.weight"] @ x + state_dict["layers.0.bias"], 0)
+    h = np.maximum(state_dict["layers.1.weight"] @ h + state_dict["layers.1.bias"], 0)
+    A = (state_dict["layers.2.weight"] @ h + state_dict["layers.2.bias"]).reshape(6, 6)
+    return A @ A.T
+
+
+def random_inputs(n, seed=1):
+    return np.random.default_rng(seed).normal(size=(n, 19))
+
+
+def test_inference_of_a_numpy_state_dict(pinn):
+    state_dict = random_state_dict()
+    x = random_inputs(10)
+    model = pinn.PINNInference(state_dict)
+
+    D = model(x)
+
+    assert D.shape == (10, 6, 6) and model(x[0]).shape == (6, 6)
+    for k in range(10):
+        D_ref = forward(state_dict, x[k])
+        assert np.allclose(D[k], D_ref, rtol=1e-12, atol=1e-12)
+        assert np.allclose(model(x[k]), D_ref, rtol=1e-12, atol=1e-12)
+        assert np.allclose(D[k], D[k].T) and np.all(np.linalg.eigvalsh(D[k]) > -1e-12)
+
+    # The weights are copies, changing the state_dict afterwards does not change the model
+    state_dict["layers.0.bias"] += 1
+    assert np.array_equal(model(x), D)
+
+
+def test_pinn_predict_with_inference(pinn):
+    state_dict = random_state_dict()
+    x = random_inputs(1)[0]
+    model = pinn.PINNInference(state_dict)
+
+    D = pinn.pinn_predict(model, x[0:7], x[7:13].reshape(6, 1), x[13:19])
+
+    assert np.array_equal(D, model(x))
+
+
+def test_inference_matches_torch(torch, pinn):
+    torch.manual_seed(0)
+    model = pinn.PINN(LAYER_SIZES)
+    model.eval()
+    x = random_inputs(10).astype(np.float32)
+
+    with torch.no_grad():
+        D_ref = model(torch.tensor(x)).numpy()
+    D = pinn.PINNInference(model)(x)
+
+    assert D.shape == D_ref.shape == (10, 6, 6)
+    assert np.allclose(D, D_ref, rtol=1e-5, atol=1e-6)
+    for k in range(10):
+        D_predict = pinn.pinn_predict(model, x[k, 0:7], x[k, 7:13], x[k, 13:19])
+        assert np.allclose(pinn.pinn_predict(pinn.PINNInference(model), x[k, 0:7], x[k, 7:13], x[k, 13:19]),
+                           D_predict, rtol=1e-5, atol=1e-6)
+
+
+def synthetic_data(torch, n, seed):
+    '''
+    A tiny (x, Dv_comp, Mv_dot, Cv, g_eta, tau, nu) dataset in the layout train_pinn takes
+    '''
+    generator = torch.Generator().manual_seed(seed)
+    x = torch.randn(n, 19, generator=generator)
+    terms = [torch.randn(n, 6, generator=generator) for _ in range(5)]
+    return (x, *terms, x[:, 7:13].clone())
+
+
+class ScriptedLoss:
+    '''
+    loss_function for train_pinn, the training batches get the real loss and the validations the given losses in turn.
+    The weights are copied at every new best validation loss.
+    '''
+    def __init__(self, torch, loss_function, val_losses):
+        self.torch = torch
+        self.loss_function = loss_function
+        self.val_losses = list(val_losses)
+        self.batch_sizes = []
+        self.best = float("inf")
+        self.best_weights = None
+
+    def __call__(self, model, *batch):
+        if self.torch.is_grad_enabled():
+            self.batch_sizes.append(len(batch[0]))
+            return self.loss_function(model, *batch)
+        value = self.val_losses.pop(0)
+        if value < self.best:
+            self.best = value
+            self.best_weights = {name: w.clone() for name, w in model.state_dict().items()}
+        return self.torch.tensor(value)
+
+
+@pytest.mark.parametrize("batch_size, batches", [(None, [20]), (8, [8, 8, 4]), (50, [20])])
+def test_train_pinn_batches(torch, pinn, monkeypatch, batch_size, batches):
+    torch.manual_seed(0)
+    model = pinn.PINN(LAYER_SIZES)
+    loss = ScriptedLoss(torch, pinn.loss_function, [1.0, 0.5, 0.25])
+    monkeypatch.setattr(pinn, "loss_function", loss)
+
+    best, log = pinn.train_pinn(model, synthetic_data(torch, 20, 1), synthetic_data(torch, 5, 2), epochs=3,
+                                lr=1e-3, batch_size=batch_size, log_every=1000, history=True)
+
+    # Every sample once per epoch, in shuffled mini-batches
+    assert sorted(loss.batch_sizes) == sorted(batches * 3)
+    assert best == 0.25 and log["val_epoch"] == [0, 1, 2] and len(log["loss"]) == len(log["lr"]) == 3
+    assert all(np.isfinite(log["loss"]))
+
+
+def test_train_pinn_early_stopping_restores_the_best_weights(torch, pinn, monkeypatch, tmp_path):
+    torch.manual_seed(0)
+    model = pinn.PINN(LAYER_SIZES)
+    train_data, val_data = synthetic_data(torch, 20, 1), synthetic_data(torch, 5, 2)
+    loss = ScriptedLoss(torch, pinn.loss_function, [3.0, 2.0, 2.5, 2.5, 2.5, 2.5])
+    monkeypatch.setattr(pinn, "loss_function", loss)
+    state = {}
+
+    best, log = pinn.train_pinn(model, train_data, val_data, epochs=100, lr=0.1, val_every=2, patience=4,
+                                log_every=1000, history=True, state=state)
+
+    # Validated every other epoch, the counter goes up by val_every without improvement
+    assert best == 2.0 and log["val_epoch"] == [0, 2, 4, 6] and len(log["loss"]) == 7
+    assert state["best_val_loss"] == 2.0 and state["counter"] == 4
+
+    # The weights of epoch 2, not the ones trained further until the stop
+    weights = model.state_dict()
+    assert all(torch.equal(weights[name], w) for name, w in loss.best_weights.items())
+
+    # The state is plain tensors and numbers, and training continues from it
+    torch.save(state, tmp_path / "state.pt")
+    loaded = torch.load(tmp_path / "state.pt", weights_only=True)
+    assert loaded["best_val_loss"] == 2.0 and loaded["counter"] == 4
+    assert loaded["optimizer"]["param_groups"] == state["optimizer"]["param_groups"]
+
+    loss.val_losses = [2.5]
+    best = pinn.train_pinn(model, train_data, val_data, epochs=1, lr=0.1, patience=100, log_every=1000,
+                           state=loaded)
+    assert best == 2.0 and loaded["counter"] == 5
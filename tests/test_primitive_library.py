@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+
+from smarc_modelling.motion_planning.MotionPrimitives.MotionPrimitives import SAM_PRIMITIVES, primitive_inputs
+from smarc_modelling.motion_planning.MotionPrimitives.PrimitiveLibrary import (FEATURE_NAMES, PrimitiveLibrary,
+                                                                               grid_states, reached_states,
+                                                                               state_features, transform_primitives)
+
+# Large enough that no primitive leaves the map or arrives at the goal
+MAP = {"x_max": 100, "y_max": 100, "z_max": 50, "x_min": -100, "y_min": -100, "z_min": -100,
+       "start_pos": (0, 0, -1.5), "goal_pixel": (90, 90, -90), "TileSize": 0.5}
+
+# Bound of the position error of the library primitives for states anywhere in their cell with the default resolution,
+# in m. Half a map tile.
+POSITION_ERROR = 0.25
+
+
+@pytest.fixture(scope="module")
+def sim():
+    return SAM_PRIMITIVES()
+
+
+def place(state, position, yaw):
+    return transform_primitives(state, position, yaw)
+
+
+def off_center_state(library, cell, rng):
+    '''
+    A random state in the grid cell, away from its center
+    '''
+    features = np.array(cell) * np.where(np.isinf(library.resolution), 0, library.resolution)
+    features += np.where(np.isinf(library.resolution), 0, rng.uniform(-0.45, 0.45, len(FEATURE_NAMES)) * library.resolution)
+    return grid_states(**dict(zip(FEATURE_NAMES, features)))[0]
+
+
+def reference_primitives(sim, state):
+    sim.computePrimitiveLength(0.0)
+    data, _, inObs, arrived = sim.curvePrimitives_batch(state, primitive_inputs(), MAP, 0.0, 1)
+    assert not inObs.any() and not arrived.any()
+    return data
+
+
+def test_cell_center_matches_rollout(sim):
+    library = PrimitiveLibrary(sim, primitive_inputs(), lazy=True)
+    center = library.cell_state(library.cell(grid_states(theta=0.1, u=0.5, vbs=30, rpm1=400, rpm2=400)[0]))
+    state = place(center, [1.0, -2.0, -3.0], 0.7)
+
+    data = reference_primitives(sim, state)
+    primitives = library.get_primitives(state)[:, 0:data.shape[1]]
+
+    assert np.max(np.abs(primitives - data)) < 1e-4
+
+
+def test_off_center_states_are_reanchored(sim):
+    library = PrimitiveLibrary(sim, primitive_inputs(), lazy=True)
+    rng = np.random.default_rng(0)
+    center = grid_states(theta=0.1, u=0.5, vbs=30, lcg=60, rpm1=400, rpm2=400)[0]
+
+    for _ in range(3):
+        state = place(off_center_state(library, library.cell(center), rng), [1.0, -2.0, -3.0], rng.uniform(-np.pi, np.pi))
+        assert library.cell(state) == library.cell(center)
+
+        data = reference_primitives(sim, state)
+        primitives = library.get_primitives(state)[:, 0:data.shape[1]]
+
+        # Exact start and actuators, the reference input is rolled out exactly and the others do not jump after the
+        # first row: one step only differs by the change of the input effect across the cell
+        assert np.array_equal(primitives[:, 0], np.broadcast_to(state, primitives[:, 0].shape))
+        assert np.max(np.abs(primitives[..., 13:19] - data[..., 13:19])) < 1e-9
+        assert np.max(np.abs(primitives[:, 1] - data[:, 1])) < 0.05
+        assert np.max(np.abs(primitives[library.reference] - data[library.reference])) < 1e-4
+        assert np.max(np.abs(primitives[..., 0:3] - data[..., 0:3])) < POSITION_ERROR
+
+
+def test_library_of_reached_states_is_hit_by_later_expansions(sim):
+    # Only the cells matter here, a few inputs keep building the library cheap
+    library = PrimitiveLibrary(sim, primitive_inputs()[::100])
+    rng = np.random.default_rng(1)
+
+    # Library over the children of the root, as apps/primitive_library.py builds it
+    children = reached_states(sim, grid_states(), primitive_inputs())
+    library.build(children)
+    assert len(library) < len(children) / 4
+
+    # Most grandchildren, reached by expanding a few children, are already in the library
+    grandchildren = reached_states(sim, children[rng.choice(len(children), 3, replace=False)], primitive_inputs())
+    grandchildren = grandchildren[rng.choice(len(grandchildren), 200, replace=False)]
+    hits = [library.get_primitives(state) is not None for state in grandchildren]
+    assert np.mean(hits) > 0.5
+
+
+def test_features_of_placed_states(sim):
+    state = grid_states(phi=0.1, theta=-0.2, u=0.3, vbs=20)[0]
+    placed = place(state, [5.0, 1.0, -2.0], 2.0)
+    assert np.allclose(state_features(placed), state_features(state))
@@ -0,0 +1,110 @@
+import numpy as np
+import pytest
+
+from smarc_modelling.motion_planning.MotionPrimitives.MotionPrimitives import SAM_PRIMITIVES, primitive_inputs
+from smarc_modelling.motion_planning.MotionPrimitives.ObstacleChecker import (IsOutsideTheMap, IsOutsideTheMap_batch,
+                                                                              arrived, arrived_batch,
+                                                                              compute_A_point_forward,
+                                                                              compute_AB_points_batch,
+                                                                              compute_B_point_backward)
+
+# Small enough that some primitives leave the map, with the goal (tree 1) and the start (tree 2) on the way of others
+MAP = {"x_max": 2.5, "y_max": 1.5, "z_max": 0, "x_min": -1.5, "y_min": -1.5, "z_min": -5,
+       "start_pos": (1.0, 0, -1.0), "goal_pixel": (1.5, 0, -1.5), "TileSize": 0.5}
+
+# No primitive leaves it or arrives anywhere
+LARGE_MAP = {"x_max": 100, "y_max": 100, "z_max": 50, "x_min": -100, "y_min": -100, "z_min": -100,
+             "start_pos": (90, 90, -90), "goal_pixel": (90, 90, -90), "TileSize": 0.5}
+
+X0 = np.array([0, 0, -1.5, 1, 0, 0, 0, 0.5, 0, 0, 0, 0, 0, 50, 50, 0, 0, 0, 0], float)
+
+
+@pytest.fixture(scope="module")
+def sim():
+    return SAM_PRIMITIVES()
+
+
+def loop_primitives(sim, x0, inputs, map_instance, angle, numberTree):
+    '''
+    One curvePrimitives call per input, as the search ran them before
+    '''
+    inputLen = inputs.shape[1]
+    results = []
+    for inputs_ii in inputs:
+        data, cost, inObs, arrivedPoint, _ = sim.curvePrimitives(x0, inputs_ii[0:inputLen//2], inputs_ii[inputLen//2:],
+                                                                 map_instance, angle, numberTree)
+        results.append((np.transpose(data), cost, inObs, arrivedPoint))
+    return results
+
+
+def assert_matches_loop(data, cost, inObs, arrivedPoint, reference):
+    assert inObs.any() and arrivedPoint.any() and not (inObs | arrivedPoint).all()
+    for j, (data_ref, cost_ref, inObs_ref, arrived_ref) in enumerate(reference):
+        assert inObs[j] == inObs_ref, j
+        if inObs_ref:
+            continue
+        assert arrivedPoint[j] == arrived_ref, j
+        assert np.allclose(data[j], data_ref, rtol=1e-10, atol=1e-12), j
+        assert np.isclose(cost[j], cost_ref, rtol=1e-10), j
+
+
+@pytest.mark.parametrize("numberTree", [1, 2])
+def test_curve_primitives_batch_matches_loop(sim, numberTree):
+    inputs = primitive_inputs()[::7]
+    reference = loop_primitives(sim, X0, inputs, MAP, 0.0, numberTree)
+
+    data, cost, inObs, arrivedPoint = sim.curvePrimitives_batch(X0, inputs, MAP, 0.0, numberTree)
+
+    assert data.shape == (len(inputs), sim.n_sim, 19)
+    assert_matches_loop(data, cost, inObs, arrivedPoint, reference)
+
+
+def test_curve_primitives_batch_length_follows_angle(sim):
+    inputs = primitive_inputs()[::50]
+    reference = loop_primitives(sim, X0, inputs, MAP, 0.6, 1)
+
+    data, cost, inObs, arrivedPoint = sim.curvePrimitives_batch(X0, inputs, MAP, 0.6, 1)
+
+    assert data.shape[1] == sim.n_sim < 30
+    for j, (data_ref, cost_ref, inObs_ref, _) in enumerate(reference):
+        assert inObs[j] == inObs_ref
+        if not inObs_ref:
+            assert np.allclose(data[j], data_ref, rtol=1e-10, atol=1e-12)
+            assert np.isclose(cost[j], cost_ref, rtol=1e-10)
+
+
+@pytest.mark.parametrize("numberTree", [1, 2])
+def test_check_primitives_batch_matches_loop(sim, numberTree):
+    inputs = primitive_inputs()[::7]
+    reference = loop_primitives(sim, X0, inputs, MAP, 0.0, numberTree)
+
+    # Simulated without any check, then checked at once as for the primitives of the library
+    rollouts, _, inObs, arrivedPoint = sim.curvePrimitives_batch(X0, inputs, LARGE_MAP, 0.0, numberTree)
+    assert not inObs.any() and not arrivedPoint.any()
+    data, cost, inObs, arrivedPoint = sim.checkPrimitives_batch(rollouts, MAP, numberTree)
+
+    assert_matches_loop(data, cost, inObs, arrivedPoint, reference)
+
+
+def test_obstacle_checker_batch_matches_scalar():
+    rng = np.random.default_rng(0)
+    states = np.zeros((500, 19))
+    states[:, 0:3] = rng.uniform([-2, -2, -5.5], [3, 2, 0.5], (500, 3))
+    q = rng.normal(size=(500, 4))
+    states[:, 3:7] = q / np.linalg.norm(q, axis=1, keepdims=True)
+    # Some points right in the goal and start areas
+    states[0:50, 0:3] = np.array(MAP["goal_pixel"]) + rng.uniform(-0.3, 0.3, (50, 3))
+    states[50:100, 0:3] = np.array(MAP["start_pos"]) + rng.uniform(-0.3, 0.3, (50, 3))
+
+    pointA, pointB = compute_AB_points_batch(states)
+    assert np.allclose(pointA, [compute_A_point_forward(x) for x in states], atol=1e-12)
+    assert np.allclose(pointB, [compute_B_point_backward(x) for x in states], atol=1e-12)
+
+    outside = IsOutsideTheMap_batch(states[:, 0:3], MAP)
+    assert outside.any() and not outside.all()
+    assert np.array_equal(outside, [IsOutsideTheMap(*x[0:3], MAP) for x in states])
+
+    for numberTree in (1, 2):
+        inGoal = arrived_batch(states[:, 0:3], MAP, numberTree)
+        assert inGoal.any() and not inGoal.all()
+        assert np.array_equal(inGoal, [arrived(x[0:3], MAP, numberTree) for x in states])
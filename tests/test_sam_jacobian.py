@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from smarc_modelling.apps.benchmark_dynamics import random_states, max_rel_error
+from smarc_modelling.vehicles.SAM import SAM
+from smarc_modelling.vehicles.SAM_jacobian import SAMJacobian, check_jacobians
+from smarc_modelling.vehicles.SAM_kernel import pack_parameters
+
+N_STATES = 50
+
+
+def tuned_sam():
+    sam = SAM(0.01, V_current=0.3, beta_current=45)
+    sam.inertia_factor = 5.0
+    sam.damping_factor = 60.0
+    sam.damping_rot = 3.0
+    return sam
+
+
+@pytest.mark.parametrize("make_sam", [lambda: SAM(0.01), tuned_sam])
+def test_check_jacobians_on_random_states(make_sam):
+    X, U = random_states(N_STATES, seed=2)
+
+    errors = check_jacobians(make_sam(), X, U)
+
+    assert errors["x_dot"] < 1e-12
+    assert errors["A"] < 1e-6 and errors["B"] < 1e-6
+
+
+def test_jacobians_with_parameters_per_operating_point():
+    X, U = random_states(2, seed=3)
+    sams = [SAM(0.01), tuned_sam()]
+    P = np.array([pack_parameters(sam) for sam in sams])
+
+    X_dot, A, B = SAMJacobian(SAM(0.01)).evaluate(X, U, P)
+
+    for k, sam in enumerate(sams):
+        X_dot_ref, A_ref, B_ref = SAMJacobian(sam).evaluate(X[k], U[k])
+        assert max_rel_error(X_dot[k], sam.dynamics(X[k], U[k])) < 1e-12
+        assert np.allclose(A[k], A_ref[0], rtol=1e-12, atol=1e-12)
+        assert np.allclose(B[k], B_ref[0], rtol=1e-12, atol=1e-12)
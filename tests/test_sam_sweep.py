@@ -0,0 +1,88 @@
+import os
+
+import numpy as np
+import pytest
+
+from smarc_modelling.lib.integrators import simulate
+from smarc_modelling.sam_sweep import SWEEP_PARAMETERS, grid, load_results, monte_carlo, run_sweep
+from smarc_modelling.vehicles.SAM import SAM
+
+DT = 0.01
+N_STEPS = 50
+
+
+def initial_state():
+    x0 = np.zeros(19)
+    x0[2] = -1
+    x0[3] = 1.0
+    x0[13] = 50
+    x0[14] = 50
+    return x0
+
+
+def control_schedule():
+    u = np.zeros((N_STEPS-1, 6))
+    u[:, 0] = 60
+    u[:, 1] = 40
+    u[:, 2] = np.deg2rad(5)
+    u[:, 3] = -np.deg2rad(5)
+    u[:, 4] = 1000
+    u[:, 5] = 1000
+    return u
+
+
+def serial_run(params, x0, u):
+    '''
+    One plain SAM simulation with the parameters of a row of the sweep
+    '''
+    sam = SAM(DT, V_current=params["V_current"], beta_current=params["beta_current"])
+    sam.inertia_factor = params["inertia_factor"]
+    sam.damping_factor = params["damping_factor"]
+    sam.damping_rot = params["damping_rot"]
+    return simulate(sam.dynamics, x0, u, DT, N_STEPS, update_dt=sam.update_dt)
+
+
+def test_sweep_matches_serial_runs(tmp_path):
+    x0 = initial_state()
+    u = control_schedule()
+    params = grid(damping_factor=[40, 80], V_current=0.2, beta_current=30)
+    x_ref = serial_run(params[0], x0, u)
+
+    path = str(tmp_path / "sweep")
+    stats = run_sweep(params, x0, u, DT, path, x_ref=x_ref, n_workers=2, verbose=False)
+    res = load_results(path)
+
+    assert stats["n_sims"] == 2
+    assert set(res) == set(SWEEP_PARAMETERS) | {"done", "finite", "rmse", "wall_time", "x_final", "x"}
+    assert res["done"].all() and res["finite"].all()
+    assert res["x"].shape == (2, N_STEPS, 19)
+    for i in range(2):
+        x = serial_run(params[i], x0, u)
+        for name in SWEEP_PARAMETERS:
+            assert res[name][i] == params[name][i]
+        assert np.allclose(res["x"][i], x, rtol=1e-10, atol=1e-12)
+        assert np.array_equal(res["x_final"][i], res["x"][i, -1])
+    assert res["rmse"][0] < 1e-10 < res["rmse"][1]
+
+
+def test_sweep_without_trajectories(tmp_path):
+    x0 = initial_state()
+    u = control_schedule()
+    params = monte_carlo(2, damping_factor=(40, 80))
+    path = str(tmp_path / "sweep")
+
+    run_sweep(params, x0, u, DT, path, n_workers=1, verbose=False)
+    run_sweep(params, x0, u, DT, path, n_workers=1, store_trajectory=False, verbose=False)
+    res = load_results(path)
+
+    # The trajectories of the first sweep are gone
+    assert "x" not in res and not os.path.exists(os.path.join(path, "x.npy"))
+    assert np.isnan(res["rmse"]).all()
+    assert np.allclose(res["x_final"][1], serial_run(params[1], x0, u)[-1], rtol=1e-10, atol=1e-12)
+
+
+def test_unknown_parameters_raise():
+    with pytest.raises(ValueError, match="vbs_factor"):
+        grid(vbs_factor=[0.2, 0.5])
+    with pytest.raises(ValueError, match="vbs_factor"):
+        monte_carlo(2, vbs_factor=(0.2, 0.5))
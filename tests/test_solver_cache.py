@@ -0,0 +1,112 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from casadi import MX, SX, Function, vertcat
+
+SOLVER_CACHE = "smarc_modelling.motion_planning.MotionPrimitives.SolverCache"
+
+
+@pytest.fixture
+def solver_cache(import_without_acados):
+    return import_without_acados(SOLVER_CACHE)
+
+
+def make_ocp(N=10, tf=2.0, W=(1.0, 2.0, 0.1), nlp_solver_type="SQP", lbx=(-1.0,)):
+    '''
+    The parts of an AcadosOcp that ocp_key reads, for a small linear model
+    '''
+    x = SX.sym("x", 2)
+    xdot = SX.sym("xdot", 2)
+    u = SX.sym("u", 1)
+    p = SX.sym("p", 2)
+    model = SimpleNamespace(name="test_model", x=x, xdot=xdot, u=u, p=p,
+                            f_impl_expr=xdot - vertcat(x[1], u),
+                            cost_y_expr=vertcat(x - p, u), cost_y_expr_e=x - p)
+    options = SimpleNamespace(N_horizon=N, tf=tf, qp_solver="PARTIAL_CONDENSING_HPIPM", hpipm_mode="SPEED",
+                              hessian_approx="GAUSS_NEWTON", integrator_type="IRK", sim_method_newton_iter=3,
+                              nlp_solver_type=nlp_solver_type, nlp_solver_max_iter=100, tol=1e-6, qp_tol=1e-6,
+                              globalization="FIXED_STEP", regularize_method="NO_REGULARIZE")
+    cost = SimpleNamespace(cost_type="NONLINEAR_LS", cost_type_e="NONLINEAR_LS", W=np.diag(W), W_e=np.diag(W[0:2]),
+                           yref=np.zeros(3))
+    constraints = SimpleNamespace(idxbx=np.array([0]), idxbx_e=None, idxbu=np.array([0]), lbx=np.array(lbx),
+                                  x0=np.zeros(2))
+    return SimpleNamespace(model=model, solver_options=options, cost=cost, constraints=constraints)
+
+
+def test_same_ocp_same_key(solver_cache):
+    key = solver_cache.ocp_key(make_ocp())
+
+    assert key == solver_cache.ocp_key(make_ocp())
+    assert len(key) == 16
+
+
+def test_runtime_values_do_not_change_the_key(solver_cache):
+    ocp = make_ocp()
+    ocp.cost.yref = np.ones(3)
+    ocp.constraints.x0 = np.ones(2)
+
+    assert solver_cache.ocp_key(ocp) == solver_cache.ocp_key(make_ocp())
+    assert solver_cache.ocp_key(make_ocp(lbx=(-5.0,))) == solver_cache.ocp_key(make_ocp())
+
+
+@pytest.mark.parametrize("change", [dict(W=(1.0, 3.0, 0.1)), dict(N=12), dict(tf=3.0), dict(nlp_solver_type="SQP_RTI")])
+def test_compiled_values_change_the_key(solver_cache, change):
+    assert solver_cache.ocp_key(make_ocp(**change)) != solver_cache.ocp_key(make_ocp())
+
+
+def test_changed_expression_changes_the_key(solver_cache):
+    ocp = make_ocp()
+    ocp.model.f_impl_expr = ocp.model.xdot - vertcat(ocp.model.x[1], 2*ocp.model.u)
+
+    assert solver_cache.ocp_key(ocp) != solver_cache.ocp_key(make_ocp())
+
+
+class MockSolver:
+    def __init__(self, N):
+        self.N = N
+        self.values = {}
+
+    def set(self, stage, field, value):
+        self.values[(stage, field)] = np.array(value)
+
+
+def test_horizon_bucket(solver_cache, monkeypatch):
+    monkeypatch.setattr(solver_cache.glbv, "HORIZON_BUCKETS", (40, 11, 20))
+
+    assert [solver_cache.horizon_bucket(N) for N in (1, 11, 12, 20, 21, 40)] == [11, 11, 20, 20, 40, 40]
+    # Longer horizons than all the buckets get their own solver
+    assert solver_cache.horizon_bucket(41) == 41
+
+
+@pytest.mark.parametrize("N", [7, 20])
+def test_set_effective_horizon(solver_cache, N):
+    solver = MockSolver(20)
+    solver_cache.set_effective_horizon(solver, N)
+
+    # time_scale of every stage including the terminal one, 1 for the first N stages and 0 in the padding
+    time_scale = [solver.values[(stage, "p")] for stage in range(21)]
+    assert all(value.shape == (1,) for value in time_scale)
+    assert np.array_equal(np.concatenate(time_scale), np.r_[np.ones(N), np.zeros(21 - N)])
+    assert set(field for _, field in solver.values) == {"p"}
+
+
+@pytest.mark.parametrize("sym", [SX, MX])
+def test_add_time_scale(solver_cache, sym):
+    x = sym.sym("x", 2)
+    xdot = sym.sym("xdot", 2)
+    u = sym.sym("u", 1)
+    model = SimpleNamespace(x=x, xdot=xdot, u=u, p=sym.sym("p", 0), f_expl_expr=vertcat(x[1], u))
+
+    model = solver_cache.add_time_scale(model)
+
+    assert model.p.numel() == 1 and model.p.name() == "time_scale"
+    f_expl = lambda *args: Function("f_expl", [x, u, model.p], [model.f_expl_expr])(*args).full().ravel()
+    f_impl = lambda *args: Function("f_impl", [x, xdot, u, model.p], [model.f_impl_expr])(*args).full().ravel()
+    x0, xdot0, u0 = np.array([1.0, 2.0]), np.array([0.5, -1.0]), np.array([3.0])
+
+    # Scaled dynamics in the first stages, frozen state in the padding
+    assert np.allclose(f_expl(x0, u0, 1.0), [2.0, 3.0])
+    assert np.allclose(f_expl(x0, u0, 0.0), 0)
+    assert np.allclose(f_impl(x0, xdot0, u0, 1.0), xdot0 - [2.0, 3.0])
+    assert np.allclose(f_impl(x0, xdot0, u0, 0.0), xdot0)
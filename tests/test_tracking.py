@@ -0,0 +1,238 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from smarc_modelling.control.tracking import TrackingLoop
+
+N = 3
+NX = 2
+NU = 1
+
+
+class MockSolverWithoutFlat:
+    '''
+    The parts of AcadosOcpSolver that TrackingLoop uses, of an older acados without set_flat and get_flat. Every solve()
+    returns a new, recognizable solution and the next status of the given list.
+    '''
+    def __init__(self, statuses=(), nlp_solver_type="SQP_RTI"):
+        self.N = N
+        self.statuses = list(statuses)
+        self.acados_ocp = SimpleNamespace(solver_options=SimpleNamespace(nlp_solver_type=nlp_solver_type))
+        self.calls = []
+        self.n_solves = 0
+        self.rti_phase = None
+        self.X = np.zeros((N + 1, NX))
+        self.U = np.zeros((N, NU))
+
+    def get(self, stage, field):
+        return (self.X if field == "x" else self.U)[stage].copy()
+
+    def set(self, stage, field, value):
+        self.calls.append(("set", stage, field, np.array(value, dtype=float)))
+
+    def options_set(self, name, value):
+        self.calls.append(("options_set", name, value))
+        if name == "rti_phase":
+            self.rti_phase = value
+
+    def solve(self):
+        self.calls.append(("solve", self.rti_phase))
+        self.n_solves += 1
+        self.X = 100*self.n_solves + np.arange((N + 1) * NX, dtype=float).reshape(N + 1, NX)
+        self.U = -100*self.n_solves - np.arange(N * NU, dtype=float).reshape(N, NU)
+        return self.statuses.pop(0) if self.statuses else 0
+
+    def get_stats(self, name):
+        return 0.001
+
+
+class MockSolver(MockSolverWithoutFlat):
+    def get_flat(self, field):
+        return (self.X if field == "x" else self.U).ravel().copy()
+
+    def set_flat(self, field, values):
+        self.calls.append(("set_flat", field, np.array(values, dtype=float)))
+
+    def flat_values(self, field):
+        '''
+        The values of all the set_flat calls of a field, reshaped per stage
+        '''
+        return [call[2].reshape(-1, {"p": NX + NU, "x": NX, "u": NU}[field]) for call in self.calls
+                if call[0] == "set_flat" and call[1] == field]
+
+
+class MockIntegrator:
+    def __init__(self):
+        self.calls = []
+
+    def simulate(self, x, u):
+        self.calls.append((np.array(x), np.array(u)))
+        return x + 0.1
+
+
+def reference_trajectory(n=5):
+    return np.column_stack([np.arange(n), 10 + np.arange(n)]).astype(float)
+
+
+def test_reference_window_repeats_the_last_row():
+    tracker = TrackingLoop(MockSolver(), MockIntegrator())
+    reference = np.arange(5 * (NX + NU), dtype=float).reshape(5, NX + NU)
+
+    assert np.array_equal(tracker.reference_window(reference, 0), reference[0:N + 1])
+    assert np.array_equal(tracker.reference_window(reference, 3), reference[[3, 4, 4, 4]])
+
+
+def test_simulate_sets_windows_and_shifted_warm_start():
+    solver = MockSolver()
+    tracker = TrackingLoop(solver, MockIntegrator())
+    trajectory = reference_trajectory()
+
+    simX, simU, status = tracker.simulate(trajectory)
+
+    assert status == 0 and simX.shape == (6, NX) and simU.shape == (5, NU)
+    full = np.concatenate((trajectory, np.zeros((5, NU))), axis=1)
+
+    # The references of all the N+1 stages in one call per step
+    windows = solver.flat_values("p")
+    assert len(windows) == 5
+    for i, window in enumerate(windows):
+        assert np.array_equal(window, tracker.reference_window(full, i))
+
+    # Cold start with the initial state, then the previous solution shifted by one stage with the current state first
+    X = solver.flat_values("x")
+    U = solver.flat_values("u")
+    assert np.array_equal(X[0], np.tile(simX[0], (N + 1, 1)))
+    assert np.array_equal(U[0], np.zeros((N, NU)))
+    for i in range(1, 5):
+        X_prev = 100*i + np.arange((N + 1) * NX, dtype=float).reshape(N + 1, NX)
+        U_prev = -100*i - np.arange(N * NU, dtype=float).reshape(N, NU)
+        assert np.array_equal(X[i][0], simX[i])
+        assert np.array_equal(X[i][1:], np.concatenate((X_prev[2:], X_prev[-1:])))
+        assert np.array_equal(U[i], np.concatenate((U_prev[1:], U_prev[-1:])))
+
+    # The first input of every solution is applied, and x0 is constrained to the current state
+    assert np.array_equal(simU[:, 0], -100*np.arange(1, 6))
+    bounds = [call for call in solver.calls if call[0] == "set" and call[2] in ("lbx", "ubx")]
+    assert len(bounds) == 10 and all(np.array_equal(call[3], simX[k // 2]) for k, call in enumerate(bounds))
+
+    # Every full step is a whole real-time iteration
+    assert [call[1] for call in solver.calls if call[0] == "solve"] == [0] * 5
+    assert tracker.timing()["steps"] == 5
+
+
+def test_simulate_without_set_flat():
+    solver = MockSolverWithoutFlat()
+    tracker = TrackingLoop(solver, MockIntegrator())
+    simX, simU, _ = tracker.simulate(reference_trajectory())
+
+    # Same references per stage
+    p = [call for call in solver.calls if call[0] == "set" and call[2] == "p"]
+    assert len(p) == 5 * (N + 1)
+    assert np.array_equal(p[N + 1][3], np.array([1.0, 11.0, 0.0]))
+    assert np.array_equal(simU[:, 0], -100*np.arange(1, 6))
+
+
+def test_failed_solve_is_applied_by_default():
+    solver = MockSolver(statuses=[0, 4])
+    integrator = MockIntegrator()
+    tracker = TrackingLoop(solver, integrator)
+
+    simX, simU, status = tracker.simulate(reference_trajectory())
+
+    assert status == 0 and simX.shape == (6, NX) and simU.shape == (5, NU)
+    assert len(integrator.calls) == 5
+    assert tracker.status == [0, 4, 0, 0, 0] and tracker.timing()["failed"] == 1
+
+
+def test_stop_on_failure():
+    solver = MockSolver(statuses=[0, 4])
+    integrator = MockIntegrator()
+    tracker = TrackingLoop(solver, integrator)
+
+    simX, simU, status = tracker.simulate(reference_trajectory(), stop_on_failure=True)
+
+    # The input of the failed step is not applied
+    assert status == 4
+    assert simX.shape == (2, NX) and simU.shape == (1, NU)
+    assert len(integrator.calls) == 1
+    assert np.allclose(simX[1], simX[0] + 0.1)
+
+
+@pytest.mark.parametrize("nlp_solver_type", ["SQP", None])
+def test_full_step_of_sqp_solver_leaves_the_rti_phase(nlp_solver_type):
+    solver = MockSolver(nlp_solver_type=nlp_solver_type)
+    tracker = TrackingLoop(solver, MockIntegrator())
+    tracker.simulate(reference_trajectory())
+
+    assert not tracker.rti
+    assert not any(call[0] == "options_set" for call in solver.calls)
+
+
+def test_rti_phases_in_simulate():
+    solver = MockSolver()
+    tracker = TrackingLoop(solver, MockIntegrator(), rti_phases=True)
+    trajectory = reference_trajectory()
+    full = np.concatenate((trajectory, np.zeros((5, NU))), axis=1)
+
+    simX, simU, status = tracker.simulate(trajectory)
+
+    # Preparation then feedback at every step, the next step is prepared after the input is applied
+    assert [call[1] for call in solver.calls if call[0] == "solve"] == [1, 2] * 5
+    assert np.array_equal(simU[:, 0], -100*np.arange(2, 11, 2))
+    for i, window in enumerate(solver.flat_values("p")):
+        assert np.array_equal(window, tracker.reference_window(full, i))
+
+    # The state is only set in the feedback phase, after the preparation
+    for k, call in enumerate(solver.calls):
+        if call[0] == "set" and call[2] == "lbx":
+            assert solver.calls[k + 2] == ("options_set", "rti_phase", 2)
+
+    # Bookkeeping: one preparation and one feedback time per step, the step time is their sum
+    assert len(tracker.preparation_time) == len(tracker.feedback_time) == len(tracker.step_time) == 5
+    assert np.allclose(tracker.step_time, np.add(tracker.preparation_time, tracker.feedback_time))
+    assert np.allclose(tracker.solver_time, 0.002)
+    assert not tracker.prepared
+
+
+def test_prepare_warm_starts_from_the_predicted_state():
+    solver = MockSolver()
+    tracker = TrackingLoop(solver, MockIntegrator(), rti_phases=True)
+    full = np.concatenate((reference_trajectory(), np.zeros((5, NU))), axis=1)
+    x0 = np.array([0.0, 10.0])
+
+    tracker.step(x0, tracker.reference_window(full, 0))
+    X_prev = solver.X.copy()
+    tracker.prepare(tracker.reference_window(full, 1))
+
+    # Without a state the shifted previous solution is kept as it is
+    assert tracker.prepared
+    assert np.array_equal(solver.flat_values("x")[-1], np.concatenate((X_prev[1:], X_prev[-1:])))
+    assert solver.calls[-1] == ("solve", 1)
+
+
+def test_failed_preparation_is_reported_by_the_feedback():
+    solver = MockSolver(statuses=[3, 0])
+    tracker = TrackingLoop(solver, MockIntegrator(), rti_phases=True)
+    full = np.concatenate((reference_trajectory(), np.zeros((5, NU))), axis=1)
+
+    tracker.prepare(tracker.reference_window(full, 0), np.array([0.0, 10.0]))
+    _, status = tracker.feedback(np.array([0.0, 10.0]))
+
+    assert status == 3 and tracker.status == [3]
+
+
+def test_full_step_after_feedback_resets_the_rti_phase():
+    solver = MockSolver()
+    tracker = TrackingLoop(solver, MockIntegrator())
+    full = np.concatenate((reference_trajectory(), np.zeros((5, NU))), axis=1)
+    x0 = np.array([0.0, 10.0])
+
+    # Split iteration, then a full one on the same solver
+    tracker.prepare(tracker.reference_window(full, 0), x0)
+    tracker.feedback(x0)
+    assert solver.rti_phase == 2
+    tracker.step(x0, tracker.reference_window(full, 1))
+
+    assert [call[1] for call in solver.calls if call[0] == "solve"] == [1, 2, 0]
+    assert len(tracker.feedback_time) == 1 and len(tracker.step_time) == 2